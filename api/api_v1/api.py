@@ -20,5 +20,17 @@ router.include_router(suggestion_predict_router)
 from .endpoints.labeledText_api import router as labeledText_api_router
 router.include_router(labeledText_api_router)
 
+from .endpoints.labeledText_import_api import router as labeledText_import_api_router
+router.include_router(labeledText_import_api_router)
+
+from .endpoints.labeledText_export_api import router as labeledText_export_api_router
+router.include_router(labeledText_export_api_router)
+
 from .endpoints.label_train import router as label_train_router
 router.include_router(label_train_router)
+
+from .endpoints.admin_api import router as admin_api_router
+router.include_router(admin_api_router)
+
+from .endpoints.label_statistics_api import router as label_statistics_api_router
+router.include_router(label_statistics_api_router)
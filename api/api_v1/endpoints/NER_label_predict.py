@@ -8,6 +8,7 @@ from pydantic import BaseModel
 from typing import Any, Dict, AnyStr, List, Union
 from db.mongodb import get_database
 from core.config import DATABASE_NAME, LABEL_COLLECTION
+from utils.label_catalog import asyncio_get_label_catalog, asyncio_update_label_catalog_version
 
 JSONObject = Dict[AnyStr, Any]
 JSONArray = List[Any]
@@ -106,9 +107,8 @@ class specify_NER_labelText_model_version_body(BaseModel):
 async def specify_NER_labelText_model_version(response: Response, data: specify_NER_labelText_model_version_body):
     mongo_client = await get_database()
     col = mongo_client[DATABASE_NAME][LABEL_COLLECTION]
-    result = await col.find_one({
-        "label_name": data.label_name
-    })
+    catalog = await asyncio_get_label_catalog()
+    result = catalog.get_label(data.label_name)
     if result == None:
         response.status_code = status.HTTP_404_NOT_FOUND
         return {
@@ -134,6 +134,7 @@ async def specify_NER_labelText_model_version(response: Response, data: specify_
             "adapter.current_filename": data.model_version
         }})
     if result.modified_count:
+        await asyncio_update_label_catalog_version()
         response.status_code = status.HTTP_200_OK
         return {
             "message": "OK",
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Response, status
+
+from core.config import DATABASE_NAME
+from db.mongodb import get_database
+from db.indexes import INDEXES, create_indexes
+
+router = APIRouter()
+ADMIN_API_TAGS = ["Admin"]
+
+
+@router.get("/admin/indexes", tags = ADMIN_API_TAGS)
+async def get_index_usage_statistics(response: Response):
+    """# Index usage of every managed collection
+    "ops" is how many times an index was used since "since" (server restart or index creation).
+    "missing" lists the defined indexes not found in the DB."""
+    mongo_client = await get_database()
+    database = mongo_client[DATABASE_NAME]
+    result = {}
+    for collection_name, indexes in INDEXES.items():
+        stats = database[collection_name].aggregate([{"$indexStats": {}}])
+        stats = await stats.to_list(None)
+        existing = {stat["name"] for stat in stats}
+        result[collection_name] = {
+            "indexes": [{
+                "name": stat["name"],
+                "key": stat["key"],
+                "ops": stat["accesses"]["ops"],
+                "since": stat["accesses"]["since"],
+            } for stat in stats],
+            "missing": [index["name"] for index in indexes if index["name"] not in existing],
+        }
+    response.status_code = status.HTTP_200_OK
+    return result
+
+
+@router.post("/admin/indexes", tags = ADMIN_API_TAGS)
+async def create_missing_indexes(response: Response):
+    """Create the defined indexes again, EX: after the dedup job fixed duplicated data."""
+    mongo_client = await get_database()
+    failed = await create_indexes(mongo_client[DATABASE_NAME])
+    if failed:
+        response.status_code = status.HTTP_409_CONFLICT
+        return {
+            "message": "Failed, some indexes can't be created, check the API logs.",
+            "failed": failed,
+        }
+    response.status_code = status.HTTP_200_OK
+    return {
+        "message": "Success"
+    }
@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+
+from utils.label_statistics import asyncio_get_label_statistics
+
+router = APIRouter()
+LABEL_API_TAGS = ["Label"]
+
+
+@router.get("/labels:statistics", tags = LABEL_API_TAGS)
+async def get_label_statistics(refresh: bool = False):
+    """# Label statistics of the training dataset
+    Per label sentence and token counts, "positive_ratio" (token count / all tokens),
+    "sentence_ratio" (sentence count / all sentences) and "co_occurrence",
+    the sentence count of every label pair labeled in the same sentence.
+
+    Cached, and only the new sentences are counted after an insert.
+    Use refresh = true to count everything again."""
+    statistics = await asyncio_get_label_statistics(refresh)
+    return statistics.to_dict()
@@ -26,6 +26,7 @@ from typing import Any, Dict, AnyStr, List, Union
 from datetime import datetime
 from db.utils import convert_mongo_id
 from utils.trainer_communicate import set_trainer_restart_required
+from utils.label_catalog import asyncio_get_label_catalog
 
 JSONObject = Dict[AnyStr, Any]
 JSONArray = List[Any]
@@ -45,9 +46,9 @@ async def train_specific_NER_label(body: train_specific_NER_label_body, response
 
     # Check if have this label name in DB
     mongo_client = await get_database()
-    label_define_col = mongo_client[DATABASE_NAME][LABEL_COLLECTION]
+    catalog = await asyncio_get_label_catalog()
 
-    label = await label_define_col.find_one({"label_name": body.label_name})
+    label = catalog.get_label(body.label_name)
     if label == None:
         response.status_code = status_code.HTTP_404_NOT_FOUND
         return {
@@ -1,5 +1,5 @@
 from inspect import trace
-from fastapi import APIRouter, Depends, status, Response
+from fastapi import APIRouter, Depends, status, Response, Request
 
 from typing import Optional
 
@@ -16,6 +16,12 @@ from core.config import (
     Feedback_Suggestion_Collection,
     LABEL_COLLECTION,
     LABEL_TRAIN_JOB_COLLECTION,
+    CONFIG_COLLECTION,
+    LABEL_DATA_COUNT_COLLECTION,
+    LABELED_DATA_QUERY_MAX_TIME_MS,
+    CUSTOM_FILTER_COLLECTION_SCAN,
+    CUSTOM_FILTER_FORBIDDEN_OPERATORS,
+    LABEL_DICTIONARY_NAME,
 )
 from db.mongodb import AsyncIOMotorClient, get_database
 from bson.objectid import ObjectId
@@ -23,8 +29,12 @@ import asyncio
 from typing import Any, Dict, AnyStr, List, Union
 from datetime import datetime
 from db.utils import convert_mongo_id
+from db.query_plan import find_operators, get_plan_summary
+from pymongo.errors import ExecutionTimeout, OperationFailure
 from utils.trainer_communicate import asyncio_update_db_last_modify_time, set_trainer_restart_required
+from utils.label_catalog import asyncio_get_label_catalog, asyncio_update_label_catalog_version
 import re
+import logging
 JSONObject = Dict[AnyStr, Any]
 JSONArray = List[Any]
 JSONStructure = Union[JSONArray, JSONObject]
@@ -81,6 +91,8 @@ async def define_new_label(response: Response, data: create_new_label_body):
         }
         try:
             result = await col.insert_one(dataToStore)
+            await asyncio_update_label_catalog_version()
+            await set_label_data_count(data.label_name, data.inherit)
             response.status_code = status.HTTP_201_CREATED
             return {
                 "message": f"Success, new label {data.label_name} added."
@@ -92,22 +104,44 @@ async def define_new_label(response: Response, data: create_new_label_body):
             }
 
 @router.get("/labels", tags = LABEL_API_TAGS)
-async def get_all_label():
-    mongo_client = await get_database()
-    label_define_col = mongo_client[DATABASE_NAME][LABEL_COLLECTION]
+async def get_all_label(request: Request, response: Response):
+    """Return 304 Not Modified if If-None-Match has the current ETag."""
+    catalog = await asyncio_get_label_catalog()
+    etag = f'"labels-{catalog.version}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
 
-    labels = await label_define_col.find({}, {"_id": False}).to_list(None)
+    labels = catalog.get_labels()
+    for label in labels:
+        del label["_id"]
     return labels
 
 
 
+@router.get("/labels:counts", tags = LABEL_API_TAGS)
+async def get_all_label_data_counts(response: Response):
+    """Sentence and token count of every label in the training dataset.
+    If updating the counts failed after a write, they are stale and the
+    X-Label-Counts-Stale-Since header is set, until
+    python -m utils.labeled_data_maintenance count rebuilds them."""
+    mongo_client = await get_database()
+    label_count_col = mongo_client[DATABASE_NAME][LABEL_DATA_COUNT_COLLECTION]
+    config_col = mongo_client[DATABASE_NAME][CONFIG_COLLECTION]
+    config = await config_col.find_one({"collection_name": LABEL_DATA_COUNT_COLLECTION}) or {}
+    if config.get("stale_since"):
+        response.headers["X-Label-Counts-Stale-Since"] = config["stale_since"].isoformat()
+    counts = await label_count_col.find({}, {"_id": False}).to_list(None)
+    return {count.pop("label_name"): count for count in counts}
+
+
 @router.get("/labels/{label_name}", tags = LABEL_API_TAGS)
 async def get_label_by_name(label_name, response: Response):
     mongo_client = await get_database()
-    label_define_col = mongo_client[DATABASE_NAME][LABEL_COLLECTION]
-    label_data_col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
+    catalog = await asyncio_get_label_catalog()
 
-    label = await label_define_col.find_one({"label_name": label_name})
+    label = catalog.get_label(label_name)
     if label == None:
         response.status_code = status.HTTP_404_NOT_FOUND
         return {
@@ -115,14 +149,10 @@ async def get_label_by_name(label_name, response: Response):
         }
     label = convert_mongo_id(label)
 
-    texts = label_data_col.find(
-        {"text_and_labels.labels": {"$in": [label_name] + label["inherit"]}},
-        {"text_and_labels": False}
-    )
-    texts = await texts.to_list(None)
-    texts_count = len(texts)
-
-    label["data_count"] = texts_count
+    # Distinct sentences with any of its labels, kept by the label counts.
+    label_count_col = mongo_client[DATABASE_NAME][LABEL_DATA_COUNT_COLLECTION]
+    count = await label_count_col.find_one({"label_name": label_name}, {"data_count": True})
+    label["data_count"] = (count or {}).get("data_count", 0)
 
     label["description(auto_generated)"] = f"""Label "{label["label_name"]}" is to label out {label["label_name"]} in concerto contract. {label["label_name"]} also all the {label["inherit"]} labels in current and future dataset, and when training {label["alias_as"]}, text which labeled as Party will also be labeled positively. Currently, we have {label["data_count"]} datas contain this label in training dataset."""
     return label
@@ -161,82 +191,279 @@ class update_data_body(BaseModel):
         },
     ]
 
-from utils.tokenizer import tokenizer as roberta_tokenizer
+from utils.labeled_data import (
+    get_uploads_labels,
+    get_labeled_sentence_documents_of_uploads,
+    get_sentence_upserts,
+    get_sentence_upsert_result,
+)
+from utils.sentence_encoding import (
+    get_label_positions,
+    get_label_reservation_update,
+    get_label_position_updates,
+)
+from utils.label_counts import (
+    get_label_count_updates,
+    get_stale_counts_update,
+    get_data_count_filter,
+    get_data_count_update,
+)
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from concurrent.futures import ThreadPoolExecutor
+
+# Tokenizing big uploads is CPU bound, run it out of the event loop.
+# One worker is enough, the fast tokenizer batches in Rust,
+# and it should not be shared between threads at the same time.
+tokenize_executor = ThreadPoolExecutor(max_workers=1)
+
+async def run_in_tokenize_executor(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(tokenize_executor, func, *args)
+
+async def get_label_dictionary(uploads):
+    """{label: position} of the label dictionary, with the labels of
+    the valid uploads added. See utils.sentence_encoding.update_label_dictionary."""
+    mongo_client = await get_database()
+    config_col = mongo_client[DATABASE_NAME][CONFIG_COLLECTION]
+    label_positions = get_label_positions(
+        await config_col.find_one({"name": LABEL_DICTIONARY_NAME}))
+    new_labels = get_uploads_labels(uploads) - label_positions.keys()
+    if new_labels:
+        label_dictionary = await config_col.find_one_and_update(
+            *get_label_reservation_update(len(new_labels)),
+            upsert=True, return_document=ReturnDocument.AFTER)
+        await config_col.bulk_write(get_label_position_updates(
+            new_labels, label_dictionary["label_count"] - len(new_labels)), ordered=False)
+        label_positions = get_label_positions(
+            await config_col.find_one({"name": LABEL_DICTIONARY_NAME}))
+    return label_positions
+
+async def set_label_data_count(label_name, inherit):
+    """Count the data_count of a new label once, the writes after
+    the catalog version update keep it, see utils.label_counts."""
+    mongo_client = await get_database()
+    label_data_col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
+    label_count_col = mongo_client[DATABASE_NAME][LABEL_DATA_COUNT_COLLECTION]
+    data_count = await label_data_col.count_documents(get_data_count_filter(label_name, inherit))
+    await label_count_col.update_one(*get_data_count_update(label_name, data_count), upsert=True)
+
+async def update_label_counts(documents, sign = 1):
+    """Add (sign = 1) or remove (sign = -1) the documents from the label counts."""
+    catalog = await asyncio_get_label_catalog()
+    requests = get_label_count_updates(documents, sign, catalog.get_label_inherits())
+    if requests:
+        mongo_client = await get_database()
+        label_count_col = mongo_client[DATABASE_NAME][LABEL_DATA_COUNT_COLLECTION]
+        try:
+            await label_count_col.bulk_write(requests, ordered=False)
+        except Exception:
+            # The sentences are written already, see utils.label_counts.
+            logging.exception("Label counts not updated, they are stale until recounted.")
+            config_col = mongo_client[DATABASE_NAME][CONFIG_COLLECTION]
+            await config_col.update_one(*get_stale_counts_update(), upsert=True)
+
+async def upsert_labeled_sentence_documents(col, documents):
+    """Write with one unordered bulk_write, sentences already stored are skipped.
+    Return (duplicated positions, failed {position: error message})."""
+    if len(documents) == 0:
+        return set(), {}
+    try:
+        result = await col.bulk_write(get_sentence_upserts(documents), ordered=False)
+    except BulkWriteError as error:
+        return get_sentence_upsert_result(documents, error=error)
+    return get_sentence_upsert_result(documents, result=result)
 
 @router.post("/data/labeledText", tags = LABEL_API_TAGS, status_code=status.HTTP_200_OK)
 async def update_labeled_data(response: Response,
                               data: update_data_body,
                               refreash_trainer: bool = False):
-    sentences = []
-    current_sentence = []
-    # Split the texts by dot. 
-    # So avoid CUDA Out of Memory at training by too long texts.
-    # This won't affect NER model's performance.
-    for text in data.texts:
-        current_sentence.append(text)
-        if text == {'text': '.', 'labels': ['O']}:
-            # New Sentence, New data.
-            sentences.append(current_sentence)
-            current_sentence = []
-    sentences.append(current_sentence)
+    """Sentences already in the dataset (same words and labels) are not added again,
+    they are counted in duplicate_count."""
+    # todo: Check the label in text all included.
+    uploads = [data.dict()]
+    label_dictionary = await get_label_dictionary(uploads)
+    documents, = await run_in_tokenize_executor(
+        get_labeled_sentence_documents_of_uploads, uploads, label_dictionary)
+    if isinstance(documents, Exception):
+        response.status_code = status.HTTP_406_NOT_ACCEPTABLE
+        return {
+            "message": f"Fail, please check the Error Message",
+            "error_msg": str(documents)
+        }
     mongo_client = await get_database()
     col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
-    insert_ids = []
-    for sentence in sentences:
-        token_and_labels = []
-        last_word_index = len(sentence)-1
-        for i, text in enumerate(sentence):
-            if i != 0 and i != last_word_index:
-                text_to_do = " " + text["text"]
-            else:
-                text_to_do = text["text"]
-            tokens = roberta_tokenizer.tokenize(text_to_do)
-            for j, token in enumerate(tokens):
-                token_and_labels.append({
-                    "token": token,
-                    "labels": text["labels"]
-                })
-        dataToStore = {
-            "user": data.user,
-            "tags": data.tags,
-            "text_and_labels": sentence,
-            "token_and_labels": token_and_labels,
-            "TimeStamp": datetime.now(),
-        }
-        # todo: Check the label in text all included.
-        result = await col.insert_one(dataToStore)
-        insert_ids.append(str(result.inserted_id))
-    await asyncio_update_db_last_modify_time(NER_LABEL_COLLECTION)
+    duplicated, failed = await upsert_labeled_sentence_documents(col, documents)
+    inserted = [document for i, document in enumerate(documents)
+                if i not in failed and i not in duplicated]
+    insert_ids = [str(document["_id"]) for document in inserted]
+    if inserted:
+        await update_label_counts(inserted)
+        await asyncio_update_db_last_modify_time(NER_LABEL_COLLECTION)
 
     if refreash_trainer:
         await set_trainer_restart_required(True)
+    if failed:
+        response.status_code = status.HTTP_207_MULTI_STATUS
+        return {
+            "message": f"Add Partially Success, {len(failed)} sentences failed",
+            "insert_ids": insert_ids,
+            "duplicate_count": len(duplicated),
+            "errors": list(failed.values()),
+        }
     return {
         "message": "Add Success",
-        "insert_ids": insert_ids
+        "insert_ids": insert_ids,
+        "duplicate_count": len(duplicated),
     }
 
+class bulk_update_data_body(BaseModel):
+    documents: List[update_data_body] = [update_data_body()]
+
+@router.post("/data/labeledText:bulk", tags = LABEL_API_TAGS, status_code=status.HTTP_200_OK)
+async def bulk_update_labeled_data(response: Response,
+                                   data: bulk_update_data_body,
+                                   refreash_trainer: bool = False):
+    """Add many labeled documents at once.
+    All sentences are written with one unordered bulk_write, and the result
+    of each document is reported in the same order as the request."""
+    results = []
+    all_documents = []
+    owners = [] # which request document each sentence document belongs to
+    uploads = [document.dict() for document in data.documents]
+    label_dictionary = await get_label_dictionary(uploads)
+    all_sentence_documents = await run_in_tokenize_executor(
+        get_labeled_sentence_documents_of_uploads, uploads, label_dictionary)
+    for i, sentence_documents in enumerate(all_sentence_documents):
+        if isinstance(sentence_documents, Exception):
+            results.append({"message": "Failed", "insert_ids": [], "error_msg": str(sentence_documents)})
+            continue
+        results.append({"message": "Add Success", "insert_ids": [], "duplicate_count": 0})
+        all_documents += sentence_documents
+        owners += [i] * len(sentence_documents)
+
+    mongo_client = await get_database()
+    col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
+    duplicated, failed = await upsert_labeled_sentence_documents(col, all_documents)
+    inserted = []
+    for j, sentence_document in enumerate(all_documents):
+        result = results[owners[j]]
+        if j in failed:
+            result["message"] = "Failed"
+            result.setdefault("errors", []).append(failed[j])
+        elif j in duplicated:
+            result["duplicate_count"] += 1
+        else:
+            result["insert_ids"].append(str(sentence_document["_id"]))
+            inserted.append(sentence_document)
+    if inserted:
+        await update_label_counts(inserted)
+        await asyncio_update_db_last_modify_time(NER_LABEL_COLLECTION)
+
+    if refreash_trainer:
+        await set_trainer_restart_required(True)
+    failed_count = len([result for result in results if result["message"] == "Failed"])
+    if failed_count:
+        response.status_code = status.HTTP_207_MULTI_STATUS
+    return {
+        "message": "Add Success" if failed_count == 0 else f"{failed_count} documents failed",
+        "results": results,
+    }
+
+
+def get_labeled_data_projection(detail):
+    """detail: only the texts and tokens, else everything but them.
+    The binary "encoded" field is never returned."""
+    if detail:
+        return {"text_and_labels": True, "token_and_labels": True}
+    return {"text_and_labels": False, "token_and_labels": False, "encoded": False}
+
+def get_labeled_data_page_error(start, end, cursor):
+    """Message of an invalid page, None if it is valid."""
+    if cursor is not None and not ObjectId.is_valid(cursor):
+        return f"Invalid cursor {cursor!r}, use the next_cursor of the last page."
+    if not (end == -1 and start == -1) and end < start:
+        return f"end ({end}) must not be smaller than start ({start})."
+    return None
+
+def get_labeled_data_page_query(mongo_filter, start, end, cursor):
+    """(filter, skip, limit) of a page, limit is None for all documents."""
+    if end == -1 and start == -1: end = None
+    if cursor:
+        mongo_filter = {"$and": [mongo_filter, {"_id": {"$gt": ObjectId(cursor)}}]}
+    skip = start if start > 0 and not cursor else 0
+    limit = end - start if end is not None else None
+    return mongo_filter, skip, limit
+
+async def find_labeled_data_page(mongo_filter, detail, start, end, cursor):
+    """Documents of mongo_filter sorted by _id, skip and limit done by Mongo.
+    With cursor (the next_cursor of the last page), the page starts
+    after that _id instead of skipping start documents, so every page costs the same.
+    Return (documents, next_cursor), next_cursor is None at the last page.
+    Raise ExecutionTimeout after LABELED_DATA_QUERY_MAX_TIME_MS."""
+    mongo_client = await get_database()
+    col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
+
+    mongo_filter, skip, limit = get_labeled_data_page_query(mongo_filter, start, end, cursor)
+    if limit is not None and limit <= 0:
+        return [], None
+    result = col.find(mongo_filter, get_labeled_data_projection(detail)).sort("_id", 1)
+    result = result.max_time_ms(LABELED_DATA_QUERY_MAX_TIME_MS)
+    if skip:
+        result = result.skip(skip)
+    if limit is not None:
+        result = result.limit(limit)
+
+    result = await result.to_list(None)
+    next_cursor = None
+    if limit is not None and len(result) == limit:
+        next_cursor = str(result[-1]["_id"])
+    result = list(map(convert_mongo_id, result))
+    return result, next_cursor
+
+async def explain_labeled_data_page(mongo_filter, start, end, cursor):
+    """Query plan summary of find_labeled_data_page, see db.query_plan.get_plan_summary."""
+    mongo_client = await get_database()
+    query_filter, skip, limit = get_labeled_data_page_query(mongo_filter, start, end, cursor)
+    find = {"find": NER_LABEL_COLLECTION, "filter": query_filter, "sort": {"_id": 1}}
+    if skip:
+        find["skip"] = skip
+    if limit:
+        find["limit"] = limit
+    explain = await mongo_client[DATABASE_NAME].command(
+        {"explain": find, "verbosity": "queryPlanner"},
+        maxTimeMS = LABELED_DATA_QUERY_MAX_TIME_MS)
+    return get_plan_summary(explain, mongo_filter)
 
 @router.get("/data/labeledText", tags = LABEL_API_TAGS)
 async def get_labeled_data(response: Response,
                            label_name: str = None,
                            detail: bool = False, 
                            start: int = 0, 
-                           end: int = 10):
-    if end == -1 and start == -1: end = None
-    mongo_client = await get_database()
-    col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
-    
-    result = col.find({"text_and_labels.labels": {"$in": [label_name]}},
-                      {"text_and_labels": detail, 
-                       "token_and_labels": detail})
-    
-    result = await result.to_list(end)
-    result = result[start:end]
-    result = list(map(convert_mongo_id,result))
+                           end: int = 10,
+                           cursor: str = None):
+    """Page with start and end, or with cursor: pass the next_cursor
+    of the response to get the next end - start documents."""
+    page_error = get_labeled_data_page_error(start, end, cursor)
+    if page_error:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {
+            "message": page_error
+        }
+    try:
+        result, next_cursor = await find_labeled_data_page(
+            {"text_and_labels.labels": {"$in": [label_name]}},
+            detail, start, end, cursor)
+    except ExecutionTimeout:
+        response.status_code = status.HTTP_504_GATEWAY_TIMEOUT
+        return {
+            "message": f"Query exceeded {LABELED_DATA_QUERY_MAX_TIME_MS} ms, use a cursor instead of a big start.",
+        }
     response.status_code = status.HTTP_200_OK
     return {
         "message": "Success",
-        "data": result
+        "data": result,
+        "next_cursor": next_cursor,
     }
 
 class custom_filter(BaseModel):
@@ -247,23 +474,68 @@ async def get_labeled_data_by_custom_filter(response: Response,
                            data: custom_filter,
                            detail: bool = False, 
                            start: int = 0, 
-                           end: int = 10):
-    if end == -1 and start == -1: end = None
-    mongo_client = await get_database()
-    col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
-    
-    result = col.find(data.mongo_filter,
-                      {"text_and_labels": detail, 
-                       "token_and_labels": detail})
-    
-    result = await result.to_list(end)
-    result = result[start:end]
-    result = list(map(convert_mongo_id,result))
+                           end: int = 10,
+                           cursor: str = None,
+                           explain: bool = False):
+    """Page with start and end, or with cursor: pass the next_cursor
+    of the response to get the next end - start documents.
+
+    The query stops after LABELED_DATA_QUERY_MAX_TIME_MS. A filter no index
+    can be used for scans the whole collection, it is rejected or warned
+    by CUSTOM_FILTER_COLLECTION_SCAN. explain = true returns the query plan
+    ("index_used", "indexes", "stages") with the data."""
+    forbidden = find_operators(data.mongo_filter, CUSTOM_FILTER_FORBIDDEN_OPERATORS)
+    if forbidden:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {
+            "message": f"Operators {sorted(forbidden)} are not allowed."
+        }
+    page_error = get_labeled_data_page_error(start, end, cursor)
+    if page_error:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {
+            "message": page_error
+        }
+
+    try:
+        plan = None
+        if explain or CUSTOM_FILTER_COLLECTION_SCAN != "allow":
+            plan = await explain_labeled_data_page(data.mongo_filter, start, end, cursor)
+        warning = None
+        if plan and plan["collection_scan"] and CUSTOM_FILTER_COLLECTION_SCAN != "allow":
+            warning = "No index can be used for this filter, the whole collection is scanned."
+            if CUSTOM_FILTER_COLLECTION_SCAN == "reject":
+                response.status_code = status.HTTP_400_BAD_REQUEST
+                return {
+                    "message": f"Rejected: {warning}",
+                    "explain": plan,
+                }
+            logging.warning(f"find:by:mongo:filter collection scan: {data.mongo_filter}")
+        result, next_cursor = await find_labeled_data_page(
+            data.mongo_filter, detail, start, end, cursor)
+    except ExecutionTimeout:
+        response.status_code = status.HTTP_504_GATEWAY_TIMEOUT
+        return {
+            "message": f"Query exceeded {LABELED_DATA_QUERY_MAX_TIME_MS} ms, use a filter an index can be used for.",
+            "explain": plan,
+        }
+    except OperationFailure as error:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {
+            "message": f"Invalid filter: {error}"
+        }
+
     response.status_code = status.HTTP_200_OK
-    return {
+    result = {
         "message": "Success",
-        "data": result
+        "data": result,
+        "next_cursor": next_cursor,
     }
+    if warning:
+        result["warning"] = warning
+    if explain:
+        result["explain"] = plan
+    return result
 
 @router.get("/data/labeledText/{_id}", tags = LABEL_API_TAGS)
 async def get_labeled_data_by_id(response: Response,
@@ -274,8 +546,7 @@ async def get_labeled_data_by_id(response: Response,
     col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
     
     result = await col.find_one({"_id": ObjectId(_id)},
-                                {"text_and_labels": detail, 
-                                 "token_and_labels": detail})
+                                get_labeled_data_projection(detail))
     if result:
         result["_id"] = str(result["_id"])
         response.status_code = status.HTTP_200_OK
@@ -295,8 +566,11 @@ async def delete_labeled_data_by_id(response: Response, _id):
     mongo_client = await get_database()
     col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
     
-    result = await col.delete_one({"_id": ObjectId(_id)})
-    if result.deleted_count:
+    result = await col.find_one_and_delete({"_id": ObjectId(_id)},
+                                           {"token_and_labels": True})
+    if result:
+        await update_label_counts([result], sign = -1)
+        await asyncio_update_db_last_modify_time(NER_LABEL_COLLECTION, deleted = True)
         response.status_code = status.HTTP_204_NO_CONTENT
         return response
     else:
@@ -0,0 +1,91 @@
+from fastapi import APIRouter, Query, Response, status
+from fastapi.responses import StreamingResponse
+
+import json
+import zlib
+from typing import List
+
+from core.config import (
+    DATABASE_NAME,
+    NER_LABEL_COLLECTION,
+    LABELED_DATA_EXPORT_BATCH_SIZE,
+)
+from db.mongodb import get_database
+
+router = APIRouter()
+LABEL_API_TAGS = ["Label"]
+
+# Binary, can't be written as JSON.
+UNEXPORTABLE_FIELDS = ["encoded"]
+
+
+def get_export_filter(labels, tags, user):
+    export_filter = {}
+    if labels:
+        export_filter["text_and_labels.labels"] = {"$in": labels}
+    if tags:
+        export_filter["tags"] = {"$in": tags}
+    if user:
+        export_filter["user"] = user
+    return export_filter
+
+
+def get_export_projection(fields):
+    """Projection of the fields, or of all exportable fields if fields is empty.
+    None if fields only has unexportable fields, an empty projection would return all."""
+    if fields:
+        if all(field in UNEXPORTABLE_FIELDS for field in fields):
+            return None
+        return {field: True for field in fields if field not in UNEXPORTABLE_FIELDS}
+    return {field: False for field in UNEXPORTABLE_FIELDS}
+
+
+async def generate_ndjson(cursor, compress):
+    """One JSON document per line, gzip compressed if compress.
+    Only one cursor batch is in memory at a time."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    lines = []
+    async for document in cursor:
+        lines.append(json.dumps(document, default=str, ensure_ascii=False))
+        if len(lines) == LABELED_DATA_EXPORT_BATCH_SIZE:
+            chunk = ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+            yield compressor.compress(chunk) if compressor else chunk
+    chunk = ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+    if compressor:
+        yield compressor.compress(chunk) + compressor.flush()
+    elif chunk:
+        yield chunk
+
+
+@router.get("/data/labeledText:export", tags = LABEL_API_TAGS)
+async def export_labeled_data(response: Response,
+                              labels: List[str] = Query([]),
+                              tags: List[str] = Query([]),
+                              user: str = None,
+                              fields: List[str] = Query([]),
+                              compress: bool = False):
+    """# Download the labeled dataset as NDJSON (JSON Lines)
+    - labels: only sentences with one of these labels.
+    - tags: only sentences with one of these tags.
+    - fields: only these fields, EX: `?fields=text_and_labels&fields=tags`. All fields if empty.
+    - compress: gzip the response (.jsonl.gz).
+
+    The documents are streamed from a Mongo cursor, so the server memory
+    doesn't grow with the dataset size."""
+    projection = get_export_projection(fields)
+    if projection is None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {
+            "message": f"Failed, fields {UNEXPORTABLE_FIELDS} can't be exported, choose other fields."
+        }
+    mongo_client = await get_database()
+    col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
+    cursor = col.find(get_export_filter(labels, tags, user), projection)
+    cursor = cursor.sort("_id", 1).batch_size(LABELED_DATA_EXPORT_BATCH_SIZE)
+    filename = f"{NER_LABEL_COLLECTION}.jsonl" + (".gz" if compress else "")
+    return StreamingResponse(
+        generate_ndjson(cursor, compress),
+        status_code=status.HTTP_200_OK,
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
@@ -0,0 +1,97 @@
+from fastapi import APIRouter, BackgroundTasks, Query, Request, Response, status
+
+import os
+import tempfile
+from typing import List
+from datetime import datetime
+from bson.objectid import ObjectId
+
+from core.config import (
+    DATABASE_NAME,
+    LABELED_DATA_IMPORT_JOB_COLLECTION,
+)
+from db.mongodb import get_database
+from utils.labeled_data_import import IMPORT_FORMATS, get_encoding_error, run_import_job
+
+router = APIRouter()
+LABEL_API_TAGS = ["Label"]
+
+
+@router.post("/data/labeledText:import", tags = LABEL_API_TAGS, status_code=status.HTTP_202_ACCEPTED)
+async def import_labeled_data(request: Request,
+                              response: Response,
+                              background_tasks: BackgroundTasks,
+                              file_format: str = "jsonl",
+                              user: str = "example@gmail.com",
+                              tags: List[str] = Query([]),
+                              encoding: str = "utf-8"):
+    """# Import a labeled corpus file in background
+    Send the file as the raw request body, EX:\n
+    `curl --data-binary @data.jsonl "/api/v1/data/labeledText:import?file_format=jsonl"`\n
+    file_format = ["jsonl", "csv"]\n
+    - jsonl: one body of POST /data/labeledText per line.
+    - csv: columns "Sentence #", "Word" and "newTag", labels joined by "|".
+
+    encoding must keep ASCII as is (utf-8, latin-1, cp1252 ...), lines that
+    do not decode are reported in the job errors.
+
+    Track the progress with GET /data/labeledText:import/{trace_id}."""
+    if file_format not in IMPORT_FORMATS:
+        response.status_code = status.HTTP_406_NOT_ACCEPTABLE
+        return {
+            "message": f"file_format must be in one of the {IMPORT_FORMATS}."
+        }
+    encoding_error = get_encoding_error(encoding)
+    if encoding_error:
+        response.status_code = status.HTTP_406_NOT_ACCEPTABLE
+        return {
+            "message": encoding_error
+        }
+    # Spool the body to disk, the job reads it back line by line.
+    fd, path = tempfile.mkstemp(suffix=f".{file_format}")
+    try:
+        received_bytes = 0
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+                received_bytes += len(chunk)
+
+        mongo_client = await get_database()
+        job_col = mongo_client[DATABASE_NAME][LABELED_DATA_IMPORT_JOB_COLLECTION]
+        result = await job_col.insert_one({
+            "status": "waiting",
+            "file_format": file_format,
+            "received_bytes": received_bytes,
+            "user": user,
+            "tags": tags,
+            "processed_documents": 0,
+            "failed_documents": 0,
+            "inserted_sentences": 0,
+            "duplicated_sentences": 0,
+            "errors": [],
+            "last_update_time": datetime.now(),
+            "add_time": datetime.now(),
+        })
+    except BaseException:
+        # No job will read the file, don't leave it in the temp dir.
+        os.remove(path)
+        raise
+    background_tasks.add_task(run_import_job, result.inserted_id, path,
+                              file_format, user, tags, encoding)
+    return {
+        "message": "Success, start importing.",
+        "trace_id": str(result.inserted_id),
+    }
+
+
+@router.get("/data/labeledText:import/{trace_id}", tags = LABEL_API_TAGS)
+async def track_labeled_data_import_status(trace_id: str, response: Response):
+    mongo_client = await get_database()
+    job_col = mongo_client[DATABASE_NAME][LABELED_DATA_IMPORT_JOB_COLLECTION]
+    job = await job_col.find_one({"_id": ObjectId(trace_id)}, {"_id": False})
+    if job == None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {
+            "message": f"trace_id {trace_id} Not Found."
+        }
+    return job
@@ -22,9 +22,8 @@ class classify_template_body(BaseModel):
 
 @router.post("/models/classify/template", tags = TAG_OF_TEMPLATE_CLASSIFY_API)
 def classify_template(response: Response, data: classify_template_body):
-    predictions = model.classify(data.text)
-    if data.return_max_size > 0:
-        predictions = predictions[:data.return_max_size]
+    model.check_and_update_index()
+    predictions = model.classify(data.text, data.return_max_size)
     response.status_code = status.HTTP_200_OK
     return {
         "message": "get success",
@@ -32,6 +31,21 @@ def classify_template(response: Response, data: classify_template_body):
     }
 
 
+class classify_template_batch_body(BaseModel):
+    return_max_size = 20
+    texts: List[str] = [model.example_text]
+
+
+@router.post("/models/classify/template:batch", tags = TAG_OF_TEMPLATE_CLASSIFY_API)
+def classify_template_batch(response: Response, data: classify_template_batch_body):
+    """Classify many texts in one call, the prediction list keeps the order of texts."""
+    model.check_and_update_index()
+    predictions = model.classify_batch(data.texts, data.return_max_size) if data.texts else []
+    response.status_code = status.HTTP_200_OK
+    return {
+        "message": "get success",
+        "prediction": predictions
+    }
 
 @router.get("/models/classify/template", tags = TAG_OF_TEMPLATE_CLASSIFY_API)
 def get_classify_model_status(response: Response):
@@ -1,5 +1,6 @@
 
-from fastapi import FastAPI, Depends, status
+from fastapi import FastAPI, Depends, status, Response, BackgroundTasks
+from bson.objectid import ObjectId
 import pymongo
 from starlette.exceptions import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
@@ -13,6 +14,8 @@ from datetime import datetime
 
 from motor.motor_asyncio import AsyncIOMotorClient as MotorClient
 from db.utils import convert_mongo_id
+from utils.trainer_communicate import asyncio_update_db_last_modify_time
+from utils.template_classification import model as template_model
 
 from core.config import (
     ALLOWED_HOSTS,
@@ -24,6 +27,7 @@ from core.config import (
     Feedback_Template_Collection,
     Feedback_Suggestion_Collection,
     LABEL_COLLECTION,
+    TEMPLATE_RETRAIN_JOB_COLLECTION,
     API_V1_PREFIX,
 )
 
@@ -74,12 +78,37 @@ class text_label_body(BaseModel):
 
 
 class update_template_data_body(BaseModel):
+    user: str = "example@gmail.com"
     text: str = example_text
-    template: str = "IP Payment"
+    template: str = "bill-of-lading"
 
 @app.post("/data/template", tags = ["Optimize Data"], status_code=status.HTTP_200_OK)
-def update_template_data(data: update_template_data_body):
-    return "OK"
+async def update_template_data(response: Response,
+                               data: Union[List[update_template_data_body], update_template_data_body]):
+    """Store which template a text should be classified as.
+    Accept one feedback or a list of them."""
+    if not isinstance(data, list):
+        data = [data]
+    unknown_templates = {feedback.template for feedback in data} - set(template_model.data.keys())
+    if unknown_templates:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {
+            "message": f"Failed, templates {unknown_templates} not found."
+        }
+    mongo_client = await get_database()
+    col = mongo_client[DATABASE_NAME][Feedback_Template_Collection]
+    dataToStore = [{
+        "user": feedback.user,
+        "text": feedback.text,
+        "template": feedback.template,
+        "TimeStamp": datetime.now(),
+    } for feedback in data]
+    result = await col.insert_many(dataToStore, ordered=False)
+    await asyncio_update_db_last_modify_time(Feedback_Template_Collection)
+    return {
+        "message": "Add Success",
+        "insert_ids": list(map(str, result.inserted_ids)),
+    }
 
 class update_suggestion_data_body(BaseModel):
     text: str = "Not Finish Yet"
@@ -102,13 +131,42 @@ def retrain_suggestion_model():
 
 
 
-@app.post("/model/template:retrain", tags = ["ReTrain"], status_code=status.HTTP_200_OK)
-def retrain_template_model():
+@app.post("/model/template:retrain", tags = ["ReTrain"], status_code=status.HTTP_202_ACCEPTED)
+async def retrain_template_model(background_tasks: BackgroundTasks):
+    """Rebuild the template classification index with the stored feedback in background.
+    Only templates with new feedback are embedded again."""
+    mongo_client = await get_database()
+    feedback_col = mongo_client[DATABASE_NAME][Feedback_Template_Collection]
+    job_col = mongo_client[DATABASE_NAME][TEMPLATE_RETRAIN_JOB_COLLECTION]
+    train_data_count = await feedback_col.count_documents({})
+    result = await job_col.insert_one({
+        "status": "waiting",
+        "template_count": len(template_model.data),
+        "re_embedded_count": -1,
+        "train_data_count": train_data_count,
+        "last_update_time": datetime.now(),
+        "add_time": datetime.now(),
+    })
+    background_tasks.add_task(template_model.run_retrain_job, result.inserted_id)
     return {
-        "message": "success AAA, start retrain.",
-        "train-data-amount": 2500,
+        "message": "success, start retrain.",
+        "train-data-amount": train_data_count,
+        "template-amount": len(template_model.data),
+        "trace_id": str(result.inserted_id),
     }
 
+@app.get("/model/template:retrain/{trace_id}", tags = ["ReTrain"])
+async def track_template_model_retrain_status(trace_id: str, response: Response):
+    mongo_client = await get_database()
+    job_col = mongo_client[DATABASE_NAME][TEMPLATE_RETRAIN_JOB_COLLECTION]
+    job = await job_col.find_one({"_id": ObjectId(trace_id)}, {"_id": False})
+    if job == None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {
+            "message": f"trace_id {trace_id} Not Found."
+        }
+    return job
+
 
 
 
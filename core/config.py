@@ -42,6 +42,12 @@ Feedback_Suggestion_Collection = "suggestion_data_feedback"
 LABEL_COLLECTION = "Labels"
 LABEL_TRAIN_JOB_COLLECTION = "NER_label_training_jobs"
 CONFIG_COLLECTION="config"
+TEMPLATE_RETRAIN_JOB_COLLECTION = "template_retrain_jobs"
+TEMPLATE_INDEX_NAME = "template_classification_index"
+LABELED_DATA_IMPORT_JOB_COLLECTION = "labeled_data_import_jobs"
+LABEL_DATA_COUNT_COLLECTION = "label_data_counts"
+LABEL_CATALOG_NAME = "label_catalog" # in CONFIG_COLLECTION, version of LABEL_COLLECTION for caches
+LABEL_DICTIONARY_NAME = "label_dictionary" # in CONFIG_COLLECTION, label positions of labeled_dataset "encoded" bitmask
 SLEEP_INTERVAL_SECOND = 3
 
 TRAINER_LOG_COLLECTION = "trainer_log"
@@ -52,11 +58,43 @@ TRAINER_LOG_COLLECTION = "trainer_log"
 # For 24 VGB, batch size 256 is fine.
 # For 8 VGB or less, batch size 64 is good.
 NER_TRAIN_BATCH_SIZE = 256
+# Batch sentences of similar length, less padding.
+NER_TRAIN_BUCKET_BY_LENGTH = True
+# Also cap a batch at this many tokens (sentences x longest sentence), None for no cap.
+NER_TRAIN_MAX_TOKENS = None
+# DataLoader processes, and batches each of them loads ahead.
+NER_TRAIN_LOADER_WORKERS = 2
+NER_TRAIN_LOADER_PREFETCH = 2
+# Stream each job's sentences in chunks instead of holding them all in memory,
+# from the memory-mapped cache ("cache", built and refreshed by parts of
+# NER_TRAINER_DATA_CACHE_FETCH_SIZE sentences) or from MongoDB ("mongo").
+NER_TRAIN_STREAMING = False
+NER_TRAIN_STREAM_SOURCE = "cache"
+NER_TRAIN_STREAM_CHUNK_SIZE = 4096 # sentences in memory per loader worker
+# Waiting jobs with the same train_data_filter and epochs are trained together,
+# an adapter and head per label in one Parallel pass. 1 trains one job at a time.
+# Every label multiplies the activations after the first adapter layer.
+NER_TRAIN_PARALLEL_LABELS = 8
 NER_TRAIN_DEFAULT_FILTER = {}
 NER_TRAIN_DEVIDE_ID = 0
 NER_ADAPTERS_PATH = "."
 DUMMY_LABEL_NAME = "DUMMY;" # ";" can't be the real label name, no conflict
 
+# Labeled Data Import
+# Documents per bulk write batch, and processes to tokenize the batches.
+LABELED_DATA_IMPORT_BATCH_SIZE = 500
+LABELED_DATA_IMPORT_WORKER = 2
+# Documents per cursor batch when exporting.
+LABELED_DATA_EXPORT_BATCH_SIZE = 1000
+
+# Labeled Data Query
+# Time limit of a labeled data page query in the DB.
+LABELED_DATA_QUERY_MAX_TIME_MS = 5000
+# When find:by:mongo:filter would scan the whole collection: "reject", "warn" or "allow".
+CUSTOM_FILTER_COLLECTION_SCAN = "warn"
+# Operators running JavaScript in the DB, not allowed in find:by:mongo:filter.
+CUSTOM_FILTER_FORBIDDEN_OPERATORS = ["$where", "$function", "$accumulator"]
+
 # Anaconda
 ANACONDA_ENV_NAME = "adapter"
 
@@ -66,7 +104,9 @@ PATH = os.getcwd()
 PREDICT_DEVICE="cpu"
 
 # CACHE
-NER_TRAINER_DATA_CATCH_FILE=f"{PATH}/cache/NER_TRAINER_DATA_CATCH.csv"
+NER_TRAINER_DATA_CACHE_DIR=f"{PATH}/cache/NER_trainer_data" # a directory per train data filter
+NER_TRAINER_DATA_CACHE_MAX_SEGMENTS = 64 # appended refreshes before the cache is rewritten
+NER_TRAINER_DATA_CACHE_FETCH_SIZE = 10000 # sentences per part written to the cache, _ids per $in query when syncing it
 NER_ADAPTERS_TRAINER_NAME = "NER_adapter_trainer"
 NER_TRAINER_RUNNER_NAME = "NER_trainer_runner"
 
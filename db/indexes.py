@@ -0,0 +1,65 @@
+"""Indexes of every collection, created by connect_to_mongo at API startup.
+
+create_index is a no-op when the same index already exists, so this is
+safe to run at every start. An index that can't be built (EX: duplicated
+label_name before the unique index existed) is logged and skipped,
+the API still starts."""
+import logging
+from pymongo.errors import OperationFailure
+from core.config import (
+    NER_LABEL_COLLECTION,
+    LABEL_COLLECTION,
+    LABEL_TRAIN_JOB_COLLECTION,
+    CONFIG_COLLECTION,
+    LABEL_DATA_COUNT_COLLECTION,
+    Feedback_Template_Collection,
+)
+
+# Unique content_hash of labeled_dataset,
+# documents stored before the hash existed don't have it.
+CONTENT_HASH_INDEX = {
+    "keys": [("content_hash", 1)],
+    "name": "content_hash_unique",
+    "unique": True,
+    "partialFilterExpression": {"content_hash": {"$exists": True}},
+}
+
+INDEXES = {
+    LABEL_COLLECTION: [
+        {"keys": [("label_name", 1)], "name": "label_name_unique", "unique": True},
+        {"keys": [("alias_as", 1)], "name": "alias_as"},
+    ],
+    NER_LABEL_COLLECTION: [
+        {"keys": [("text_and_labels.labels", 1)], "name": "text_and_labels_labels"},
+        {"keys": [("token_and_labels.labels", 1)], "name": "token_and_labels_labels"},
+        {"keys": [("user", 1)], "name": "user"},
+        CONTENT_HASH_INDEX,
+    ],
+    LABEL_TRAIN_JOB_COLLECTION: [
+        {"keys": [("status", 1), ("add_time", 1)], "name": "status_add_time"},
+    ],
+    CONFIG_COLLECTION: [
+        {"keys": [("collection_name", 1)], "name": "collection_name", "sparse": True},
+        {"keys": [("name", 1)], "name": "name", "sparse": True},
+    ],
+    LABEL_DATA_COUNT_COLLECTION: [
+        {"keys": [("label_name", 1)], "name": "label_name_unique", "unique": True},
+    ],
+    Feedback_Template_Collection: [
+        {"keys": [("template", 1)], "name": "template"},
+    ],
+}
+
+
+async def create_indexes(database):
+    """Create every index of INDEXES in the (motor) database.
+    Return the names of the indexes failed to create."""
+    failed = []
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await database[collection_name].create_index(**index)
+            except OperationFailure as error:
+                logging.warning(f"Can't create index {index['name']} of {collection_name}: {error}")
+                failed.append(f"{collection_name}.{index['name']}")
+    return failed
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -5,8 +6,10 @@ from core.config import (
     MONGODB_URL,
     MAX_CONNECTIONS_COUNT,
     MIN_CONNECTIONS_COUNT,
+    DATABASE_NAME,
 )
 from .mongodb import db
+from .indexes import create_indexes
 
 
 async def connect_to_mongo():
@@ -15,9 +18,30 @@ async def connect_to_mongo():
                                    maxPoolSize=MAX_CONNECTIONS_COUNT,
                                    minPoolSize=MIN_CONNECTIONS_COUNT)
     logging.info("Connecting to MongoDB Success.")
+    # An index build on a big collection takes long, don't hold the startup.
+    # POST /admin/indexes creates the failed ones again.
+    global index_task
+    index_task = asyncio.create_task(create_indexes_in_background())
+
+
+index_task = None
+
+async def create_indexes_in_background():
+    logging.info("Creating MongoDB indexes...")
+    try:
+        failed = await create_indexes(db.client[DATABASE_NAME])
+    except Exception:
+        logging.exception("Creating MongoDB indexes failed, retry with POST /admin/indexes.")
+        return
+    if failed:
+        logging.warning(f"MongoDB indexes {failed} not created, retry with POST /admin/indexes.")
+    else:
+        logging.info("Creating MongoDB indexes Success.")
 
 
 async def close_mongo_connection():
+    if index_task is not None and not index_task.done():
+        index_task.cancel()
     logging.info("Closing Connection from MongoDB...")
     db.client.close()
     logging.info("Closing Connection from MongoDB Success.")
\ No newline at end of file
@@ -0,0 +1,45 @@
+"""Checks of the client supplied Mongo filters, before running them."""
+
+# Stages which read an index instead of every document.
+INDEX_STAGES = {"IXSCAN", "IDHACK", "COUNT_SCAN", "DISTINCT_SCAN", "TEXT", "TEXT_MATCH", "EXPRESS_IXSCAN", "EXPRESS_IDHACK"}
+
+
+def find_operators(mongo_filter, operators):
+    """Operators of operators used anywhere in mongo_filter."""
+    found = set()
+    if isinstance(mongo_filter, dict):
+        for key, value in mongo_filter.items():
+            if key in operators:
+                found.add(key)
+            found |= find_operators(value, operators)
+    elif isinstance(mongo_filter, list):
+        for value in mongo_filter:
+            found |= find_operators(value, operators)
+    return found
+
+
+def iter_plan_stages(plan):
+    # Mongo 5+ wraps the classic plan in "queryPlan" with the slot based engine.
+    plan = plan.get("queryPlan", plan)
+    yield plan
+    for key in ("inputStage", "innerStage", "outerStage"):
+        if key in plan:
+            yield from iter_plan_stages(plan[key])
+    for stage in plan.get("inputStages", []):
+        yield from iter_plan_stages(stage)
+
+
+def get_plan_summary(explain, mongo_filter):
+    """Summary of the winning plan of an explain command result.
+    A scan of the _id index only used for sorting reads every document as well,
+    so it is a collection scan too, unless mongo_filter selects by _id."""
+    stages = list(iter_plan_stages(explain["queryPlanner"]["winningPlan"]))
+    indexes = [stage["indexName"] for stage in stages if "indexName" in stage]
+    index_used = any(stage["stage"] in INDEX_STAGES for stage in stages) and (
+        any(index != "_id_" for index in indexes) or "_id" in mongo_filter)
+    return {
+        "stages": [stage["stage"] for stage in stages],
+        "indexes": indexes,
+        "index_used": index_used,
+        "collection_scan": not index_used,
+    }
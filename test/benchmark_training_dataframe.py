@@ -0,0 +1,120 @@
+"""Benchmark of utils.trainer.NER.build_training_dataframe, the builder of
+get_training_data, against the DataFrame.append builder it replaced, on a
+synthetic corpus. Also times a load of the binary cache.
+
+python -m test.benchmark_training_dataframe --sentences 100000
+"""
+import argparse
+import gc
+import random
+import tempfile
+import time
+
+import pandas as pd
+from bson.objectid import ObjectId
+
+from utils.trainer.data_cache import TrainingDataBuilder, TrainingDataCache, DATAFRAME_COLUMNS
+from utils.trainer.NER import build_training_dataframe
+
+LABELS = ["B-per", "I-per", "B-org", "I-org", "Party", "String", "Date", "Money"]
+
+
+def make_synthetic_sentences(sentence_count, seed = 0):
+    """Sentence documents like labeled_dataset, 5 to 40 tokens each."""
+    generator = random.Random(seed)
+    sentences = []
+    for _ in range(sentence_count):
+        token_and_labels = []
+        for _ in range(generator.randint(5, 40)):
+            labels = generator.sample(LABELS, generator.choice([0, 0, 0, 1, 1, 2]))
+            token_and_labels.append({
+                "token": "Ġtok" + str(generator.randint(0, 5000)),
+                "labels": labels or ["O"],
+            })
+        sentences.append({"_id": ObjectId(), "token_and_labels": token_and_labels})
+    return sentences
+
+
+def append_frames(df, other):
+    # DataFrame.append was removed in pandas 2, pd.concat copies the same way.
+    if hasattr(pd.DataFrame, "append"):
+        return df.append(other)
+    return pd.concat([df, other])
+
+
+def build_training_dataframe_with_append(sentences):
+    """The builder before build_training_dataframe: a frame per sentence,
+    appended in nested chunks of 50."""
+    dfs = []
+    df_columns = DATAFRAME_COLUMNS
+    for i, sentence in enumerate(sentences):
+        if i%50 == 0:
+            if i != 0: dfs.append(df)
+            df = pd.DataFrame()
+        sentense_df = pd.DataFrame(columns = df_columns, data = sentence["token_and_labels"])
+        sentense_df["Sentence #"] = str(sentence["_id"])
+        df = append_frames(df, sentense_df)
+    dfs.append(df)
+    while len(dfs) > 50:
+        new_dfs = []
+        tmp_df = pd.DataFrame(columns = df_columns)
+        for i, df in enumerate((dfs)):
+            if i%50 == 0:
+                if i != 0: new_dfs.append(tmp_df)
+                tmp_df = pd.DataFrame()
+            tmp_df = append_frames(tmp_df, df)
+        new_dfs.append(tmp_df)
+        dfs = new_dfs
+    final_df = pd.DataFrame(columns = df_columns)
+    for df in dfs:
+        final_df = append_frames(final_df, df)
+    return final_df.reset_index(drop=True)
+
+
+def build_training_data(sentences):
+    builder = TrainingDataBuilder()
+    for sentence in sentences:
+        builder.add(sentence)
+    return builder.build()
+
+
+def load_training_data(data):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        data_cache = TrainingDataCache(cache_dir, {})
+        manifest = data_cache.write([data], {})
+        start = time.perf_counter()
+        data = data_cache.load(manifest)
+        load_time = time.perf_counter() - start
+        return load_time, data.to_dataframe()
+
+
+def benchmark(builder, sentences):
+    start = time.perf_counter()
+    df = builder(sentences)
+    return time.perf_counter() - start, df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sentences", type = int, default = 100000)
+    parser.add_argument("--skip-old", action = "store_true",
+                        help = "skip the DataFrame.append builder")
+    args = parser.parse_args()
+
+    sentences = make_synthetic_sentences(args.sentences)
+    # The trainer streams the cursor, keep the synthetic corpus out of the GC scans.
+    gc.freeze()
+    token_count = sum(len(sentence["token_and_labels"]) for sentence in sentences)
+    print(f"{args.sentences} sentences, {token_count} tokens")
+
+    new_time, new_df = benchmark(build_training_dataframe, sentences)
+    print(f"TrainingDataBuilder and to_dataframe: {new_time:.2f} s")
+    load_time, cached_df = load_training_data(build_training_data(sentences))
+    print(f"TrainingDataCache.load: {load_time * 1000:.2f} ms")
+    for column in DATAFRAME_COLUMNS:
+        assert cached_df[column].tolist() == new_df[column].tolist()
+    if not args.skip_old:
+        old_time, old_df = benchmark(build_training_dataframe_with_append, sentences)
+        print(f"DataFrame.append builder: {old_time:.2f} s ({old_time / new_time:.0f}x)")
+        for column in DATAFRAME_COLUMNS:
+            assert old_df[column].tolist() == new_df[column].tolist()
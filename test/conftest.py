@@ -0,0 +1,167 @@
+"""The modules under test create their MongoClient at import, make them
+mongomock clients of one in memory server, the tests need no MongoDB server.
+The API reads through db.mongodb.db.client, the mongo_db fixture makes
+it a motor like wrapper of the same server."""
+import os
+
+import pymongo
+import pytest
+
+# core.config builds MONGODB_URL from them, an empty user is not a valid URI.
+os.environ.setdefault("MONGO_USER", "test")
+os.environ.setdefault("MONGO_PASSWORD", "test")
+
+try:
+    import mongomock
+except ModuleNotFoundError:
+    # No mongomock, the tests using MongoDB are skipped.
+    mongomock = None
+
+if mongomock is not None:
+    server_store = mongomock.store.ServerStore()
+
+    class MongoClient(mongomock.MongoClient):
+        """All clients see the same databases, as with a server."""
+        def __init__(self, *args, **kwargs):
+            kwargs.setdefault("_store", server_store)
+            super().__init__(*args, **kwargs)
+
+    pymongo.MongoClient = MongoClient
+
+    # pymongo 4.11+ passes sort to the bulk builder, mongomock doesn't take it.
+    def drop_sort(add):
+        def add_without_sort(*args, sort = None, **kwargs):
+            return add(*args, **kwargs)
+        return add_without_sort
+
+    BulkOperationBuilder = mongomock.collection.BulkOperationBuilder
+    BulkOperationBuilder.add_update = drop_sort(BulkOperationBuilder.add_update)
+    BulkOperationBuilder.add_replace = drop_sort(BulkOperationBuilder.add_replace)
+
+
+class AsyncCursor:
+    """The motor cursor methods the API uses, over a mongomock cursor."""
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        # sort, skip, limit, max_time_ms, batch_size ... return the cursor.
+        method = getattr(self.cursor, name)
+        def chain(*args, **kwargs):
+            method(*args, **kwargs)
+            return self
+        return chain
+
+    async def to_list(self, length):
+        documents = list(self.cursor)
+        return documents[:length] if length else documents
+
+    async def iterate(self):
+        for document in self.cursor:
+            yield document
+
+    def __aiter__(self):
+        return self.iterate()
+
+
+class AsyncCollection:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    def aggregate(self, *args, **kwargs):
+        return AsyncCursor(self.collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+        async def run(*args, **kwargs):
+            return method(*args, **kwargs)
+        return run
+
+
+class AsyncDatabase:
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.database[name])
+
+    async def command(self, *args, **kwargs):
+        return self.database.command(*args, **kwargs)
+
+
+class AsyncMongoClient:
+    def __init__(self, client):
+        self.client = client
+
+    def __getitem__(self, name):
+        return AsyncDatabase(self.client[name])
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    """The empty test database, also set as the database of the API.
+    The cached label catalogs are cleared with it."""
+    if mongomock is None:
+        pytest.skip("mongomock is not installed")
+    from core.config import DATABASE_NAME
+    from db.mongodb import db
+    import utils.label_catalog as label_catalog
+    client = pymongo.MongoClient()
+    client.drop_database(DATABASE_NAME)
+    monkeypatch.setattr(db, "client", AsyncMongoClient(client))
+    monkeypatch.setattr(label_catalog, "_catalog", label_catalog.LabelCatalog())
+    monkeypatch.setattr(label_catalog, "_asyncio_catalog", label_catalog.LabelCatalog())
+    yield client[DATABASE_NAME]
+    client.drop_database(DATABASE_NAME)
+
+
+class WordTokenizer:
+    """One token per word, its leading space as "Ġ" like RoBERTa,
+    the ids in order of first use after the special tokens."""
+    cls_token_id, sep_token_id = 0, 2
+
+    def __init__(self):
+        self.vocabulary = {"<s>": 0, "<pad>": 1, "</s>": 2}
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.vocabulary.setdefault(token, len(self.vocabulary)) for token in tokens]
+
+    def convert_ids_to_tokens(self, ids):
+        tokens = list(self.vocabulary)
+        return [tokens[i] for i in ids]
+
+    def encode_words(self, words):
+        return [self.convert_tokens_to_ids([word.replace(" ", "Ġ")]) for word in words]
+
+
+@pytest.fixture
+def tokenizer():
+    """A tokenizer for the datasets of utils.trainer.NER, without the roberta-base download."""
+    return WordTokenizer()
+
+
+@pytest.fixture
+def word_tokenizer(monkeypatch, tokenizer):
+    """tokenizer, also as the tokenizer of utils.labeled_data."""
+    import utils.labeled_data as labeled_data
+    monkeypatch.setattr(labeled_data, "encode_words", tokenizer.encode_words)
+    monkeypatch.setattr(labeled_data, "fast_tokenizer", tokenizer)
+    return tokenizer
+
+
+class LabelCatalog:
+    """Every label is trained with "String" as positive too."""
+    def get_positive_labels(self, label_name):
+        return [label_name, "String"]
+
+
+@pytest.fixture
+def label_catalog(monkeypatch):
+    """LabelCatalog as the label catalog of utils.trainer.NER."""
+    import utils.trainer.NER as NER
+    catalog = LabelCatalog()
+    monkeypatch.setattr(NER, "get_label_catalog", lambda: catalog)
+    return catalog
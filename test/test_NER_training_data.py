@@ -0,0 +1,168 @@
+"""get_training_data refreshes, training filters, the length bucket sampler
+and the streaming dataset of utils.trainer.NER, against mongomock."""
+import datetime
+
+import numpy as np
+import pytest
+from bson.objectid import ObjectId
+
+pytest.importorskip("mongomock")
+import utils.trainer.NER as NER
+from core.config import DATABASE_NAME, NER_LABEL_COLLECTION, CONFIG_COLLECTION
+from test.test_data_cache import make_sentences, get_rows
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path, label_catalog):
+    monkeypatch.setattr(NER, "NER_TRAINER_DATA_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(NER, "NER_TRAINER_DATA_CACHE_FETCH_SIZE", 7)
+    NER.client.drop_database(DATABASE_NAME)
+    yield NER.client[DATABASE_NAME]
+    NER.client.drop_database(DATABASE_NAME)
+
+
+def set_data_version(db, deleted = False):
+    now = datetime.datetime.now()
+    update = {"last_update_time": now, **({"last_delete_time": now} if deleted else {})}
+    db[CONFIG_COLLECTION].update_one({"collection_name": NER_LABEL_COLLECTION},
+                                     {"$set": update}, upsert = True)
+
+
+def assert_synced(train_data_search_filter = {}):
+    data = NER.get_training_data(train_data_search_filter)
+    expected = NER.fetch_training_data(train_data_search_filter)
+    assert sorted(get_rows(data)) == sorted(get_rows(expected))
+    return data
+
+
+def test_get_training_data_refreshes_the_cache(db):
+    col = db[NER_LABEL_COLLECTION]
+    col.insert_many(make_sentences(30, seed = 1))
+    set_data_version(db)
+    assert len(assert_synced()) == 30
+    # Unchanged version: the same cache.
+    assert len(assert_synced()) == 30
+
+    col.insert_many(make_sentences(10, seed = 2))
+    set_data_version(db)
+    assert len(assert_synced()) == 40
+
+    col.delete_many({"_id": {"$in": [sentence["_id"] for sentence in col.find().limit(6)]}})
+    set_data_version(db, deleted = True)
+    assert len(assert_synced()) == 34
+
+    # Written with an _id before the last cached one.
+    col.insert_one({"_id": ObjectId.from_datetime(datetime.datetime(2000, 1, 1)),
+                    "token_and_labels": [{"token": "Ġnew", "labels": ["New"]}]})
+    set_data_version(db)
+    assert len(assert_synced()) == 35
+
+    col.delete_many({})
+    set_data_version(db, deleted = True)
+    assert len(assert_synced()) == 0
+    col.insert_many(make_sentences(3, seed = 3))
+    set_data_version(db)
+    assert len(assert_synced()) == 3
+
+
+def test_get_training_data_appends_then_rewrites(db, monkeypatch):
+    monkeypatch.setattr(NER, "NER_TRAINER_DATA_CACHE_MAX_SEGMENTS", 2)
+    col = db[NER_LABEL_COLLECTION]
+    cache = NER.TrainingDataCache(NER.NER_TRAINER_DATA_CACHE_DIR, {})
+    col.insert_many(make_sentences(20, seed = 7))
+    set_data_version(db)
+    assert_synced()
+    manifest = cache.read_manifest()
+
+    col.insert_many(make_sentences(5, seed = 8))
+    set_data_version(db)
+    assert_synced()
+    appended = cache.read_manifest()
+    assert appended["columns"] == manifest["columns"]
+    assert appended["segments"] == [20, 5]
+
+    col.insert_many(make_sentences(5, seed = 9))
+    set_data_version(db)
+    assert len(assert_synced()) == 30
+    rewritten = cache.read_manifest()
+    assert rewritten["columns"] != manifest["columns"]
+    assert rewritten["segments"] == [30]
+
+
+def test_get_training_data_by_filter(db):
+    db[NER_LABEL_COLLECTION].insert_many(make_sentences(30, seed = 4))
+    set_data_version(db)
+    train_data_search_filter = {"token_and_labels.labels": "Party"}
+    data = assert_synced(train_data_search_filter)
+    assert 0 < len(data) < 30
+
+
+def test_get_target_indexes_by_filter(db):
+    sentences = make_sentences(40, seed = 5)
+    db[NER_LABEL_COLLECTION].insert_many(sentences)
+    set_data_version(db)
+    data = NER.get_training_data()
+    train_data_search_filter = {"token_and_labels.labels": {"$in": ["Law", "Date"]}}
+    expected = sorted(i for i, sentence_id in enumerate(data.get_sentence_id_strings())
+                      if any({"Law", "Date"}.intersection(token["labels"])
+                             for sentence in sentences if str(sentence["_id"]) == sentence_id
+                             for token in sentence["token_and_labels"]))
+    assert NER.get_target_indexes_by_filter(data, train_data_search_filter).tolist() == expected
+    target_data = NER.get_target_data_by_filter(data, train_data_search_filter)
+    assert get_rows(target_data) == get_rows(data.take(expected))
+
+    positive_label, mask = NER.get_positive_label_mask(target_data, "Law")
+    assert positive_label == ["Law", "String"]
+    assert mask.tolist() == [bool({"Law", "String"}.intersection(labels))
+                             for labels in target_data.to_dataframe()["labels"]]
+
+
+@pytest.mark.parametrize("bucket", [True, False])
+@pytest.mark.parametrize("max_tokens", [None, 120])
+@pytest.mark.parametrize("shuffle", [True, False])
+def test_length_bucket_batch_sampler(bucket, max_tokens, shuffle):
+    lengths = np.random.default_rng(0).integers(1, 30, 500)
+    sampler = NER.LengthBucketBatchSampler(lengths, 16, max_tokens, bucket, shuffle, seed = 0)
+    for _ in range(3):
+        batch_count = len(sampler)
+        batches = list(sampler)
+        assert len(batches) == batch_count
+        assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+        assert all(len(batch) <= 16 for batch in batches)
+        if max_tokens is not None:
+            assert all(len(batch) * lengths[batch].max() <= max_tokens for batch in batches)
+        if bucket and max_tokens is None:
+            # Sorted by length, batches do not overlap in length.
+            ranges = sorted((lengths[batch].min(), lengths[batch].max()) for batch in batches)
+            assert all(high <= next_low for (_, high), (next_low, _) in zip(ranges, ranges[1:]))
+
+
+@pytest.mark.parametrize("from_cache", [True, False])
+def test_streaming_dataset_yields_every_sentence_once(db, tokenizer, from_cache):
+    sentences = make_sentences(60, seed = 6)
+    db[NER_LABEL_COLLECTION].insert_many(sentences)
+    set_data_version(db)
+    train_data_search_filter = {"token_and_labels.labels": "Party"}
+    data = NER.get_training_data() if from_cache else None
+    dataset = NER.NER_Streaming_Dataset_for_Adapter(tokenizer, "Party", train_data_search_filter,
+                                                    data, chunk_size = 8, seed = 0)
+    expected = sorted(len(sentence["token_and_labels"]) + 2 for sentence in sentences
+                      if any("Party" in token["labels"] for token in sentence["token_and_labels"]))
+    assert len(dataset) == len(expected)
+    for _ in range(2):
+        items = [item for batch in dataset for item in batch]
+        assert sorted(len(tokens) for tokens, _, _ in items) == expected
+        for tokens, _, labels in items:
+            assert labels.shape == (len(tokens), 2)
+            assert (labels.sum(-1) == 1).all()
+
+
+def test_epoch_stats_padding_ratio():
+    labels = np.zeros((2, 4, 2), dtype=np.float32)
+    labels[0, :4, 0] = 1
+    labels[1, :1, 1] = 1
+    token_count, padded_count = NER.get_padding_counts(labels)
+    assert (token_count, padded_count) == (5, 8)
+    assert NER.get_epoch_stats(3, 1, token_count, padded_count) == {
+        "epoch": 3, "batches": 1, "padding_ratio": 1 - 5 / 8}
+    assert NER.get_epoch_stats(1, 0, 0, 0)["padding_ratio"] == 0
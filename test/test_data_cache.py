@@ -0,0 +1,153 @@
+"""TrainingData, its builder and TrainingDataCache on small generated corpora."""
+import os
+
+import numpy as np
+import pytest
+from bson.objectid import ObjectId
+
+import utils.trainer.data_cache as data_cache
+from utils.trainer.data_cache import TrainingDataBuilder, TrainingDataCache
+
+LABELS = ["B-per", "I-per", "B-org", "I-org", "Party", "String", "Date", "Money", "O", "Law"]
+
+
+def make_sentences(sentence_count, seed = 0):
+    generator = np.random.default_rng(seed)
+    sentences = []
+    for _ in range(sentence_count):
+        sentences.append({"_id": ObjectId(), "token_and_labels": [
+            {"token": f"Ġtok{generator.integers(0, 50)}",
+             "labels": generator.choice(LABELS, generator.integers(0, 3), replace = False).tolist()}
+            for _ in range(generator.integers(1, 12))]})
+    return sentences
+
+
+def build(sentences, label_names = (), token_vocabulary = ()):
+    builder = TrainingDataBuilder(label_names, token_vocabulary)
+    for sentence in sentences:
+        builder.add(sentence)
+    return builder.build()
+
+
+def get_rows(data):
+    """(sentence _id, token, labels) of every token of data."""
+    df = data.to_dataframe()
+    return list(zip(df["Sentence #"], df["token"], df["labels"].map(tuple)))
+
+
+def get_sentence_rows(sentences):
+    return [(str(sentence["_id"]), token["token"], tuple(token["labels"]))
+            for sentence in sentences for token in sentence["token_and_labels"]]
+
+
+def test_builder_keeps_the_sentences():
+    sentences = make_sentences(30)
+    data = build(sentences)
+    assert len(data) == 30
+    assert data.get_sentence_id_bytes() == [sentence["_id"].binary for sentence in sentences]
+    assert get_rows(data) == get_sentence_rows(sentences)
+
+
+def test_flush_keeps_the_vocabularies():
+    sentences = make_sentences(20)
+    builder = TrainingDataBuilder()
+    for sentence in sentences[:10]:
+        builder.add(sentence)
+    first = builder.flush()
+    for sentence in sentences[10:]:
+        builder.add(sentence)
+    second = builder.build()
+    assert len(first) == len(second) == 10
+    assert second.token_vocabulary[:len(first.token_vocabulary)].tolist() == first.token_vocabulary.tolist()
+    assert get_rows(first) + get_rows(second) == get_sentence_rows(sentences)
+
+
+def test_take_and_get_sentence_indexes():
+    sentences = make_sentences(40)
+    data = build(sentences)
+    data.get_label_bitmask()
+    indexes = [3, 7, 8, 20, 39]
+    taken = data.take(indexes)
+    assert get_rows(taken) == get_sentence_rows([sentences[i] for i in indexes])
+    assert np.array_equal(taken.label_bitmask, taken.get_label_bitmask())
+    wanted = [sentences[i]["_id"].binary for i in reversed(indexes)] + [ObjectId().binary]
+    assert data.get_sentence_indexes(wanted).tolist() == indexes
+    assert data.take([]).to_dataframe().empty
+
+
+@pytest.mark.parametrize("chunk_size", [3, 65536])
+def test_label_mask_matches_the_labels(monkeypatch, chunk_size):
+    monkeypatch.setattr(data_cache, "BITMASK_CHUNK_SIZE", chunk_size)
+    sentences = make_sentences(50)
+    data = build(sentences)
+    token_labels = [set(token["labels"]) for sentence in sentences for token in sentence["token_and_labels"]]
+    for labels in (["Party"], ["Law", "B-per"], ["O", "Date", "Money"], ["missing"]):
+        expected = [bool(token.intersection(labels)) for token in token_labels]
+        assert data.get_label_mask(labels).tolist() == expected
+
+
+def test_cache_write_and_load(tmp_path):
+    sentences = make_sentences(25)
+    first = build(sentences[:10])
+    second = build(sentences[10:], first.label_names, first.token_vocabulary)
+    cache = TrainingDataCache(str(tmp_path), {"token_and_labels.labels": "Party"})
+    with cache.lock():
+        assert cache.read_manifest() is None
+        manifest = cache.write([first, second], {"last_update_time": None})
+    assert cache.read_manifest() == manifest
+    assert manifest["version"] == {"last_update_time": None}
+    assert manifest["segments"] == [25]
+    assert manifest["sentence_count"] == 25
+    assert manifest["last_id"] == max(sentence["_id"].binary for sentence in sentences).hex()
+    data = cache.load(manifest)
+    assert isinstance(data.token_ids, np.memmap)
+    assert get_rows(data) == get_sentence_rows(sentences)
+
+
+def get_file_sizes(path):
+    return {name: os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)}
+
+
+def test_cache_append_writes_the_new_sentences_only(tmp_path):
+    sentences = make_sentences(30)
+    cache = TrainingDataCache(str(tmp_path), {}, max_segments = 2)
+    manifest = cache.write([build(sentences[:20])], {})
+    data = cache.load(manifest)
+    columns = os.path.join(cache.path, manifest["columns"])
+    sizes = get_file_sizes(columns)
+
+    new_data = build(sentences[20:], data.label_names, data.token_vocabulary)
+    new_manifest = cache.append(manifest, [new_data], {"last_update_time": "now"})
+    assert new_manifest["columns"] == manifest["columns"]
+    assert new_manifest["segments"] == [20, 10]
+    assert not cache.can_append(new_manifest)
+    new_sizes = get_file_sizes(columns)
+    assert new_sizes["token_ids.bin"] - sizes["token_ids.bin"] == 4 * len(new_data.token_ids)
+    assert new_sizes["sentence_ids.bin"] - sizes["sentence_ids.bin"] == 12 * 10
+    assert get_rows(cache.load(new_manifest)) == get_sentence_rows(sentences)
+    # Readers of the old manifest only see its rows.
+    assert get_rows(data) == get_sentence_rows(sentences[:20])
+    assert get_rows(cache.load(manifest)) == get_sentence_rows(sentences[:20])
+
+
+def test_cache_append_cuts_a_failed_write(tmp_path):
+    sentences = make_sentences(15)
+    cache = TrainingDataCache(str(tmp_path), {})
+    manifest = cache.write([build(sentences[:10])], {})
+    data = cache.load(manifest)
+    # An append that failed before the manifest was written.
+    cache.append(dict(manifest), [build(sentences[10:12], data.label_names, data.token_vocabulary)], {})
+    new_data = build(sentences[12:], data.label_names, data.token_vocabulary)
+    new_manifest = cache.append(manifest, [new_data], {})
+    assert get_rows(cache.load(new_manifest)) == get_sentence_rows(sentences[:10] + sentences[12:])
+
+
+def test_cache_rewrite_removes_the_old_columns(tmp_path):
+    sentences = make_sentences(20)
+    cache = TrainingDataCache(str(tmp_path), {})
+    data = cache.load(cache.write([build(sentences)], {}))
+    manifest = cache.write([data.take(np.arange(5, 20))], {"last_delete_time": "now"})
+    assert [name for name in os.listdir(cache.path) if name.startswith("columns-")] == [manifest["columns"]]
+    assert get_rows(cache.load(manifest)) == get_sentence_rows(sentences[5:])
+    # Readers of the old columns keep their memory map.
+    assert get_rows(data) == get_sentence_rows(sentences)
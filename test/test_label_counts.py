@@ -0,0 +1,54 @@
+"""The $inc label counts of utils.label_counts, checked against counts of the sentences."""
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+from utils.label_counts import (
+    get_label_count_increments,
+    get_label_count_updates,
+    get_data_count_filter,
+    get_data_count_update,
+)
+
+LABEL_INHERITS = {"Party": ["B-per", "B-org"], "Date": [], "Money": ["Date"]}
+
+
+def make_sentence(*token_labels):
+    return {"token_and_labels": [{"token": f"Ġt{i}", "labels": labels}
+                                 for i, labels in enumerate(token_labels)]}
+
+
+SENTENCES = [
+    make_sentence(["Party"], ["B-per"], ["O"]),
+    make_sentence(["B-org"], ["B-per"]),
+    make_sentence(["Date"], ["O"]),
+    make_sentence(["Money", "Date"]),
+    make_sentence(["O"]),
+]
+
+
+def test_increments_count_each_sentence_once_per_label():
+    increments = get_label_count_increments(SENTENCES, label_inherits = LABEL_INHERITS)
+    assert increments["B-per"][:2] == [2, 2]
+    assert increments["O"][:2] == [3, 3]
+    # Party is on 1 sentence, its inherit labels bring 1 more.
+    assert increments["Party"] == [1, 1, 2]
+    assert increments["Money"][2] == 2
+    assert increments["Date"][2] == 2
+    assert increments["B-org"][2] == 0
+    assert get_label_count_increments(SENTENCES[:1], sign = -1)["Party"] == [-1, -1, 0]
+
+
+def test_data_count_matches_count_documents():
+    client = mongomock.MongoClient()
+    sentence_col, label_count_col = client.db.sentences, client.db.label_counts
+    sentence_col.insert_many([dict(sentence) for sentence in SENTENCES])
+    label_count_col.bulk_write(get_label_count_updates(SENTENCES, label_inherits = LABEL_INHERITS))
+    deleted = sentence_col.find_one_and_delete({"token_and_labels.labels": "B-org"})
+    label_count_col.bulk_write(get_label_count_updates([deleted], -1, LABEL_INHERITS))
+
+    for label_name, inherit in LABEL_INHERITS.items():
+        count = label_count_col.find_one({"label_name": label_name})
+        assert count["data_count"] == sentence_col.count_documents(get_data_count_filter(label_name, inherit))
+
+    label_count_col.update_one(*get_data_count_update("New", 3), upsert=True)
+    assert label_count_col.find_one({"label_name": "New"})["data_count"] == 3
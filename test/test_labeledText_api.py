@@ -0,0 +1,261 @@
+"""Endpoints of api/api_v1/endpoints/labeledText_api.py, called directly
+on the mongomock database of the mongo_db fixture."""
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+from fastapi import Response
+from starlette.requests import Request
+
+pytest.importorskip("mongomock")
+import api.api_v1.endpoints.labeledText_api as labeledText_api
+from core.config import (
+    DATABASE_NAME,
+    NER_LABEL_COLLECTION,
+    CONFIG_COLLECTION,
+    CUSTOM_FILTER_FORBIDDEN_OPERATORS,
+)
+from db.mongodb import db
+from db.query_plan import get_plan_summary
+from utils.label_counts import get_data_count_filter
+
+
+def run(endpoint, *args, **kwargs):
+    """(response, result) of an endpoint, response has the status code."""
+    response = Response()
+    result = asyncio.run(endpoint(response, *args, **kwargs))
+    return response, result
+
+
+def make_upload(*words, user = "tester"):
+    """A body of POST /data/labeledText, a word is "text" or "text/label|label"."""
+    texts = []
+    for word in words:
+        text, _, labels = word.partition("/")
+        texts.append({"text": text, "labels": labels.split("|") if labels else ["O"]})
+    return labeledText_api.update_data_body(user = user, tags = ["test"], texts = texts)
+
+
+def define_label(label_name, inherit = ()):
+    return run(labeledText_api.define_new_label, labeledText_api.create_new_label_body(
+        label_name = label_name, inherit = list(inherit), alias_as = []))
+
+
+def get_label(label_name):
+    response = Response()
+    result = asyncio.run(labeledText_api.get_label_by_name(label_name, response))
+    return response, result
+
+
+def get_labels(if_none_match = None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    response = Response()
+    result = asyncio.run(labeledText_api.get_all_label(
+        Request({"type": "http", "headers": headers}), response))
+    return response, result
+
+
+def test_upload_skips_duplicated_sentences(mongo_db, word_tokenizer):
+    upload = make_upload("Dan/Party|B-per", "pays", "Niall/Party", ".", "Niall/Party", "agrees")
+    response, result = run(labeledText_api.update_labeled_data, upload)
+    assert result["message"] == "Add Success" and result["duplicate_count"] == 0
+    assert len(result["insert_ids"]) == 2
+    documents = list(mongo_db[NER_LABEL_COLLECTION].find())
+    assert [[token["token"] for token in document["token_and_labels"]] for document in documents] == [
+        ["Dan", "Ġpays", "ĠNiall", "."], ["Niall", "agrees"]]
+    assert mongo_db[CONFIG_COLLECTION].find_one({"collection_name": NER_LABEL_COLLECTION})["last_update_time"]
+
+    response, result = run(labeledText_api.update_labeled_data, upload)
+    assert result["insert_ids"] == [] and result["duplicate_count"] == 2
+    assert mongo_db[NER_LABEL_COLLECTION].count_documents({}) == 2
+
+
+def test_bulk_upload_reports_each_document(mongo_db, word_tokenizer):
+    # mongomock numbers the upserts in order, not by request, the duplicate is last.
+    documents = [
+        make_upload("Dan/Party", "pays"),
+        labeledText_api.update_data_body(texts = [{"text": 1, "labels": ["O"]}]),
+        make_upload("on", "Monday/Date"),
+        make_upload("Dan/Party", "pays"),
+    ]
+    response, result = run(labeledText_api.bulk_update_labeled_data,
+                           labeledText_api.bulk_update_data_body(documents = documents))
+    assert response.status_code == 207
+    assert result["message"] == "1 documents failed"
+    first, malformed, other, duplicated = result["results"]
+    assert len(first["insert_ids"]) == 1 and first["duplicate_count"] == 0
+    assert malformed["message"] == "Failed" and "text must be a string" in malformed["error_msg"]
+    assert len(other["insert_ids"]) == 1
+    assert duplicated["insert_ids"] == [] and duplicated["duplicate_count"] == 1
+    stored = {str(document["_id"]) for document in mongo_db[NER_LABEL_COLLECTION].find()}
+    assert stored == set(first["insert_ids"] + other["insert_ids"])
+    # Labels of the malformed upload are not added to the label dictionary.
+    counts = run(labeledText_api.get_all_label_data_counts)[1]
+    assert counts["Party"] == {"sentence_count": 1, "token_count": 1, "data_count": 0}
+    assert counts["Date"]["sentence_count"] == 1
+
+
+def test_label_counts_follow_inserts_and_deletes(mongo_db, word_tokenizer):
+    define_label("Party", ["B-per", "B-org"])
+    run(labeledText_api.update_labeled_data, make_upload("Dan/Party", "pays", ".", "Acme/B-org", "sells"))
+    response, result = run(labeledText_api.update_labeled_data, make_upload("Niall/B-per|B-org", "buys"))
+    niall_id = result["insert_ids"][0]
+    define_label("Money")
+    run(labeledText_api.update_labeled_data, make_upload("10/Money", "USD/Money"))
+
+    counts = run(labeledText_api.get_all_label_data_counts)[1]
+    assert counts["Party"] == {"sentence_count": 1, "token_count": 1, "data_count": 3}
+    assert counts["B-org"]["sentence_count"] == 2
+    assert counts["Money"] == {"sentence_count": 1, "token_count": 2, "data_count": 1}
+    assert get_label("Party")[1]["data_count"] == 3
+
+    response, _ = run(labeledText_api.delete_labeled_data_by_id, niall_id)
+    assert response.status_code == 204
+    label_data_col = mongo_db[NER_LABEL_COLLECTION]
+    for label_name, inherit in [("Party", ["B-per", "B-org"]), ("Money", [])]:
+        assert get_label(label_name)[1]["data_count"] == \
+            label_data_col.count_documents(get_data_count_filter(label_name, inherit))
+    assert run(labeledText_api.get_all_label_data_counts)[1]["B-per"]["sentence_count"] == 0
+    config = mongo_db[CONFIG_COLLECTION].find_one({"collection_name": NER_LABEL_COLLECTION})
+    assert config["last_delete_time"] == config["last_update_time"]
+
+
+def test_label_counts_marked_stale_if_not_updated(mongo_db, word_tokenizer, monkeypatch):
+    # Not a write request, bulk_write raises.
+    monkeypatch.setattr(labeledText_api, "get_label_count_updates", lambda *args: [None])
+    response, result = run(labeledText_api.update_labeled_data, make_upload("Dan/Party"))
+    assert result["message"] == "Add Success"
+    response, counts = run(labeledText_api.get_all_label_data_counts)
+    assert counts == {}
+    assert datetime.fromisoformat(response.headers["X-Label-Counts-Stale-Since"])
+
+
+def test_label_catalog_etag(mongo_db):
+    define_label("Party", ["B-per"])
+    response, labels = get_labels()
+    etag = response.headers["ETag"]
+    assert [label["label_name"] for label in labels] == ["Party"]
+    assert get_labels(etag)[1].status_code == 304
+    assert get_labels(f'"other", W/{etag}')[1].status_code == 304
+
+    response, result = define_label("Party")
+    assert result["message"] == "Failed, Already have Party"
+    assert get_labels(etag)[1].status_code == 304
+
+    define_label("Date")
+    response, labels = get_labels(etag)
+    assert response.headers["ETag"] != etag
+    assert sorted(label["label_name"] for label in labels) == ["Date", "Party"]
+    assert get_label("Date")[1]["label_name"] == "Date"
+    assert get_label("Missing")[0].status_code == 404
+
+
+def insert_sentences(mongo_db, count):
+    documents = [{"_id": ObjectId(), "user": "tester", "encoded": b"\x00",
+                  "text_and_labels": [{"text": f"word{i}", "labels": ["Party"]}],
+                  "token_and_labels": [{"token": f"Ġword{i}", "labels": ["Party"]}]}
+                 for i in range(count)]
+    mongo_db[NER_LABEL_COLLECTION].insert_many(documents)
+    return [str(document["_id"]) for document in documents]
+
+
+def get_page(**kwargs):
+    return run(labeledText_api.get_labeled_data, **{"label_name": "Party", **kwargs})
+
+
+def test_paging_with_cursor(mongo_db):
+    ids = insert_sentences(mongo_db, 23)
+    paged_ids, cursor = [], None
+    while True:
+        response, result = get_page(start = 0, end = 10, cursor = cursor)
+        assert response.status_code == 200
+        assert all("encoded" not in document and "text_and_labels" not in document
+                   for document in result["data"])
+        paged_ids += [document["_id"] for document in result["data"]]
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+    assert paged_ids == ids
+
+    response, result = get_page(start = 5, end = 8, detail = True)
+    assert [document["_id"] for document in result["data"]] == ids[5:8]
+    assert result["data"][0]["token_and_labels"] == [{"token": "Ġword5", "labels": ["Party"]}]
+    assert len(get_page(start = -1, end = -1)[1]["data"]) == 23
+    assert get_page(start = 3, end = 3)[1]["data"] == []
+
+
+@pytest.mark.parametrize("page", [
+    {"cursor": "not-an-id"},
+    {"cursor": "0" * 23},
+    {"start": 10, "end": 5},
+    {"start": 0, "end": -1},
+])
+def test_invalid_page_is_a_bad_request(mongo_db, page):
+    response, result = get_page(**page)
+    assert response.status_code == 400
+    response, result = run(labeledText_api.get_labeled_data_by_custom_filter,
+                           labeledText_api.custom_filter(mongo_filter = {}), **page)
+    assert response.status_code == 400
+
+
+def find_by_filter(mongo_filter, **kwargs):
+    return run(labeledText_api.get_labeled_data_by_custom_filter,
+               labeledText_api.custom_filter(mongo_filter = mongo_filter), **kwargs)
+
+
+@pytest.mark.parametrize("operator", CUSTOM_FILTER_FORBIDDEN_OPERATORS)
+def test_find_by_filter_rejects_forbidden_operators(mongo_db, operator):
+    mongo_filter = {"$or": [{"user": "tester"}, {"$expr": {operator: "sleep(1000)"}}]}
+    response, result = find_by_filter(mongo_filter)
+    assert response.status_code == 400
+    assert operator in result["message"]
+
+
+COLLECTION_SCAN_EXPLAIN = {"queryPlanner": {"winningPlan": {
+    "stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "_id_"}}}}
+INDEX_SCAN_EXPLAIN = {"queryPlanner": {"winningPlan": {"queryPlan": {
+    "stage": "SORT", "inputStage": {"stage": "FETCH", "inputStage": {
+        "stage": "IXSCAN", "indexName": "user_1"}}}}}}
+
+
+def test_get_plan_summary():
+    assert get_plan_summary(COLLECTION_SCAN_EXPLAIN, {"user": "tester"}) == {
+        "stages": ["FETCH", "IXSCAN"], "indexes": ["_id_"],
+        "index_used": False, "collection_scan": True}
+    assert get_plan_summary(COLLECTION_SCAN_EXPLAIN, {"_id": ObjectId()})["index_used"]
+    summary = get_plan_summary(INDEX_SCAN_EXPLAIN, {"user": "tester"})
+    assert summary["stages"] == ["SORT", "FETCH", "IXSCAN"] and not summary["collection_scan"]
+
+
+@pytest.mark.parametrize("collection_scan", ["allow", "warn", "reject"])
+@pytest.mark.parametrize("explain", [COLLECTION_SCAN_EXPLAIN, INDEX_SCAN_EXPLAIN])
+def test_find_by_filter_collection_scan(mongo_db, monkeypatch, collection_scan, explain):
+    ids = insert_sentences(mongo_db, 3)
+    monkeypatch.setattr(labeledText_api, "CUSTOM_FILTER_COLLECTION_SCAN", collection_scan)
+    # mongomock has no explain command.
+    commands = []
+    async def command(self, command, **kwargs):
+        commands.append(command)
+        return explain
+    monkeypatch.setattr(type(db.client[DATABASE_NAME]), "command", command)
+
+    response, result = find_by_filter({"user": "tester"}, start = 0, end = 2)
+    scan = explain is COLLECTION_SCAN_EXPLAIN
+    if scan and collection_scan == "reject":
+        assert response.status_code == 400
+        assert result["explain"]["collection_scan"]
+        return
+    assert response.status_code == 200
+    assert [document["_id"] for document in result["data"]] == ids[:2]
+    assert ("warning" in result) == (scan and collection_scan == "warn")
+    assert "explain" not in result
+    if collection_scan == "allow":
+        assert commands == []
+    else:
+        assert commands[0]["explain"]["filter"] == {"user": "tester"}
+        assert commands[0]["explain"]["limit"] == 2
+
+    response, result = find_by_filter({"user": "tester"}, explain = True, cursor = ids[0])
+    assert commands[-1]["explain"]["filter"] == {"$and": [{"user": "tester"}, {"_id": {"$gt": ObjectId(ids[0])}}]}
+    assert result["explain"] == get_plan_summary(explain, {"user": "tester"})
@@ -0,0 +1,141 @@
+"""POST /data/labeledText:import and GET /data/labeledText:export,
+called directly on the mongomock database of the mongo_db fixture."""
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import BackgroundTasks, Response
+from starlette.requests import Request
+
+mongomock = pytest.importorskip("mongomock")
+import api.api_v1.endpoints.labeledText_export_api as labeledText_export_api
+import api.api_v1.endpoints.labeledText_import_api as labeledText_import_api
+import utils.labeled_data_import as labeled_data_import
+from core.config import NER_LABEL_COLLECTION, LABELED_DATA_IMPORT_JOB_COLLECTION
+
+JSONL = "\n".join([
+    json.dumps({"texts": [{"text": "Dan", "labels": ["Party"]}, {"text": "pays", "labels": ["O"]}]}),
+    json.dumps([{"text": "on", "labels": ["O"]}, {"text": "Monday", "labels": ["Date"]}]),
+    "not json",
+    json.dumps({"user": "other", "tags": ["old"], "texts": [{"text": "Dan", "labels": ["Party"]},
+                                                            {"text": "pays", "labels": ["O"]}]}),
+]).encode("utf-8") + b"\n" + '[{"text": "Caf\xe9", "labels": ["Party"]}]\n'.encode("latin-1")
+
+
+def make_request(body, chunk_size = 16):
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    async def receive():
+        return messages.pop(0)
+    return Request({"type": "http", "method": "POST", "headers": []}, receive)
+
+
+def start_import(body, **kwargs):
+    response, background_tasks = Response(), BackgroundTasks()
+    result = asyncio.run(labeledText_import_api.import_labeled_data(
+        make_request(body), response, background_tasks, **{"tags": ["imported"], **kwargs}))
+    return response, result, background_tasks
+
+
+@pytest.fixture
+def import_in_threads(monkeypatch, tmp_path):
+    """The import workers as threads, spawned processes would not see mongomock."""
+    monkeypatch.setattr(labeled_data_import, "ProcessPoolExecutor",
+                        lambda max_workers, mp_context: ThreadPoolExecutor(max_workers))
+    monkeypatch.setattr(labeled_data_import, "LABELED_DATA_IMPORT_BATCH_SIZE", 2)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+
+def test_import_job(mongo_db, word_tokenizer, import_in_threads, tmp_path):
+    response, result, background_tasks = start_import(JSONL, user = "tester")
+    assert result["message"] == "Success, start importing."
+    [task] = background_tasks.tasks
+    task.func(*task.args, **task.kwargs)
+    assert os.listdir(tmp_path) == []
+
+    job = asyncio.run(labeledText_import_api.track_labeled_data_import_status(result["trace_id"], Response()))
+    assert job["status"] == "done"
+    assert job["received_bytes"] == len(JSONL)
+    assert (job["processed_documents"], job["failed_documents"]) == (5, 2)
+    assert (job["inserted_sentences"], job["duplicated_sentences"]) == (2, 1)
+    assert [error["document"] for error in job["errors"]] == [2, 4]
+    assert job["errors"][1]["error_msg"].startswith("line 5: 'utf-8' codec can't decode")
+    sentences = list(mongo_db[NER_LABEL_COLLECTION].find())
+    assert [sentence["user"] for sentence in sentences] == ["tester", "tester"]
+    assert sentences[0]["tags"] == ["imported"]
+
+
+def test_import_latin_1(mongo_db, word_tokenizer, import_in_threads):
+    body = '[{"text": "Caf\xe9", "labels": ["Party"]}]\n'.encode("latin-1")
+    response, result, background_tasks = start_import(body, encoding = "latin-1")
+    [task] = background_tasks.tasks
+    task.func(*task.args, **task.kwargs)
+    [sentence] = mongo_db[NER_LABEL_COLLECTION].find()
+    assert sentence["text_and_labels"][0]["text"] == "Caf\xe9"
+
+
+@pytest.mark.parametrize("kwargs", [{"file_format": "xml"}, {"encoding": "utf-16"}])
+def test_import_rejects_unreadable_files(mongo_db, import_in_threads, tmp_path, kwargs):
+    response, result, background_tasks = start_import(JSONL, **kwargs)
+    assert response.status_code == 406
+    assert background_tasks.tasks == []
+    assert os.listdir(tmp_path) == []
+
+
+def test_import_removes_the_file_if_the_job_is_not_stored(mongo_db, import_in_threads, monkeypatch, tmp_path):
+    def insert_one(*args, **kwargs):
+        raise RuntimeError("server down")
+    monkeypatch.setattr(mongomock.collection.Collection, "insert_one", insert_one)
+    with pytest.raises(RuntimeError):
+        start_import(JSONL)
+    assert os.listdir(tmp_path) == []
+    assert mongo_db[LABELED_DATA_IMPORT_JOB_COLLECTION].count_documents({}) == 0
+
+
+def export(**kwargs):
+    response = asyncio.run(labeledText_export_api.export_labeled_data(Response(), **{
+        "labels": [], "tags": [], "user": None, "fields": [], "compress": False, **kwargs}))
+    if isinstance(response, dict):
+        return response
+    async def read():
+        return b"".join([chunk async for chunk in response.body_iterator])
+    return response, asyncio.run(read())
+
+
+def get_lines(body):
+    return [json.loads(line) for line in body.decode("utf-8").splitlines()]
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_export_ndjson(mongo_db, monkeypatch, batch_size):
+    monkeypatch.setattr(labeledText_export_api, "LABELED_DATA_EXPORT_BATCH_SIZE", batch_size)
+    documents = [{"user": user, "tags": tags, "encoded": b"\x01",
+                  "text_and_labels": [{"text": "Dan", "labels": labels}]}
+                 for user, tags, labels in [("a", ["x"], ["Party"]), ("b", ["y"], ["Date"]),
+                                            ("a", ["y"], ["Date", "Party"])]]
+    mongo_db[NER_LABEL_COLLECTION].insert_many(documents)
+
+    response, body = export()
+    assert response.media_type == "application/x-ndjson"
+    lines = get_lines(body)
+    assert [line["_id"] for line in lines] == [str(document["_id"]) for document in documents]
+    assert all("encoded" not in line for line in lines)
+
+    assert [line["user"] for line in get_lines(export(labels = ["Party"], tags = ["y"])[1])] == ["a"]
+    assert len(get_lines(export(user = "a")[1])) == 2
+    assert get_lines(export(fields = ["user", "encoded"])[1])[0].keys() == {"_id", "user"}
+
+    response, body = export(compress = True)
+    assert response.headers["Content-Disposition"].endswith('.jsonl.gz"')
+    assert get_lines(gzip.decompress(body)) == lines
+    assert export(labels = ["Missing"])[1] == b""
+    assert gzip.decompress(export(labels = ["Missing"], compress = True)[1]) == b""
+
+
+def test_export_rejects_unexportable_fields(mongo_db):
+    assert "can't be exported" in export(fields = ["encoded"])["message"]
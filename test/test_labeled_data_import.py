@@ -0,0 +1,52 @@
+"""The readers of POST /data/labeledText:import files in utils.labeled_data_import."""
+import io
+
+import pytest
+
+pytest.importorskip("mongomock")
+from utils.labeled_data_import import LineDecoder, get_encoding_error, read_uploads
+
+
+def read(content, file_format, encoding = "utf-8"):
+    return list(read_uploads(LineDecoder(io.BytesIO(content), encoding), file_format, "user", ["tag"]))
+
+
+def get_texts(upload):
+    return [(text["text"], text["labels"]) for text in upload["texts"]]
+
+
+def test_jsonl_undecodable_line_fails_alone():
+    uploads = read('{"texts": [{"text": "café", "labels": ["O"]}]}\n'.encode("utf-8")
+                   + b'{"texts": [{"text": "caf\xe9", "labels": ["O"]}]}\n'
+                   + b'\n[{"text": "a", "labels": ["Party"]}]\n', "jsonl")
+    assert get_texts(uploads[0]) == [("café", ["O"])]
+    assert isinstance(uploads[1], ValueError) and str(uploads[1]).startswith("line 2: 'utf-8' codec")
+    assert get_texts(uploads[2]) == [("a", ["Party"])]
+    assert uploads[2]["user"] == "user" and uploads[2]["tags"] == ["tag"]
+    assert len(uploads) == 3
+
+
+def test_csv_undecodable_row_fails_its_sentence():
+    content = (b"Sentence #,Word,newTag\n"
+               b"1,caf\xc3\xa9,O\n,b,O\n"
+               b"2,caf\xe9,O\n,x,O\n"
+               b"3,ok,O|Party\n")
+    uploads = read(content, "csv")
+    assert get_texts(uploads[0]) == [("café", ["O"]), ("b", ["O"])]
+    assert isinstance(uploads[1], ValueError) and str(uploads[1]).startswith("line 4:")
+    assert get_texts(uploads[2]) == [("ok", ["O", "Party"])]
+    # Each byte is a latin-1 character.
+    assert get_texts(read(content, "csv", "latin-1")[1]) == [("café", ["O"]), ("x", ["O"])]
+
+
+def test_csv_header_must_decode():
+    with pytest.raises(ValueError, match="CSV header"):
+        read(b"Sentence #,Wo\xffrd,newTag\n1,a,O\n", "csv")
+
+
+@pytest.mark.parametrize("encoding, supported", [
+    ("utf-8", True), ("utf-8-sig", True), ("latin-1", True), ("cp1252", True),
+    ("utf-16", False), ("rot13", False), ("unknown", False),
+])
+def test_get_encoding_error(encoding, supported):
+    assert (get_encoding_error(encoding) is None) == supported
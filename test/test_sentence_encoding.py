@@ -0,0 +1,43 @@
+"""The "encoded" field of utils.sentence_encoding, decoded as its module docstring describes."""
+import numpy as np
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+from core.config import LABEL_DICTIONARY_NAME
+from utils.sentence_encoding import (
+    encode_sentence,
+    update_label_dictionary,
+    get_label_names,
+    get_label_reservation_update,
+)
+
+
+def decode(encoded):
+    """(input ids, {token: set of label positions})."""
+    input_ids = np.frombuffer(encoded["input_ids"], dtype="<i4")
+    bitmask = np.frombuffer(encoded["label_bitmask"], dtype=np.uint8)
+    mask = np.unpackbits(bitmask.reshape(len(input_ids), encoded["label_bitmask_width"]), axis=1)
+    return input_ids.tolist(), [set(np.flatnonzero(row).tolist()) for row in mask]
+
+
+def test_encode_sentence_roundtrip_with_position_gaps():
+    # Positions 1, 2 and 4 were reserved by writers that lost the race.
+    label_positions = {"O": 0, "Party": 3, "Date": 5, "Money": 11}
+    ids_of_words = [[10, 11], [12], [13, 14, 15]]
+    labels_of_words = [["Party"], ["O"], ["Date", "Money"]]
+    encoded = encode_sentence(ids_of_words, labels_of_words, label_positions)
+    assert encoded["label_bitmask_width"] == 2
+    input_ids, positions = decode(encoded)
+    assert input_ids == [10, 11, 12, 13, 14, 15]
+    assert positions == [{3}, {3}, {0}, {5, 11}, {5, 11}, {5, 11}]
+
+
+def test_update_label_dictionary_keeps_positions():
+    config_col = mongomock.MongoClient().db.config
+    assert update_label_dictionary(config_col, ["Party", "O"]) == {"O": 0, "Party": 1}
+    # A concurrent writer reserved position 2 and did not push its label.
+    config_col.update_one(*get_label_reservation_update(1))
+    label_positions = update_label_dictionary(config_col, ["Date", "O"])
+    assert label_positions == {"O": 0, "Party": 1, "Date": 3}
+    assert config_col.find_one({"name": LABEL_DICTIONARY_NAME})["label_count"] == 4
+    assert get_label_names(label_positions) == ["O", "Party", "Date"]
@@ -0,0 +1,56 @@
+"""TemplateIndex of utils.template_classification.model, its scores and rebuilds."""
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+pytest.importorskip("mongomock")
+from utils.template_classification.model import TemplateIndex
+
+TEXTS = {
+    "bill-of-lading": "Bill of lading for ocean transport, shipper and consignee, port of loading",
+    "loan": "Promissory note, the borrower pays the lender the principal and interest",
+    "lease": "The tenant pays the landlord rent for the premises every month",
+    "sale": "The seller delivers the goods, the buyer pays the price on delivery",
+}
+QUERIES = [
+    "the tenant and the landlord of the premises",
+    "a vessel carries the goods from the port of loading",
+    "interest on the loan principal, paid by the borrower",
+    "royalties of a software license",
+    "",
+]
+
+
+def get_sklearn_scores(texts, queries):
+    vectorizer = TfidfVectorizer(sublinear_tf=True, stop_words="english")
+    matrix = vectorizer.fit_transform(texts)
+    return (vectorizer.transform(queries) @ matrix.T).toarray()
+
+
+def test_scores_match_tfidf_vectorizer():
+    index = TemplateIndex(TEXTS.keys(), TEXTS.values())
+    assert np.allclose(index.score_batch(QUERIES), get_sklearn_scores(list(TEXTS.values()), QUERIES))
+    assert index.names[index.top_k(index.score(QUERIES[0]), 1)[0]] == "lease"
+
+
+def test_rebuild_matches_a_full_fit():
+    index = TemplateIndex(TEXTS.keys(), TEXTS.values())
+    texts_by_name = dict(TEXTS)
+    # New words, a removed template and a new one.
+    texts_by_name["lease"] += "\nsublease of the apartment, security deposit"
+    del texts_by_name["loan"]
+    texts_by_name["license"] = "The licensor grants a software license against royalties"
+    new_index, changed_count = index.rebuild(texts_by_name)
+    assert changed_count == 2
+    assert new_index.names == list(texts_by_name.keys())
+    full_index = TemplateIndex(texts_by_name.keys(), texts_by_name.values())
+    assert np.array_equal(new_index.document_frequencies[[new_index.vocabulary[word] for word in full_index.vocabulary]],
+                          full_index.document_frequencies)
+    queries = QUERIES + ["security deposit of the apartment"]
+    assert np.allclose(new_index.score_batch(queries), get_sklearn_scores(list(texts_by_name.values()), queries))
+    # The old index is unchanged.
+    assert np.allclose(index.score_batch(QUERIES), get_sklearn_scores(list(TEXTS.values()), QUERIES))
+
+    same_index, changed_count = new_index.rebuild(texts_by_name)
+    assert changed_count == 0
+    assert np.allclose(same_index.matrix.toarray(), new_index.matrix.toarray())
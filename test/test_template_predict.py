@@ -0,0 +1,95 @@
+"""Template classification: the classify endpoints of
+api/api_v1/endpoints/template_predict.py and the index rebuild jobs
+of utils.template_classification.model."""
+import pytest
+from fastapi import Response
+
+pytest.importorskip("mongomock")
+from utils.template_classification import model
+from core.config import (
+    Feedback_Template_Collection,
+    TEMPLATE_RETRAIN_JOB_COLLECTION,
+    TEMPLATE_INDEX_NAME,
+    CONFIG_COLLECTION,
+)
+
+try:
+    from api.api_v1.endpoints import template_predict
+except Exception:
+    # The request bodies are pydantic 1 models, see requirements.txt.
+    template_predict = None
+requires_endpoints = pytest.mark.skipif(template_predict is None,
+                                        reason = "template_predict can't be imported")
+
+TEXTS = [model.example_text, "The tenant pays the rent of the premises to the landlord.", ""]
+
+
+@pytest.fixture
+def index(monkeypatch, mongo_db):
+    """Rebuilds of the tests are undone after them."""
+    monkeypatch.setattr(model, "index", model.index)
+    monkeypatch.setattr(model, "index_update_time", None)
+    monkeypatch.setattr(model, "index_checked_at", 0)
+    return model.index
+
+
+def test_classify_batch_matches_classify(index):
+    predictions = model.classify_batch(TEXTS, 5)
+    assert len(predictions) == len(TEXTS)
+    for text, text_predictions in zip(TEXTS, predictions):
+        assert len(text_predictions) == 5
+        expected = model.classify(text, 5)
+        assert [prediction["name"] for prediction in text_predictions] == \
+            [prediction["name"] for prediction in expected]
+        assert [prediction["confidence"] for prediction in text_predictions] == \
+            pytest.approx([prediction["confidence"] for prediction in expected])
+    assert predictions[0][0]["name"] == "bill-of-lading"
+    all_predictions = model.classify(TEXTS[0])
+    assert len(all_predictions) == len(index)
+    confidences = [prediction["confidence"] for prediction in all_predictions]
+    assert confidences == sorted(confidences, reverse = True)
+
+
+def test_retrain_job_embeds_the_templates_with_feedback(index, mongo_db):
+    name = "helloworld"
+    text = "zeppelin charter of the airship hangar"
+    assert model.classify(text, 1)[0]["confidence"] == 0
+    mongo_db[Feedback_Template_Collection].insert_one({"user": "tester", "text": text, "template": name})
+    job_id = mongo_db[TEMPLATE_RETRAIN_JOB_COLLECTION].insert_one({"status": "waiting"}).inserted_id
+    model.run_retrain_job(job_id)
+
+    job = mongo_db[TEMPLATE_RETRAIN_JOB_COLLECTION].find_one({"_id": job_id})
+    assert job["status"] == "done"
+    assert (job["template_count"], job["re_embedded_count"], job["train_data_count"]) == (len(index), 1, 1)
+    assert model.classify(text, 1)[0]["name"] == name
+    config = mongo_db[CONFIG_COLLECTION].find_one({"name": TEMPLATE_INDEX_NAME})
+    assert config["last_update_time"] == model.index_update_time
+
+
+def test_check_and_update_index_follows_other_workers(index, mongo_db, monkeypatch):
+    assert not model.check_and_update_index()
+    mongo_db[CONFIG_COLLECTION].insert_one({
+        "name": TEMPLATE_INDEX_NAME, "last_update_time": model.datetime(2021, 8, 4)})
+    # Checked less than SLEEP_INTERVAL_SECOND ago.
+    assert not model.check_and_update_index()
+    monkeypatch.setattr(model, "index_checked_at", 0)
+    assert model.check_and_update_index()
+    model.index_rebuild_thread.join()
+    assert model.index_update_time == model.datetime(2021, 8, 4)
+    monkeypatch.setattr(model, "index_checked_at", 0)
+    assert not model.check_and_update_index()
+
+
+@requires_endpoints
+def test_classify_template_endpoints(index):
+    response = Response()
+    result = template_predict.classify_template(response, template_predict.classify_template_body(
+        text = TEXTS[0], return_max_size = 3))
+    assert result["prediction"] == model.classify(TEXTS[0], 3)
+    result = template_predict.classify_template_batch(response, template_predict.classify_template_batch_body(
+        texts = TEXTS, return_max_size = 3))
+    assert [[prediction["name"] for prediction in predictions] for predictions in result["prediction"]] == \
+        [[prediction["name"] for prediction in model.classify(text, 3)] for text in TEXTS]
+    result = template_predict.classify_template_batch(response, template_predict.classify_template_batch_body(
+        texts = []))
+    assert result["prediction"] == []
@@ -0,0 +1,57 @@
+"""Peak memory of get_training_data and of the streaming dataset on the cache
+must not grow with the corpus, only with the part and chunk sizes."""
+import tracemalloc
+
+import numpy as np
+import pytest
+from bson.objectid import ObjectId
+
+pytest.importorskip("mongomock")
+import utils.trainer.NER as NER
+from core.config import DATABASE_NAME, NER_LABEL_COLLECTION, CONFIG_COLLECTION
+
+LABELS = ["B-per", "I-per", "Party", "String", "O"]
+
+
+class GeneratedCollection:
+    """A read-only collection of sentence_count generated sentences, made while
+    iterating: unlike mongomock, it holds no corpus in memory."""
+    def __init__(self, sentence_count):
+        self.sentence_count = sentence_count
+
+    def find(self, mongo_filter = None, projection = None):
+        generator = np.random.default_rng(0)
+        for i in range(self.sentence_count):
+            lengths = generator.integers(5, 40)
+            yield {"_id": ObjectId(i.to_bytes(12, "big")), "token_and_labels": [
+                {"token": f"Ġtok{token}", "labels": [LABELS[token % len(LABELS)]]}
+                for token in generator.integers(0, 5000, lengths).tolist()]}
+
+    def count_documents(self, mongo_filter):
+        return self.sentence_count
+
+    def find_one(self, mongo_filter):
+        return None
+
+
+def get_peak_memory(monkeypatch, tmp_path, tokenizer, sentence_count):
+    col = GeneratedCollection(sentence_count)
+    monkeypatch.setattr(NER, "client", {DATABASE_NAME: {NER_LABEL_COLLECTION: col, CONFIG_COLLECTION: col}})
+    monkeypatch.setattr(NER, "NER_TRAINER_DATA_CACHE_DIR", str(tmp_path / str(sentence_count)))
+    monkeypatch.setattr(NER, "NER_TRAINER_DATA_CACHE_FETCH_SIZE", 500)
+    tracemalloc.start()
+    try:
+        data = NER.get_training_data({})
+        dataset = NER.NER_Streaming_Dataset_for_Adapter(tokenizer, "Party", {}, data, chunk_size = 500)
+        sentences = sum(len(batch) for batch in dataset)
+        return sentences, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_peak_memory_is_bounded_by_the_part_size(monkeypatch, tmp_path, tokenizer, label_catalog):
+    small_sentences, small_peak = get_peak_memory(monkeypatch, tmp_path, tokenizer, 2000)
+    large_sentences, large_peak = get_peak_memory(monkeypatch, tmp_path, tokenizer, 8000)
+    assert (small_sentences, large_sentences) == (2000, 8000)
+    # The sentence _ids are still read whole, 12 bytes each.
+    assert large_peak < 1.5 * small_peak
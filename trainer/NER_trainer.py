@@ -15,17 +15,29 @@ from core.config import (
     NER_TRAIN_BATCH_SIZE,
     NER_TRAIN_DEFAULT_FILTER,
     NER_TRAIN_DEVIDE_ID,
+    NER_TRAIN_STREAMING,
+    NER_TRAIN_STREAM_SOURCE,
+    NER_TRAIN_PARALLEL_LABELS,
     PATH,
     NER_ADAPTERS_PATH,
 )
 from torch.utils.data import Dataset
 from sklearn.preprocessing import OneHotEncoder
 
-from utils.trainer.NER import get_training_dataframe, NER_Dataset_for_Adapter
+from utils.trainer.NER import (
+    get_training_data,
+    get_target_data_by_filter,
+    get_train_loader,
+    get_padding_counts,
+    get_epoch_stats,
+    NER_Dataset_for_Adapter,
+    NER_Streaming_Dataset_for_Adapter,
+)
 import re
 import sys
 import datetime
 from utils.trainer_communicate import update_pid
+from utils.label_catalog import get_label_catalog, update_label_catalog_version
 
 import os
 # When Each Train
@@ -76,34 +88,39 @@ def create_mini_batch(samples):
     return tokens_tensors, segments_tensors, masks_tensors, label_ids
 
 
-def train_model_with_auto_adjust_batch(model, i, data, now_is_training, label_index):
+def train_model_with_auto_adjust_batch(model, i, data, jobs, label_indexes):
     """Use divide and conquer to avoid CUDA out of memory error (OOM).
     If Out of memory, try again with half of the batch size.
-    If OOM again, try again with half and half of the batch, etc."""
+    If OOM again, try again with half and half of the batch, etc.
+    With several labels the model runs a Parallel of their adapters and
+    returns an output per head, the BCE losses of the labels are summed.
+    Return the loss per label."""
     datas = [data]
     while len(datas) != 0:
         data = datas[0]
         try:
             # Train
             tokens_tensors, segments_tensors, \
-            masks_tensors, labels = [t.to(device) for t in data]
+            masks_tensors, labels = [t.to(device, non_blocking=True) for t in data]
             outputs = model(input_ids = tokens_tensors,
                 attention_mask=masks_tensors,
                 token_type_ids=segments_tensors)
-            
-            logits = outputs[0]
-
-            current_label = labels.view(-1, labels.shape[-1])[:, label_index]
-            current_label = current_label.view(-1)
+            if len(label_indexes) == 1:
+                outputs = [outputs]
 
-            active_logits = logits.view(-1, logits.shape[-1])[masks_tensors.view(-1) == 1]
-
-            actual = current_label[masks_tensors.view(-1)== 1].float().view(-1,1)
+            active_mask = masks_tensors.view(-1) == 1
+            active_labels = labels.view(-1, labels.shape[-1])[active_mask]
 
             loss_fct = torch.nn.BCEWithLogitsLoss()
 
-            loss = loss_fct(active_logits, actual)
-            loss.backward()
+            losses = []
+            for output, label_index in zip(outputs, label_indexes):
+                logits = output[0]
+                active_logits = logits.view(-1, logits.shape[-1])[active_mask]
+                actual = active_labels[:, label_index].float().view(-1,1)
+                losses.append(loss_fct(active_logits, actual))
+
+            sum(losses).backward()
             datas.pop(0)
         except Exception as error:
             if "CUDA" not in error.args[0]:
@@ -115,7 +132,8 @@ def train_model_with_auto_adjust_batch(model, i, data, now_is_training, label_in
             # masks_tensors, labels
             # torch.cuda.empty_cache()
             msg = f"Failed, CUDA out of memory, dividing data from shape {np.array(datas[0][0]).shape}"
-            queue_task_log(now_is_training["_id"], msg)
+            for job in jobs:
+                queue_task_log(job["_id"], msg)
             length = len(datas[0][0])
             half = int(length/2)
             if length != 1:
@@ -140,24 +158,55 @@ def train_model_with_auto_adjust_batch(model, i, data, now_is_training, label_in
     # with threading clean cache and join, cost: 01:44 per 100 iteration.
     # with threading clean cache without join, cost: 01:44 per 100 iteration.
     ## Therefore, I clean cache directly in this case.
-    return loss
+    return losses
+
+def load_base_model():
+    """roberta-base with heads, loaded once and kept for every job."""
+    from transformers import RobertaConfig, RobertaModelWithHeads
+    config = RobertaConfig.from_pretrained(
+        "roberta-base"
+    )
+    with mute_logging():
+        model = RobertaModelWithHeads.from_pretrained(
+            "roberta-base",
+            config=config,
+            )
+    return model.to(device)
+
+def remove_adapters(model, label_names):
+    """Delete the adapters and heads of a job from the base model,
+    so the next job starts from the plain roberta-base again."""
+    for label in label_names:
+        if label in model.config.adapters:
+            model.delete_adapter(label)
+        if label in model.heads:
+            model.delete_head(label)
+    torch.cuda.empty_cache()
+
+def get_parallel_jobs(training_queue):
+    """The oldest job, and the jobs trained with it in one pass:
+    the same train_data_filter and epochs, a label at most once,
+    up to NER_TRAIN_PARALLEL_LABELS jobs."""
+    now_is_training = training_queue[0]
+    jobs = [now_is_training]
+    for job in training_queue[1:]:
+        if len(jobs) >= NER_TRAIN_PARALLEL_LABELS:
+            break
+        if (job["train_data_filter"] == now_is_training["train_data_filter"]
+                and job["epochs"] == now_is_training["epochs"]
+                and job["label_name"] not in [trained["label_name"] for trained in jobs]):
+            jobs.append(job)
+    return jobs
     
 
-def get_target_df_by_filter(df, train_data_search_filter):
-    client = pymongo.MongoClient(MONGODB_URL)
-    col = client[DATABASE_NAME][NER_LABEL_COLLECTION]
-
-    wanted_id = list(map(lambda x: str(x["_id"]),
-                            list(col.find(train_data_search_filter, {"_id": True}))))
-
-    target_df = df[df["Sentence #"].isin(wanted_id)]
-    return target_df
-
 def main():
     try:
-        df = get_training_dataframe(NER_TRAIN_DEFAULT_FILTER)    
+        training_data = None
+        if not NER_TRAIN_STREAMING or NER_TRAIN_STREAM_SOURCE == "cache":
+            training_data = get_training_data(NER_TRAIN_DEFAULT_FILTER)    
         from transformers import RobertaTokenizer
         tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
+        model = load_base_model()
 
         while True:
             dateStamp = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z")
@@ -174,107 +223,122 @@ def main():
             training_queue.sort(key = lambda x: x["add_time"], reverse= False)
 
             now_is_training = training_queue[0]
+            jobs = get_parallel_jobs(training_queue)
 
             # Update parameter On Each Iter
             train_data_search_filter = now_is_training["train_data_filter"]
-            label_name = now_is_training["label_name"]
+            label_names = [job["label_name"] for job in jobs]
+            # A single label trains its adapter alone, as before.
+            label_name = label_names[0] if len(label_names) == 1 else label_names
             Epoch_Times = now_is_training["epochs"]
 
-            print(f"""Prepare to train {label_name} with trace id {str(now_is_training["_id"])}""")
+            print(f"""Prepare to train {", ".join(label_names)} with trace id {", ".join(str(job["_id"]) for job in jobs)}""")
 
-            target_df = get_target_df_by_filter(df, train_data_search_filter)
-            trainset = NER_Dataset_for_Adapter(tokenizer, target_df, label_name)
+            if NER_TRAIN_STREAMING:
+                trainset = NER_Streaming_Dataset_for_Adapter(
+                    tokenizer, label_name, train_data_search_filter, training_data)
+            else:
+                target_data = get_target_data_by_filter(training_data, train_data_search_filter)
+                trainset = NER_Dataset_for_Adapter(tokenizer, target_data, label_name)
 
-            log_msg = f"Start training {label_name} with batch_size={NER_TRAIN_BATCH_SIZE} and epoch={Epoch_Times}, have {len(training_queue) -1} in the waiting line..."
+            log_msg = f"Start training {', '.join(label_names)} with batch_size={NER_TRAIN_BATCH_SIZE} and epoch={Epoch_Times}, have {len(training_queue) - len(jobs)} in the waiting line..."
             trainer_log(log_msg)
-            queue_task_log(now_is_training["_id"], log_msg)
+            for job in jobs:
+                queue_task_log(job["_id"], log_msg)
 
             label_define_col = client[DATABASE_NAME][LABEL_COLLECTION]
-            label_define_col.update_one(
-                {"label_name": label_name},
+            label_define_col.update_many(
+                {"label_name": {"$in": label_names}},
                 {"$set": {
                     "adapter.training_status": "training",
                     }
                 })
-            now_is_training_label_defined = label_define_col.find_one({"label_name": label_name})
-            training_job_col.update_one({
-                    "_id": now_is_training["_id"],
-                },{
-                    "$set": {
-                        "status": "training",
-                        "train_data_count": len(trainset),
-                        "positive_label": trainset.positive_label,
-                        "label_snapsnot": {
-                            "_id": str(now_is_training_label_defined["_id"]),
-                            "user": now_is_training_label_defined["user"],
-                            "label_name": now_is_training_label_defined["label_name"],
-                            "inherit": now_is_training_label_defined["inherit"],
-                            "alias_as": now_is_training_label_defined["alias_as"],
-                            "comment": now_is_training_label_defined["comment"],
-                            "tags": now_is_training_label_defined["tags"],
+            update_label_catalog_version()
+            label_catalog = get_label_catalog()
+            for job in jobs:
+                now_is_training_label_defined = label_catalog.get_label(job["label_name"])
+                training_job_col.update_one({
+                        "_id": job["_id"],
+                    },{
+                        "$set": {
+                            "status": "training",
+                            "train_data_count": len(trainset),
+                            "positive_label": trainset.positive_labels[job["label_name"]],
+                            "parallel_trace_ids": [str(trained["_id"]) for trained in jobs],
+                            "label_snapsnot": {
+                                "_id": str(now_is_training_label_defined["_id"]),
+                                "user": now_is_training_label_defined["user"],
+                                "label_name": now_is_training_label_defined["label_name"],
+                                "inherit": now_is_training_label_defined["inherit"],
+                                "alias_as": now_is_training_label_defined["alias_as"],
+                                "comment": now_is_training_label_defined["comment"],
+                                "tags": now_is_training_label_defined["tags"],
+                            }
                         }
-                    }
-                })
+                    })
 
             
 
-            trainloader = DataLoader(trainset, batch_size=NER_TRAIN_BATCH_SIZE, 
-                                    collate_fn=create_mini_batch)
+            trainloader = get_train_loader(trainset, create_mini_batch)
 
-            from transformers import RobertaConfig, RobertaModelWithHeads
-            config = RobertaConfig.from_pretrained(
-                "roberta-base"
-            )
+            from transformers.adapters.composition import Parallel
 
             try:
-                with mute_logging():
-                    model = RobertaModelWithHeads.from_pretrained(
-                        "roberta-base",
-                        config=config,
+                for label in label_names:
+                    model.add_adapter(label)
+                    model.add_tagging_head(
+                        label,
+                        num_labels=1
                         )
-
-                
-                model.add_adapter(label_name)
-                model.add_tagging_head(
-                    label_name,
-                    num_labels=1
-                    )
                 
-                model.train_adapter(label_name)
+                # A Parallel of adapters also activates the head of each adapter.
+                model.train_adapter(Parallel(*label_names) if len(label_names) > 1 else label_name)
+                # Only the new adapters and heads are moved, the base model is on device already.
                 model = model.to(device)
 
+                # train_adapter froze the base model, only the adapters and heads are optimized.
+                trainable_parameters = [(n, p) for n, p in model.named_parameters() if p.requires_grad]
                 no_decay = ["bias", "LayerNorm.weight"]
                 optimizer_grouped_parameters = [
                                 {
-                                    "params": [p for n, p in model.named_parameters() if not any(nd in n for nd in no_decay)],
+                                    "params": [p for n, p in trainable_parameters if not any(nd in n for nd in no_decay)],
                                     "weight_decay": 1e-5,
                                 },
                                 {
-                                    "params": [p for n, p in model.named_parameters() if any(nd in n for nd in no_decay)],
+                                    "params": [p for n, p in trainable_parameters if any(nd in n for nd in no_decay)],
                                     "weight_decay": 0.0,
                                 },
                             ]
                 optimizer = torch.optim.AdamW(params=optimizer_grouped_parameters, lr=1e-4)
 
+                label_indexes = [trainset.label_map[label] for label in label_names]
                 for epoch in range(Epoch_Times):
                     epoch += 1 # epoch start from 1
-                    print(f"\n{label_name} epoch {epoch} start")
+                    print(f"\n{', '.join(label_names)} epoch {epoch} start")
                     start_time = datetime.datetime.now()
-                    label_index = trainset.label_map[label_name]
+                    token_count, padded_count = 0, 0
                     for i, data in enumerate(trainloader):
-                        loss = train_model_with_auto_adjust_batch(model, i, data, now_is_training, label_index)
+                        batch_token_count, batch_padded_count = get_padding_counts(data[3])
+                        token_count += batch_token_count
+                        padded_count += batch_padded_count
+                        losses = train_model_with_auto_adjust_batch(model, i, data, jobs, label_indexes)
                         if i % 10 == 0:
                             # with threading to push log onto db, cost: 0:01:43.776396 per 100 iteration.
                             # without threading to push log onto db, cost: 0:01:43.495900 per 100 iteration.
-                            msg = f"[At Epoch {epoch} Round {i}] Loss: {loss}"
-                            queue_task_log(now_is_training["_id"], msg)
+                            for job, loss in zip(jobs, losses):
+                                msg = f"[At Epoch {epoch} Round {i}] Loss: {loss}"
+                                queue_task_log(job["_id"], msg)
                         optimizer.step()
                         optimizer.zero_grad()
-                    print(f"{label_name} epoch {epoch} end, this epoch cost {datetime.datetime.now() - start_time}")
+                    epoch_stats = get_epoch_stats(epoch, i + 1, token_count, padded_count)
+                    training_job_col.update_many({"_id": {"$in": [job["_id"] for job in jobs]}}, {
+                        "$push": {"epoch_stats": epoch_stats}})
+                    print(f"{', '.join(label_names)} epoch {epoch} end, padding ratio {epoch_stats['padding_ratio']:.2%}, this epoch cost {datetime.datetime.now() - start_time}")
                 print("Finish, Saving")
-                filename = f"{label_name}_epoch_{Epoch_Times}_{dateStamp}"
-                model.save_adapter(f"{NER_ADAPTERS_PATH}/save_adapters/{filename}", model.active_adapters[0])
-                model.save_head(f"{NER_ADAPTERS_PATH}/save_heads/{filename}", model.active_head)
+                for label in label_names:
+                    filename = f"{label}_epoch_{Epoch_Times}_{dateStamp}"
+                    model.save_adapter(f"{NER_ADAPTERS_PATH}/save_adapters/{filename}", label)
+                    model.save_head(f"{NER_ADAPTERS_PATH}/save_heads/{filename}", label)
             except Exception as error:
                 import traceback
                 import sys
@@ -282,31 +346,37 @@ def main():
                 result = "".join(traceback.format_exception(exc_type, exc_value, exc_tb))
                 print(result)
                 trainer_log(result)
-                queue_task_log(now_is_training["_id"], result)
+                for job in jobs:
+                    queue_task_log(job["_id"], result)
                 raise error
-
-            training_job_col.update_one({
-                    "_id": now_is_training["_id"],
-                },{
-                    "$set": {
-                        "store_filename": f"{label_name}_epoch_{Epoch_Times}_{dateStamp}",
-                        "status": "done",
-                    }
-                })
+            finally:
+                remove_adapters(model, label_names)
 
             label_define_col = client[DATABASE_NAME][LABEL_COLLECTION]
-            now_time = datetime.datetime.now()
-            label_define_col.update_one(
-                {"label_name": label_name},
-                {"$set": {"adapter.current_filename": f"{label_name}_epoch_{Epoch_Times}_{dateStamp}",
-                        "adapter.training_status": "done",
-                        "adapter.update_time": now_time,
-                    },
-                "$push": {"adapter.history": {
-                        "filename": f"{label_name}_epoch_{Epoch_Times}_{dateStamp}",
-                        "time": now_time,
-                        "trainer_job_id": str(now_is_training["_id"]),
-                    }}})
+            for job in jobs:
+                filename = f"""{job["label_name"]}_epoch_{Epoch_Times}_{dateStamp}"""
+                training_job_col.update_one({
+                        "_id": job["_id"],
+                    },{
+                        "$set": {
+                            "store_filename": filename,
+                            "status": "done",
+                        }
+                    })
+
+                now_time = datetime.datetime.now()
+                label_define_col.update_one(
+                    {"label_name": job["label_name"]},
+                    {"$set": {"adapter.current_filename": filename,
+                            "adapter.training_status": "done",
+                            "adapter.update_time": now_time,
+                        },
+                    "$push": {"adapter.history": {
+                            "filename": filename,
+                            "time": now_time,
+                            "trainer_job_id": str(job["_id"]),
+                        }}})
+            update_label_catalog_version()
     except KeyboardInterrupt:
         import sys
         sys.exit(1)
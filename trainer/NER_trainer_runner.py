@@ -35,7 +35,6 @@ if not trainer:
         "name": NER_ADAPTERS_TRAINER_NAME,
         "status": "down",
         "restart_required": False,
-        "last_data_cache_timestamp": datetime.datetime.strptime("1999", "%Y"),
         "logs": [],
     }
     config_col.insert_one(trainer_obj)
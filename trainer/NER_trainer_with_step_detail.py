@@ -109,16 +109,6 @@ def forward_model_with_auto_adjust_batch(i, data):
         # without threading to push log onto db, cost: 0:01:43.495900 per 100 iteration.
         queue_task_log(now_is_training["_id"], f"[At Epoch {epoch} Round {i}] Loss: {loss}")
 
-def get_target_df_by_filter(df, train_data_search_filter):
-    client = pymongo.MongoClient(MONGODB_URL)
-    col = client[DATABASE_NAME][NER_LABEL_COLLECTION]
-
-    wanted_id = list(map(lambda x: str(x["_id"]),
-                            list(col.find(train_data_search_filter, {"_id": True}))))
-
-    target_df = df[df["Sentence #"].isin(wanted_id)]
-    return target_df
-
 try:
     import pandas as pd
     import pymongo
@@ -142,7 +132,8 @@ try:
     from torch.utils.data import Dataset
     from sklearn.preprocessing import OneHotEncoder
 
-    from utils.trainer.NER import get_training_dataframe, NER_Dataset_for_Adapter
+    from utils.trainer.NER import get_training_data, get_target_data_by_filter, get_train_loader, get_padding_counts, get_epoch_stats, NER_Dataset_for_Adapter
+    from utils.label_catalog import update_label_catalog_version
     import re
     import sys
     import datetime
@@ -162,7 +153,7 @@ try:
     
     device = torch.device(f"cuda:{NER_TRAIN_DEVIDE_ID}" if torch.cuda.is_available() else "cpu")
 
-    df = get_training_dataframe(NER_TRAIN_DEFAULT_FILTER)    
+    training_data = get_training_data(NER_TRAIN_DEFAULT_FILTER)    
     from transformers import RobertaTokenizer
     tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
 
@@ -195,8 +186,8 @@ try:
 
         print(f"""Prepare to train {label_name} with trace id {str(now_is_training["_id"])}""")
 
-        target_df = get_target_df_by_filter(df, train_data_search_filter)
-        trainset = NER_Dataset_for_Adapter(tokenizer, target_df, label_name)
+        target_data = get_target_data_by_filter(training_data, train_data_search_filter)
+        trainset = NER_Dataset_for_Adapter(tokenizer, target_data, label_name)
 
         log_msg = f"Start training {label_name} with batch_size={NER_TRAIN_BATCH_SIZE} and epoch={Epoch_Times}, have {len(training_queue) -1} in the waiting line..."
         trainer_log(log_msg)
@@ -218,9 +209,9 @@ try:
                 "adapter.training_status": "training new one",
                 }
             })
+        update_label_catalog_version()
 
-        trainloader = DataLoader(trainset, batch_size=NER_TRAIN_BATCH_SIZE, 
-                                 collate_fn=create_mini_batch)
+        trainloader = get_train_loader(trainset, create_mini_batch)
 
         from transformers import RobertaConfig, RobertaModelWithHeads
         config = RobertaConfig.from_pretrained(
@@ -262,10 +253,17 @@ try:
                 print(f"\n{label_name} epoch {epoch} start")
                 start_time = datetime.datetime.now()
 
+                token_count, padded_count = 0, 0
                 for i, data in enumerate(trainloader):
+                    batch_token_count, batch_padded_count = get_padding_counts(data[3])
+                    token_count += batch_token_count
+                    padded_count += batch_padded_count
                     forward_model_with_auto_adjust_batch(i, data)
 
-                print(f"{label_name} epoch {epoch} end, this epoch cost {datetime.datetime.now() - start_time}")
+                epoch_stats = get_epoch_stats(epoch, i + 1, token_count, padded_count)
+                training_job_col.update_one({"_id": now_is_training["_id"]}, {
+                    "$push": {"epoch_stats": epoch_stats}})
+                print(f"{label_name} epoch {epoch} end, padding ratio {epoch_stats['padding_ratio']:.2%}, this epoch cost {datetime.datetime.now() - start_time}")
             dateStamp = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z")
             filename = f"{label_name}_epoch_{Epoch_Times}_{dateStamp}"
             print(f"Finish, Saving {filename}")
@@ -307,6 +305,7 @@ try:
                     "time": now_time,
                     "trainer_job_id": str(now_is_training["_id"]),
                 }}})
+        update_label_catalog_version()
 except KeyboardInterrupt:
     sys.exit(1)
 except Exception as e:
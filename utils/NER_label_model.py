@@ -37,12 +37,7 @@ with mute_logging():
 import os
 import re
 
-# This is a asyncio status, but just use mongo client directly to save develop time
-from pymongo import MongoClient
 from core.config import (
-    MONGODB_URL,
-    DATABASE_NAME,
-    LABEL_COLLECTION,
     NER_ADAPTERS_PATH,
     PREDICT_DEVICE,
 )
@@ -55,13 +50,11 @@ def check_adapter_filename_valid(filename):
     else:
         return False
 
-mongo_client = MongoClient(MONGODB_URL)
-labels_col = mongo_client[DATABASE_NAME][LABEL_COLLECTION]
+from utils.label_catalog import get_label_catalog
 
 def get_label_adapter_filenames():
     all_adapters = {}
-    labels = labels_col.find()
-    labels = list(labels)
+    labels = get_label_catalog().get_labels()
     for label in labels:
         if label["adapter"]["current_filename"]:
             filename = label["adapter"]["current_filename"]
@@ -120,9 +113,7 @@ def check_and_update_adapter():
 
 def have_adapter_version(label_name, adapter_filename):
     print(label_name, adapter_filename)
-    label = labels_col.find_one(
-        {"label_name": label_name},
-        {"adapter": True})
+    label = get_label_catalog().get_label(label_name)
     result = filter(lambda x: x["filename"] == adapter_filename,
                     label["adapter"]["history"])
     result = list(result)
@@ -0,0 +1,95 @@
+"""Label definitions of LABEL_COLLECTION, cached in each process.
+
+Every write to LABEL_COLLECTION must call update_label_catalog_version
+(or asyncio_update_label_catalog_version) after it. A read only checks the
+version document in CONFIG_COLLECTION, and loads the labels again when
+the version changed."""
+import copy
+import threading
+from core.config import (
+    MONGODB_URL,
+    DATABASE_NAME,
+    LABEL_COLLECTION,
+    CONFIG_COLLECTION,
+    LABEL_CATALOG_NAME,
+)
+
+VERSION_FILTER = {"name": LABEL_CATALOG_NAME}
+VERSION_UPDATE = {"$inc": {"version": 1}}
+
+
+class LabelCatalog:
+    def __init__(self, version = None, labels = ()):
+        self.version = version
+        self.labels = {label["label_name"]: label for label in labels}
+
+    def get_labels(self):
+        """Copies of all label definitions, safe to modify."""
+        return copy.deepcopy(list(self.labels.values()))
+
+    def get_label(self, label_name):
+        """Copy of a label definition, None if not found."""
+        return copy.deepcopy(self.labels.get(label_name))
+
+    def get_positive_labels(self, label_name):
+        """Labels trained as positive for label_name:
+        itself, its inherit labels and the labels alias_as it."""
+        alias = [label["label_name"] for label in self.labels.values()
+                 if label_name in label.get("alias_as", [])]
+        return [label_name] + alias + self.labels[label_name]["inherit"]
+
+    def get_label_inherits(self):
+        """{label_name: inherit labels} of every label, see utils.label_counts."""
+        return {label_name: list(label["inherit"]) for label_name, label in self.labels.items()}
+
+
+def get_version(version_document):
+    return version_document["version"] if version_document else 0
+
+
+# Sync, for the trainer and the model modules.
+_catalog = LabelCatalog()
+_catalog_lock = threading.Lock()
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        from pymongo import MongoClient
+        _client = MongoClient(MONGODB_URL)
+    return _client
+
+def get_label_catalog():
+    global _catalog
+    config_col = get_client()[DATABASE_NAME][CONFIG_COLLECTION]
+    version = get_version(config_col.find_one(VERSION_FILTER))
+    with _catalog_lock:
+        if version != _catalog.version:
+            labels = get_client()[DATABASE_NAME][LABEL_COLLECTION].find()
+            _catalog = LabelCatalog(version, list(labels))
+        return _catalog
+
+def update_label_catalog_version():
+    config_col = get_client()[DATABASE_NAME][CONFIG_COLLECTION]
+    config_col.update_one(VERSION_FILTER, VERSION_UPDATE, upsert=True)
+
+
+# Async, for the API.
+_asyncio_catalog = LabelCatalog()
+
+async def asyncio_get_label_catalog():
+    global _asyncio_catalog
+    from db.mongodb import get_database
+    mongo_client = await get_database()
+    config_col = mongo_client[DATABASE_NAME][CONFIG_COLLECTION]
+    version = get_version(await config_col.find_one(VERSION_FILTER))
+    if version != _asyncio_catalog.version:
+        labels = mongo_client[DATABASE_NAME][LABEL_COLLECTION].find()
+        _asyncio_catalog = LabelCatalog(version, await labels.to_list(None))
+    return _asyncio_catalog
+
+async def asyncio_update_label_catalog_version():
+    from db.mongodb import get_database
+    mongo_client = await get_database()
+    config_col = mongo_client[DATABASE_NAME][CONFIG_COLLECTION]
+    await config_col.update_one(VERSION_FILTER, VERSION_UPDATE, upsert=True)
@@ -0,0 +1,108 @@
+"""Per label sentence and token counts of labeled_dataset,
+kept in LABEL_DATA_COUNT_COLLECTION with $inc on every insert and delete.
+One document per label: {"label_name", "sentence_count", "token_count", "data_count"}.
+data_count is the data_count of GET /labels/{label_name}: the distinct
+sentences with the label or any of its inherit labels, only kept for the
+defined labels. It is counted once with count_documents when a label is
+defined, a sentence written during that count may be counted twice until
+the next recount.
+
+The $inc runs after the sentences are written. If it fails, the counts are
+marked stale with "stale_since" in the CONFIG_COLLECTION document of
+LABEL_DATA_COUNT_COLLECTION, until python -m utils.labeled_data_maintenance count
+rebuilds them."""
+import logging
+from collections import defaultdict
+from datetime import datetime
+from pymongo import UpdateOne
+from core.config import LABEL_DATA_COUNT_COLLECTION
+
+
+def get_data_count_labels(label_inherits):
+    """{label: defined labels whose data_count counts it}, label_inherits is
+    {defined label: its inherit labels}, see LabelCatalog.get_label_inherits."""
+    data_count_labels = defaultdict(set)
+    for label_name, inherit in label_inherits.items():
+        for label in [label_name, *inherit]:
+            data_count_labels[label].add(label_name)
+    return data_count_labels
+
+
+def get_label_count_increments(documents, sign = 1, label_inherits = {}):
+    """{label: [sentence increment, token increment, data_count increment]}
+    of the sentence documents. Use sign = -1 for deleted documents."""
+    data_count_labels = get_data_count_labels(label_inherits)
+    increments = defaultdict(lambda: [0, 0, 0])
+    for document in documents:
+        sentence_labels = set()
+        for token in document["token_and_labels"]:
+            for label in token["labels"]:
+                increments[label][1] += sign
+                sentence_labels.add(label)
+        counted_labels = set()
+        for label in sentence_labels:
+            increments[label][0] += sign
+            counted_labels.update(data_count_labels.get(label, ()))
+        for label in counted_labels:
+            increments[label][2] += sign
+    return increments
+
+
+def get_label_count_updates(documents, sign = 1, label_inherits = {}):
+    """UpdateOne requests to apply the counts of documents, for an unordered bulk_write.
+    Pass the label_inherits of the label catalog to keep the data counts."""
+    return [UpdateOne({"label_name": label},
+                      {"$inc": {"sentence_count": sentence_count, "token_count": token_count,
+                                "data_count": data_count}},
+                      upsert=True)
+            for label, (sentence_count, token_count, data_count)
+            in get_label_count_increments(documents, sign, label_inherits).items()]
+
+
+def get_data_count_filter(label_name, inherit):
+    """Filter of the sentences counted in the data_count of a label."""
+    return {"token_and_labels.labels": {"$in": [label_name, *inherit]}}
+
+
+def get_data_count_update(label_name, data_count):
+    """Filter and update setting the data_count of a label, use with upsert=True."""
+    return ({"label_name": label_name}, {"$set": {"data_count": data_count}})
+
+
+def get_stale_counts_update():
+    """Filter and update of CONFIG_COLLECTION marking the counts stale, use with upsert=True."""
+    return ({"collection_name": LABEL_DATA_COUNT_COLLECTION},
+            {"$set": {"stale_since": datetime.now()}})
+
+
+def get_fresh_counts_update():
+    """Filter and update of CONFIG_COLLECTION after the counts are rebuilt."""
+    return ({"collection_name": LABEL_DATA_COUNT_COLLECTION},
+            {"$unset": {"stale_since": True}})
+
+
+def apply_label_count_updates(label_count_col, config_col, requests):
+    """bulk_write the requests of get_label_count_updates, the sentences
+    are written already, so a failure marks the counts stale instead of raising."""
+    if not requests:
+        return
+    try:
+        label_count_col.bulk_write(requests, ordered=False)
+    except Exception:
+        logging.exception("Label counts not updated, they are stale until recounted.")
+        config_col.update_one(*get_stale_counts_update(), upsert=True)
+
+
+# Recount everything, for the sentences stored before the counts existed.
+RECOUNT_PIPELINE = [
+    {"$project": {"token_and_labels.labels": True}},
+    {"$unwind": "$token_and_labels"},
+    {"$unwind": "$token_and_labels.labels"},
+    {"$group": {"_id": {"label": "$token_and_labels.labels", "sentence": "$_id"},
+                "token_count": {"$sum": 1}}},
+    {"$group": {"_id": "$_id.label",
+                "sentence_count": {"$sum": 1},
+                "token_count": {"$sum": "$token_count"}}},
+    {"$project": {"_id": False, "label_name": "$_id",
+                  "sentence_count": True, "token_count": True}},
+]
@@ -0,0 +1,150 @@
+"""Per label statistics and label co-occurrence of labeled_dataset, cached in each process.
+
+The cache is keyed by "last_update_time" of labeled_dataset in CONFIG_COLLECTION.
+When only new sentences were inserted, just the sentences after the cached
+max _id are aggregated and added to the cache. A delete sets
+"last_delete_time" too, and then everything is aggregated again."""
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from core.config import (
+    DATABASE_NAME,
+    NER_LABEL_COLLECTION,
+    CONFIG_COLLECTION,
+)
+
+
+def get_statistics_pipeline(last_id = None):
+    """One $facet result of sentences after last_id (all sentences if None)."""
+    pipeline = []
+    if last_id is not None:
+        pipeline.append({"$match": {"_id": {"$gt": last_id}}})
+    pipeline += [
+        {"$project": {
+            "tokens": "$token_and_labels.labels",
+            "sentence_labels": {"$reduce": {
+                "input": "$token_and_labels.labels",
+                "initialValue": [],
+                "in": {"$setUnion": ["$$value", "$$this"]},
+            }},
+        }},
+        {"$facet": {
+            "tokens": [
+                {"$unwind": "$tokens"},
+                {"$unwind": "$tokens"},
+                {"$group": {"_id": "$tokens", "count": {"$sum": 1}}},
+            ],
+            "sentences": [
+                {"$unwind": "$sentence_labels"},
+                {"$group": {"_id": "$sentence_labels", "count": {"$sum": 1}}},
+            ],
+            "pairs": [
+                {"$project": {"a": "$sentence_labels", "b": "$sentence_labels"}},
+                {"$unwind": "$a"},
+                {"$unwind": "$b"},
+                {"$match": {"$expr": {"$lt": ["$a", "$b"]}}},
+                {"$group": {"_id": {"a": "$a", "b": "$b"}, "count": {"$sum": 1}}},
+            ],
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "sentence_count": {"$sum": 1},
+                    "token_count": {"$sum": {"$size": "$tokens"}},
+                    "last_id": {"$max": "$_id"},
+                }},
+            ],
+        }},
+    ]
+    return pipeline
+
+
+class LabelStatistics:
+    def __init__(self, last_update_time = None, last_delete_time = None):
+        self.last_update_time = last_update_time
+        self.last_delete_time = last_delete_time
+        self.last_id = None
+        self.sentence_count = 0
+        self.token_count = 0
+        self.label_sentence_counts = defaultdict(int)
+        self.label_token_counts = defaultdict(int)
+        self.pair_counts = defaultdict(int)
+        self.computed_time = None
+
+    def add(self, facet):
+        """Add a get_statistics_pipeline result."""
+        for count in facet["tokens"]:
+            self.label_token_counts[count["_id"]] += count["count"]
+        for count in facet["sentences"]:
+            self.label_sentence_counts[count["_id"]] += count["count"]
+        for count in facet["pairs"]:
+            self.pair_counts[(count["_id"]["a"], count["_id"]["b"])] += count["count"]
+        if facet["totals"]:
+            totals = facet["totals"][0]
+            self.sentence_count += totals["sentence_count"]
+            self.token_count += totals["token_count"]
+            self.last_id = totals["last_id"]
+        self.computed_time = datetime.now()
+
+    def to_dict(self):
+        labels = {}
+        for label in sorted(self.label_sentence_counts):
+            token_count = self.label_token_counts[label]
+            sentence_count = self.label_sentence_counts[label]
+            labels[label] = {
+                "sentence_count": sentence_count,
+                "token_count": token_count,
+                "positive_ratio": token_count / self.token_count if self.token_count else 0,
+                "sentence_ratio": sentence_count / self.sentence_count if self.sentence_count else 0,
+            }
+        pairs = sorted(self.pair_counts.items(), key = lambda pair: -pair[1])
+        return {
+            "total_sentences": self.sentence_count,
+            "total_tokens": self.token_count,
+            "labels": labels,
+            "co_occurrence": [{"labels": list(pair), "sentence_count": count}
+                              for pair, count in pairs],
+            "last_update_time": self.last_update_time,
+            "computed_time": self.computed_time,
+        }
+
+
+_statistics = LabelStatistics()
+_statistics_lock = None
+
+async def asyncio_get_label_statistics(refresh = False):
+    global _statistics, _statistics_lock
+    if _statistics_lock is None:
+        # Created in the running event loop.
+        _statistics_lock = asyncio.Lock()
+    from db.mongodb import get_database
+    mongo_client = await get_database()
+    config_col = mongo_client[DATABASE_NAME][CONFIG_COLLECTION]
+    labeled_data_col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
+
+    async with _statistics_lock:
+        config = await config_col.find_one({"collection_name": NER_LABEL_COLLECTION}) or {}
+        last_update_time = config.get("last_update_time")
+        last_delete_time = config.get("last_delete_time")
+        if (not refresh and _statistics.computed_time
+                and _statistics.last_update_time == last_update_time):
+            return _statistics
+
+        statistics = _statistics
+        if (refresh or statistics.computed_time is None
+                or statistics.last_delete_time != last_delete_time):
+            statistics = LabelStatistics()
+        pipeline = get_statistics_pipeline(statistics.last_id)
+        facet = await labeled_data_col.aggregate(pipeline, allowDiskUse=True).to_list(None)
+        statistics.add(facet[0])
+
+        # A sentence written with a smaller _id after the last aggregation is missed
+        # by the incremental update, count again when the totals disagree.
+        if statistics.last_id is not None and statistics.sentence_count != await labeled_data_col.estimated_document_count():
+            statistics = LabelStatistics()
+            facet = await labeled_data_col.aggregate(get_statistics_pipeline(), allowDiskUse=True).to_list(None)
+            statistics.add(facet[0])
+
+        statistics.last_update_time = last_update_time
+        statistics.last_delete_time = last_delete_time
+        _statistics = statistics
+        return _statistics
@@ -0,0 +1,156 @@
+import json
+import hashlib
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from utils.tokenizer import encode_words, fast_tokenizer
+from utils.sentence_encoding import encode_sentence
+
+def split_sentences(texts):
+    """Split the texts by dot.
+    So avoid CUDA Out of Memory at training by too long texts.
+    This won't affect NER model's performance."""
+    sentences = []
+    current_sentence = []
+    for text in texts:
+        current_sentence.append(text)
+        if text == {'text': '.', 'labels': ['O']}:
+            # New Sentence, New data.
+            sentences.append(current_sentence)
+            current_sentence = []
+    sentences.append(current_sentence)
+    return sentences
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+def get_content_hash(sentence):
+    """Hash of the words and labels of a sentence, to find the same sentence
+    uploaded again. Whitespaces of words are collapsed and labels are sorted."""
+    normalized = [[" ".join(text["text"].split()), sorted(set(text["labels"]))]
+                  for text in sentence]
+    normalized = json.dumps(normalized, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+def get_sentence_words(sentence):
+    """Words of a sentence as they are tokenized,
+    RoBERTa needs the leading space of the words in the middle."""
+    words = []
+    last_word_index = len(sentence)-1
+    for i, text in enumerate(sentence):
+        if not isinstance(text["text"], str):
+            raise ValueError(f"text must be a string, got {text['text']!r}")
+        if (not isinstance(text["labels"], list) or
+            not all(isinstance(label, str) for label in text["labels"])):
+            raise ValueError(f"labels must be a list of string, got {text['labels']!r}")
+        if i != 0 and i != last_word_index:
+            words.append(" " + text["text"])
+        else:
+            words.append(text["text"])
+    return words
+
+def get_uploads_labels(uploads):
+    """All labels used in the uploads. Malformed uploads, which
+    get_labeled_sentence_documents_of_uploads rejects, are skipped,
+    so their labels are not added to the label dictionary."""
+    labels = set()
+    for data in uploads:
+        if isinstance(data, Exception):
+            continue
+        try:
+            for sentence in split_sentences(data["texts"]):
+                get_sentence_words(sentence)
+        except Exception:
+            continue
+        for text in data["texts"]:
+            labels.update(text["labels"])
+    return labels
+
+def get_labeled_sentence_documents_of_uploads(uploads, label_positions):
+    """Documents to store for each upload, one per sentence.
+    An upload is a dict like the body of POST /data/labeledText.
+    label_positions ({label: position} of the label dictionary) must contain
+    every label of the uploads, see utils.sentence_encoding.
+    All words of all uploads are tokenized in one batch.
+    Return a list in the order of uploads, an item is the list of
+    documents, or the Exception if that upload is malformed.
+    An upload can be an Exception already, it is returned as is."""
+    prepared = []
+    all_words = []
+    for data in uploads:
+        if isinstance(data, Exception):
+            # Failed before, at parsing
+            prepared.append(data)
+            continue
+        try:
+            sentences = split_sentences(data["texts"])
+            sentences_words = [get_sentence_words(sentence) for sentence in sentences]
+        except Exception as e:
+            prepared.append(e)
+            continue
+        prepared.append((data, sentences))
+        for words in sentences_words:
+            all_words += words
+
+    all_ids = iter(encode_words(all_words))
+    results = []
+    for item in prepared:
+        if isinstance(item, Exception):
+            results.append(item)
+            continue
+        data, sentences = item
+        documents = []
+        for sentence in sentences:
+            if len(sentence) == 0:
+                # Texts ended by a dot, nothing left to store.
+                continue
+            token_and_labels = []
+            ids_of_words = []
+            for text in sentence:
+                ids = next(all_ids)
+                ids_of_words.append(ids)
+                for token in fast_tokenizer.convert_ids_to_tokens(ids):
+                    token_and_labels.append({
+                        "token": token,
+                        "labels": text["labels"]
+                    })
+            documents.append({
+                "user": data["user"],
+                "tags": data["tags"],
+                "text_and_labels": sentence,
+                "token_and_labels": token_and_labels,
+                "encoded": encode_sentence(ids_of_words,
+                                           [text["labels"] for text in sentence],
+                                           label_positions),
+                "content_hash": get_content_hash(sentence),
+                "TimeStamp": datetime.now(),
+            })
+        results.append(documents)
+    return results
+
+def get_sentence_upserts(documents):
+    """One upsert per sentence document for an unordered bulk_write.
+    A document is only inserted if its content_hash is not stored yet."""
+    requests = []
+    for document in documents:
+        document.setdefault("_id", ObjectId())
+        requests.append(UpdateOne({"content_hash": document["content_hash"]},
+                                  {"$setOnInsert": document},
+                                  upsert=True))
+    return requests
+
+def get_sentence_upsert_result(documents, result = None, error = None):
+    """Return (duplicated positions, failed {position: error message})
+    of the bulk_write of get_sentence_upserts(documents).
+    Pass the BulkWriteError as error if bulk_write raised one.
+    A duplicate key error is a concurrent upsert of the same sentence."""
+    if error is not None:
+        upserted = {upsert["index"] for upsert in error.details["upserted"]}
+        write_errors = error.details["writeErrors"]
+    else:
+        upserted = set(result.upserted_ids.keys())
+        write_errors = []
+    failed = {write_error["index"]: write_error["errmsg"] for write_error in write_errors
+              if write_error["code"] != DUPLICATE_KEY_ERROR_CODE}
+    duplicated = {i for i in range(len(documents))
+                  if i not in upserted and i not in failed}
+    return duplicated, failed
@@ -0,0 +1,244 @@
+import os
+import csv
+import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from core.config import (
+    MONGODB_URL,
+    DATABASE_NAME,
+    NER_LABEL_COLLECTION,
+    CONFIG_COLLECTION,
+    LABEL_DATA_COUNT_COLLECTION,
+    LABELED_DATA_IMPORT_JOB_COLLECTION,
+    LABELED_DATA_IMPORT_BATCH_SIZE,
+    LABELED_DATA_IMPORT_WORKER,
+)
+from utils.labeled_data import (
+    get_uploads_labels,
+    get_labeled_sentence_documents_of_uploads,
+    get_sentence_upserts,
+    get_sentence_upsert_result,
+)
+from utils.sentence_encoding import update_label_dictionary
+from utils.label_counts import get_label_count_updates, apply_label_count_updates
+from utils.label_catalog import get_label_catalog
+from utils.update_db_last_modify_time import update_db_last_modify_time
+
+IMPORT_FORMATS = ["jsonl", "csv"]
+CSV_COLUMNS = ["Sentence #", "Word", "newTag"]
+# Keep the job document small if a whole file is malformed.
+MAX_KEPT_ERRORS = 100
+
+mongo_client = MongoClient(MONGODB_URL)
+import_job_col = mongo_client[DATABASE_NAME][LABELED_DATA_IMPORT_JOB_COLLECTION]
+config_col = mongo_client[DATABASE_NAME][CONFIG_COLLECTION]
+label_count_col = mongo_client[DATABASE_NAME][LABEL_DATA_COUNT_COLLECTION]
+
+
+class LineDecoder:
+    """Lines of a binary file, decoded strictly one by one.
+    A line that does not decode is given decoded with replacement
+    characters, so the readers keep their place, and its error is kept
+    until the reader takes it with pop_error."""
+    def __init__(self, f, encoding = "utf-8"):
+        self.f = f
+        self.encoding = encoding
+        self.errors = []
+
+    def __iter__(self):
+        for line_number, line in enumerate(self.f, 1):
+            try:
+                yield line.decode(self.encoding)
+            except UnicodeDecodeError as error:
+                self.errors.append(ValueError(f"line {line_number}: {error}"))
+                yield line.decode(self.encoding, errors="replace")
+
+    def pop_error(self):
+        """The first error of the lines read since the last call, or None."""
+        errors, self.errors = self.errors, []
+        return errors[0] if errors else None
+
+
+def get_encoding_error(encoding):
+    """Error message if the import can't read files of encoding, else None.
+    Files are cut in lines before decoding, so the encoding must keep
+    ASCII as is, "\\n" included."""
+    try:
+        ascii_bytes = "a\n".encode(encoding)
+    except LookupError:
+        return f"Unknown encoding {encoding!r}."
+    # utf-8-sig adds a BOM in front only.
+    if not ascii_bytes.endswith(b"a\n"):
+        return f"Encoding {encoding!r} is not supported, use an ASCII compatible one such as utf-8."
+    return None
+
+
+def read_jsonl_uploads(lines, user, tags):
+    """One upload per line, a line is the body of POST /data/labeledText,
+    or only its "texts" list. Malformed or undecodable lines are yielded
+    as Exception."""
+    for line_number, line in enumerate(lines, 1):
+        error = lines.pop_error()
+        if error:
+            yield error
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            upload = json.loads(line)
+            if isinstance(upload, list):
+                upload = {"texts": upload}
+            yield {
+                "user": upload.get("user", user),
+                "tags": upload.get("tags", tags),
+                "texts": upload["texts"],
+            }
+        except Exception as e:
+            yield ValueError(f"line {line_number}: {e!r}")
+
+
+def read_csv_uploads(lines, user, tags):
+    """One upload per sentence of a CONLL like CSV with the columns
+    "Sentence #", "Word" and "newTag" (labels joined by "|").
+    "Sentence #" is only filled at the first word of a sentence.
+    A sentence with a malformed or undecodable row is yielded as Exception."""
+    reader = csv.DictReader(lines)
+    missing = set(CSV_COLUMNS) - set(reader.fieldnames or [])
+    error = lines.pop_error()
+    if error:
+        raise ValueError(f"CSV header: {error}")
+    if missing:
+        raise ValueError(f"CSV columns {missing} not found.")
+    texts, error = [], None
+    for row in reader:
+        if row["Sentence #"] and (texts or error):
+            yield error or {"user": user, "tags": tags, "texts": texts}
+            texts, error = [], None
+        decode_error = lines.pop_error()
+        error = error or decode_error
+        if error:
+            continue
+        if not row["Word"] or not row["newTag"]:
+            # A short row has None for the missing columns.
+            error = ValueError(f"line {reader.line_num}: Word and newTag must not be empty, "
+                               f"got {row['Word']!r}, {row['newTag']!r}")
+            continue
+        texts.append({"text": row["Word"], "labels": row["newTag"].split("|")})
+    if texts or error:
+        yield error or {"user": user, "tags": tags, "texts": texts}
+
+
+def read_uploads(lines, file_format, user, tags):
+    if file_format == "jsonl":
+        return read_jsonl_uploads(lines, user, tags)
+    elif file_format == "csv":
+        return read_csv_uploads(lines, user, tags)
+    raise ValueError(f"file_format must be in one of the {IMPORT_FORMATS}")
+
+
+def iter_batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_batch(col, batch_start, results):
+    """Upsert the sentence documents of a tokenized batch.
+    Return (inserted sentence count, duplicated sentence count, failed upload count, errors)."""
+    documents = []
+    owners = []
+    failed_uploads = {}
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            failed_uploads[i] = str(result)
+            continue
+        documents += result
+        owners += [i] * len(result)
+    duplicated, failed_documents = set(), {}
+    if documents:
+        try:
+            result = col.bulk_write(get_sentence_upserts(documents), ordered=False)
+            duplicated, failed_documents = get_sentence_upsert_result(documents, result=result)
+        except BulkWriteError as error:
+            duplicated, failed_documents = get_sentence_upsert_result(documents, error=error)
+    for j, error_msg in failed_documents.items():
+        failed_uploads.setdefault(owners[j], error_msg)
+    count_updates = get_label_count_updates(
+        [document for j, document in enumerate(documents)
+         if j not in duplicated and j not in failed_documents],
+        label_inherits = get_label_catalog().get_label_inherits())
+    apply_label_count_updates(label_count_col, config_col, count_updates)
+    errors = [{"document": batch_start + i, "error_msg": error_msg}
+              for i, error_msg in sorted(failed_uploads.items())]
+    inserted_count = len(documents) - len(duplicated) - len(failed_documents)
+    return inserted_count, len(duplicated), len(failed_uploads), errors
+
+
+def update_job(_id, update):
+    update.setdefault("$set", {})["last_update_time"] = datetime.now()
+    import_job_col.update_one({"_id": _id}, update)
+
+
+def run_import_job(_id, path, file_format, user, tags, encoding = "utf-8"):
+    """Background job of POST /data/labeledText:import.
+
+    The file at path is read line by line and cut into batches of
+    LABELED_DATA_IMPORT_BATCH_SIZE uploads. Batches are tokenized by
+    LABELED_DATA_IMPORT_WORKER processes and written with one bulk_write,
+    sentences already stored are skipped. Lines that do not decode with
+    encoding fail their upload, they are reported in the job errors.
+    Only a few batches are in flight at once, so memory stays constant
+    whatever the file size. The file is removed at the end."""
+    col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
+    update_job(_id, {"$set": {"status": "importing"}})
+    inserted_count = 0
+    try:
+        with open(path, "rb") as f, \
+             ProcessPoolExecutor(max_workers=LABELED_DATA_IMPORT_WORKER,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            pending = deque()
+
+            def write_oldest_batch():
+                nonlocal inserted_count
+                batch_start, batch_size, future = pending.popleft()
+                inserted, duplicated, failed, errors = write_batch(col, batch_start, future.result())
+                inserted_count += inserted
+                update_job(_id, {
+                    "$inc": {
+                        "processed_documents": batch_size,
+                        "failed_documents": failed,
+                        "inserted_sentences": inserted,
+                        "duplicated_sentences": duplicated,
+                    },
+                    "$push": {"errors": {"$each": errors, "$slice": MAX_KEPT_ERRORS}},
+                })
+
+            batch_start = 0
+            for batch in iter_batches(read_uploads(LineDecoder(f, encoding), file_format, user, tags),
+                                      LABELED_DATA_IMPORT_BATCH_SIZE):
+                label_positions = update_label_dictionary(config_col, get_uploads_labels(batch))
+                future = executor.submit(get_labeled_sentence_documents_of_uploads,
+                                         batch, label_positions)
+                pending.append((batch_start, len(batch), future))
+                batch_start += len(batch)
+                if len(pending) >= LABELED_DATA_IMPORT_WORKER * 2:
+                    write_oldest_batch()
+            while pending:
+                write_oldest_batch()
+    except Exception as error:
+        update_job(_id, {"$set": {"status": "failed", "error_msg": str(error)}})
+        raise error
+    finally:
+        if inserted_count:
+            update_db_last_modify_time(NER_LABEL_COLLECTION)
+        os.remove(path)
+    update_job(_id, {"$set": {"status": "done"}})
@@ -0,0 +1,157 @@
+"""One-off jobs over the existing labeled_dataset documents.
+
+Run from the project root, EX: python -m utils.labeled_data_maintenance encode"""
+import sys
+from pymongo import MongoClient, UpdateOne, DeleteMany
+from pymongo.errors import BulkWriteError
+from core.config import (
+    MONGODB_URL,
+    DATABASE_NAME,
+    NER_LABEL_COLLECTION,
+    CONFIG_COLLECTION,
+    LABEL_DATA_COUNT_COLLECTION,
+    LABEL_COLLECTION,
+    LABELED_DATA_IMPORT_BATCH_SIZE,
+)
+from db.indexes import CONTENT_HASH_INDEX
+from utils.labeled_data import get_content_hash, DUPLICATE_KEY_ERROR_CODE
+from utils.sentence_encoding import encode_sentence, update_label_dictionary
+from utils.label_counts import (
+    get_label_count_updates,
+    apply_label_count_updates,
+    get_fresh_counts_update,
+    get_data_count_filter,
+    get_data_count_update,
+    RECOUNT_PIPELINE,
+)
+from utils.label_catalog import get_label_catalog
+from utils.update_db_last_modify_time import update_db_last_modify_time
+
+mongo_client = MongoClient(MONGODB_URL)
+labeled_data_col = mongo_client[DATABASE_NAME][NER_LABEL_COLLECTION]
+config_col = mongo_client[DATABASE_NAME][CONFIG_COLLECTION]
+label_count_col = mongo_client[DATABASE_NAME][LABEL_DATA_COUNT_COLLECTION]
+
+
+def iter_batches_of_cursor(cursor, size = LABELED_DATA_IMPORT_BATCH_SIZE):
+    batch = []
+    for document in cursor.batch_size(size):
+        batch.append(document)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def encode_missing_sentences():
+    """Add the "encoded" field to the sentences stored before it existed.
+    Return the amount of updated sentences."""
+    from utils.tokenizer import fast_tokenizer
+    cursor = labeled_data_col.find({"encoded": {"$exists": False}},
+                                   {"token_and_labels": True})
+    updated_count = 0
+    for batch in iter_batches_of_cursor(cursor):
+        labels = {label for document in batch
+                  for token in document["token_and_labels"] for label in token["labels"]}
+        label_positions = update_label_dictionary(config_col, labels)
+        requests = []
+        for document in batch:
+            token_and_labels = document["token_and_labels"]
+            ids = fast_tokenizer.convert_tokens_to_ids([token["token"] for token in token_and_labels])
+            encoded = encode_sentence([[token_id] for token_id in ids],
+                                      [token["labels"] for token in token_and_labels],
+                                      label_positions)
+            requests.append(UpdateOne({"_id": document["_id"]}, {"$set": {"encoded": encoded}}))
+        labeled_data_col.bulk_write(requests, ordered=False)
+        updated_count += len(requests)
+        print(f"Encoded {updated_count} sentences")
+    return updated_count
+
+
+def delete_sentences(ids):
+    """Delete the sentences and remove them from the label counts."""
+    if ids:
+        documents = list(labeled_data_col.find({"_id": {"$in": ids}},
+                                               {"token_and_labels": True}))
+        labeled_data_col.bulk_write([DeleteMany({"_id": {"$in": ids}})])
+        apply_label_count_updates(label_count_col, config_col, get_label_count_updates(
+            documents, sign = -1, label_inherits = get_label_catalog().get_label_inherits()))
+    return len(ids)
+
+
+def dedup_sentences():
+    """Add content_hash to the sentences stored before it existed,
+    delete the duplicated sentences (keep the oldest one),
+    then create the unique content_hash index.
+    Return the amount of deleted sentences."""
+    deleted_count = 0
+    hashed_count = 0
+    cursor = labeled_data_col.find({"content_hash": {"$exists": False}},
+                                   {"text_and_labels": True}).sort("_id", 1)
+    for batch in iter_batches_of_cursor(cursor):
+        requests = [UpdateOne({"_id": document["_id"]},
+                              {"$set": {"content_hash": get_content_hash(document["text_and_labels"])}})
+                    for document in batch]
+        duplicated_ids = []
+        try:
+            labeled_data_col.bulk_write(requests, ordered=False)
+        except BulkWriteError as error:
+            for write_error in error.details["writeErrors"]:
+                if write_error["code"] != DUPLICATE_KEY_ERROR_CODE:
+                    raise error
+                # The unique index exists, and this sentence is already stored.
+                duplicated_ids.append(batch[write_error["index"]]["_id"])
+        deleted_count += delete_sentences(duplicated_ids)
+        hashed_count += len(batch)
+        print(f"Hashed {hashed_count} sentences, deleted {deleted_count} duplicated")
+
+    # Without the unique index, duplicates all got their hash above.
+    duplicated_groups = labeled_data_col.aggregate([
+        {"$match": {"content_hash": {"$exists": True}}},
+        {"$group": {"_id": "$content_hash", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    duplicated_ids = []
+    for group in duplicated_groups:
+        duplicated_ids += sorted(group["ids"])[1:]
+        if len(duplicated_ids) >= LABELED_DATA_IMPORT_BATCH_SIZE:
+            deleted_count += delete_sentences(duplicated_ids)
+            duplicated_ids = []
+    deleted_count += delete_sentences(duplicated_ids)
+    print(f"Deleted {deleted_count} duplicated sentences")
+
+    labeled_data_col.create_index(**CONTENT_HASH_INDEX)
+    if deleted_count:
+        update_db_last_modify_time(NER_LABEL_COLLECTION, deleted = True)
+    return deleted_count
+
+
+def recount_labels():
+    """Rebuild the label counts from the whole dataset, for the sentences
+    stored before the counts existed, or after the counts are marked stale.
+    Stop the API while it runs, inserts during the recount are lost from the counts."""
+    labeled_data_col.aggregate(RECOUNT_PIPELINE + [{"$out": LABEL_DATA_COUNT_COLLECTION}],
+                               allowDiskUse=True)
+    labels = mongo_client[DATABASE_NAME][LABEL_COLLECTION].find({}, {"label_name": True, "inherit": True})
+    for label in labels:
+        data_count = labeled_data_col.count_documents(
+            get_data_count_filter(label["label_name"], label["inherit"]))
+        label_count_col.update_one(*get_data_count_update(label["label_name"], data_count), upsert=True)
+    config_col.update_one(*get_fresh_counts_update())
+    label_count = label_count_col.count_documents({})
+    print(f"Counted {label_count} labels")
+    return label_count
+
+
+JOBS = {
+    "encode": encode_missing_sentences,
+    "dedup": dedup_sentences,
+    "count": recount_labels,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in JOBS:
+        print(f"Usage: python -m utils.labeled_data_maintenance [{'|'.join(JOBS)}]")
+        sys.exit(1)
+    JOBS[sys.argv[1]]()
@@ -0,0 +1,81 @@
+"""Compact encoding of a labeled sentence, stored in the "encoded" field.
+
+input_ids is the little endian int32 array of the RoBERTa token ids.
+label_bitmask has one row of label_bitmask_width bytes per token, bit i of
+a row (numpy.packbits order) is set if the token has the label at position i
+of the label dictionary. Labels added to the dictionary after the sentence
+was stored are past the width of its rows, they are not set.
+
+The dictionary is a document of the config collection:
+{"name": LABEL_DICTIONARY_NAME, "label_count", "label_positions": [{"label", "position"}]}.
+A new label reserves a position by $inc of label_count, then it is pushed
+only if no concurrent writer added it first (that position stays unused).
+Positions never change, so old documents stay valid when new labels come."""
+import numpy as np
+from bson.binary import Binary
+from pymongo import ReturnDocument, UpdateOne
+from core.config import LABEL_DICTIONARY_NAME
+
+INPUT_IDS_DTYPE = np.dtype("<i4")
+
+
+def get_label_positions(label_dictionary):
+    """{label: position} of the label dictionary document, which can be None."""
+    return {entry["label"]: entry["position"]
+            for entry in (label_dictionary or {}).get("label_positions", [])}
+
+
+def get_label_reservation_update(count):
+    """Filter and update to reserve count positions, for
+    find_one_and_update(..., upsert=True, return_document=ReturnDocument.AFTER).
+    The reserved positions are label_count - count to label_count - 1 of the result."""
+    return ({"name": LABEL_DICTIONARY_NAME}, {"$inc": {"label_count": count}})
+
+
+def get_label_position_updates(labels, first_position):
+    """UpdateOne requests giving labels the positions from first_position,
+    a label that has a position already is left as is."""
+    return [UpdateOne({"name": LABEL_DICTIONARY_NAME, "label_positions.label": {"$ne": label}},
+                      {"$push": {"label_positions": {"label": label, "position": first_position + i}}})
+            for i, label in enumerate(sorted(labels))]
+
+
+def update_label_dictionary(config_col, labels):
+    """Add the labels missing in the label dictionary.
+    Return {label: position} of the whole dictionary."""
+    label_positions = get_label_positions(config_col.find_one({"name": LABEL_DICTIONARY_NAME}))
+    new_labels = set(labels) - label_positions.keys()
+    if new_labels:
+        label_count = config_col.find_one_and_update(
+            *get_label_reservation_update(len(new_labels)),
+            upsert=True, return_document=ReturnDocument.AFTER)["label_count"]
+        config_col.bulk_write(get_label_position_updates(new_labels, label_count - len(new_labels)),
+                              ordered=False)
+        label_positions = get_label_positions(config_col.find_one({"name": LABEL_DICTIONARY_NAME}))
+    return label_positions
+
+
+def get_label_names(label_positions):
+    """Labels of {label: position} in position order."""
+    return sorted(label_positions, key=label_positions.get)
+
+
+def encode_sentence(ids_of_words, labels_of_words, label_positions):
+    """The "encoded" field of a sentence.
+    ids_of_words and labels_of_words are aligned by word,
+    label_positions maps a label to its position in the label dictionary."""
+    token_count = sum(len(ids) for ids in ids_of_words)
+    input_ids = np.empty(token_count, dtype=INPUT_IDS_DTYPE)
+    mask = np.zeros((token_count, max(label_positions.values(), default=0) + 1), dtype=bool)
+    row = 0
+    for ids, labels in zip(ids_of_words, labels_of_words):
+        input_ids[row:row + len(ids)] = ids
+        mask[row:row + len(ids), [label_positions[label] for label in labels]] = True
+        row += len(ids)
+    bitmask = np.packbits(mask, axis=1)
+    return {
+        "input_ids": Binary(input_ids.tobytes()),
+        "label_bitmask": Binary(bitmask.tobytes()),
+        "label_bitmask_width": bitmask.shape[1],
+    }
+
@@ -1,17 +1,290 @@
 import json
-import random
+import time
+import hashlib
+import threading
+from datetime import datetime
+import numpy as np
+import scipy.sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+# This is a asyncio status, but just use mongo client directly, same as NER_label_model
+from pymongo import MongoClient
+from core.config import (
+    MONGODB_URL,
+    DATABASE_NAME,
+    CONFIG_COLLECTION,
+    Feedback_Template_Collection,
+    TEMPLATE_RETRAIN_JOB_COLLECTION,
+    TEMPLATE_INDEX_NAME,
+    SLEEP_INTERVAL_SECOND,
+)
+
 with open("./utils/template_classification/all_contract.json", "r") as f:
     data = json.load(f)
 
-def classify(text):
+mongo_client = MongoClient(MONGODB_URL)
+config_col = mongo_client[DATABASE_NAME][CONFIG_COLLECTION]
+feedback_col = mongo_client[DATABASE_NAME][Feedback_Template_Collection]
+retrain_job_col = mongo_client[DATABASE_NAME][TEMPLATE_RETRAIN_JOB_COLLECTION]
+
+
+def get_template_text(template_files):
+    """Join the human readable parts of a template: README, the markdown
+    texts (grammar and samples) and the package description."""
+    texts = []
+    for filename, content in template_files.items():
+        if filename.endswith(".md"):
+            texts.append("".join(content) if isinstance(content, list) else str(content))
+    package = template_files.get("/package.json", {})
+    if isinstance(package, dict):
+        texts.append(str(package.get("displayName", "")))
+        texts.append(str(package.get("description", "")))
+        texts.append(" ".join(package.get("keywords", [])))
+    return "\n".join(texts)
+
+
+def hash_text(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class TemplateIndex:
+    """TF-IDF vectors of every template, held as one sparse matrix.
+
+    The term counts and document frequencies are kept, so a rebuild only
+    analyzes the changed texts and weights all rows again with the new idf.
+    Rows are L2 normalized, so the cosine similarity of a text against all
+    templates is a single sparse matrix product. The weights are the ones
+    of TfidfVectorizer(sublinear_tf=True) fitted on the texts."""
+    def __init__(self, names, texts):
+        self.names = list(names)
+        texts = list(texts)
+        self.text_hashes = [hash_text(text) for text in texts]
+        self.analyzer = TfidfVectorizer(stop_words="english").build_analyzer()
+        self.vocabulary = {}
+        self.counts = self.count_terms(texts, grow = True)
+        self.document_frequencies = np.bincount(self.counts.indices, minlength=len(self.vocabulary))
+        self.set_weights()
+
+    def __len__(self):
+        return len(self.names)
+
+    def count_terms(self, texts, grow = False):
+        """Sparse term counts of texts, a column per vocabulary word.
+        With grow, new words are appended to the vocabulary, else they are dropped."""
+        indices, indptr = [], [0]
+        for text in texts:
+            for word in self.analyzer(text):
+                column = self.vocabulary.get(word)
+                if column is None:
+                    if not grow:
+                        continue
+                    column = self.vocabulary[word] = len(self.vocabulary)
+                indices.append(column)
+            indptr.append(len(indices))
+        counts = scipy.sparse.csr_matrix(
+            (np.ones(len(indices)), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+            shape=(len(texts), len(self.vocabulary)))
+        counts.sum_duplicates()
+        return counts
+
+    def weigh(self, counts):
+        """Normalized sublinear tf * idf rows of counts."""
+        tf = counts.copy()
+        tf.data = np.log(tf.data) + 1
+        return normalize(tf @ scipy.sparse.diags(self.idf), copy=False).tocsr()
+
+    def set_weights(self):
+        """Smooth idf of the document frequencies, as TfidfVectorizer.
+        Words left in no template weigh 0, as if not in the vocabulary."""
+        self.idf = np.log((1 + len(self.names)) / (1 + self.document_frequencies)) + 1
+        self.idf[self.document_frequencies == 0] = 0
+        self.matrix = self.weigh(self.counts)
+
+    def score(self, text):
+        return self.score_batch([text])[0]
+
+    def score_batch(self, texts):
+        """Scores of every text against every template, shape (texts, templates)."""
+        queries = self.weigh(self.count_terms(texts))
+        return (queries @ self.matrix.T).toarray()
+
+    def top_k(self, scores, k = None):
+        """Indexes of the k highest scores, best first.
+        scores can be one row or a matrix, then it works on each row."""
+        if k is None or k <= 0 or k >= scores.shape[-1]:
+            return np.argsort(-scores, axis=-1, kind="stable")
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+        order = np.argsort(-candidate_scores, axis=-1, kind="stable")
+        return np.take_along_axis(candidates, order, axis=-1)
+
+    def rebuild(self, texts_by_name):
+        """Return a new index for texts_by_name and the amount of re-embedded templates.
+
+        Only templates whose text changed are analyzed again, the others
+        keep their term counts. New words are appended as columns, the
+        document frequencies are updated by the removed and added rows,
+        then every row is weighted with the new idf. This index is not
+        changed, requests can keep using it meanwhile."""
+        old_rows = {name: i for i, name in enumerate(self.names)}
+        names = list(texts_by_name.keys())
+        texts = list(texts_by_name.values())
+        text_hashes = [hash_text(text) for text in texts]
+
+        kept, changed = [], []
+        for i, name in enumerate(names):
+            old_row = old_rows.get(name)
+            if old_row is None or self.text_hashes[old_row] != text_hashes[i]:
+                changed.append(i)
+            else:
+                kept.append(i)
+        kept_old_rows = [old_rows[names[i]] for i in kept]
+        removed_old_rows = np.setdiff1d(np.arange(len(self.names)), kept_old_rows)
+
+        new_index = object.__new__(TemplateIndex)
+        new_index.names = names
+        new_index.text_hashes = text_hashes
+        new_index.analyzer = self.analyzer
+        new_index.vocabulary = dict(self.vocabulary)
+        changed_counts = new_index.count_terms([texts[i] for i in changed], grow = True)
+        width = len(new_index.vocabulary)
+
+        kept_counts = self.counts[kept_old_rows]
+        kept_counts = scipy.sparse.csr_matrix(
+            (kept_counts.data, kept_counts.indices, kept_counts.indptr), shape=(len(kept), width))
+        order = np.empty(len(names), dtype=np.int64)
+        order[kept] = np.arange(len(kept))
+        order[changed] = len(kept) + np.arange(len(changed))
+        new_index.counts = scipy.sparse.vstack([kept_counts, changed_counts], format="csr")[order]
+
+        document_frequencies = np.zeros(width, dtype=np.int64)
+        document_frequencies[:len(self.document_frequencies)] = self.document_frequencies
+        document_frequencies -= np.bincount(self.counts[removed_old_rows].indices, minlength=width)
+        document_frequencies += np.bincount(changed_counts.indices, minlength=width)
+        new_index.document_frequencies = document_frequencies
+        new_index.set_weights()
+        return new_index, len(changed)
+
+
+index = TemplateIndex(data.keys(), [get_template_text(files) for files in data.values()])
+index_update_time = None
+index_checked_at = 0
+# Only one rebuild at a time, readers never wait: they grab the current index.
+index_lock = threading.Lock()
+# Thread of the last rebuild started by check_and_update_index.
+index_rebuild_thread = None
+
+
+def classify(text, return_max_size = None):
+    """Return templates sorted by similarity to text,
+    only the first return_max_size if it is positive."""
+    current_index = index
+    scores = current_index.score(text)
     predictions = []
-    for key in data.keys():
-        result = {
-            "name": key,
-            "confidence": random.random()}
-        predictions.append(result)
+    for i in current_index.top_k(scores, return_max_size):
+        predictions.append({
+            "name": current_index.names[i],
+            "confidence": float(scores[i])})
     return predictions
 
+
+def classify_batch(texts, return_max_size = None):
+    """classify for many texts, scored together with one matrix product."""
+    current_index = index
+    scores = current_index.score_batch(texts)
+    all_predictions = []
+    for text_scores, top_indexes in zip(scores, current_index.top_k(scores, return_max_size)):
+        all_predictions.append([{
+            "name": current_index.names[i],
+            "confidence": float(text_scores[i])} for i in top_indexes])
+    return all_predictions
+
+
+def get_template_texts_with_feedback():
+    """Template texts with their feedback texts appended,
+    and the amount of feedback used."""
+    feedbacks = feedback_col.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": "$template", "texts": {"$push": "$text"}}},
+    ])
+    feedbacks = {feedback["_id"]: feedback["texts"] for feedback in feedbacks}
+    texts_by_name = {}
+    feedback_count = 0
+    for name, files in data.items():
+        texts = feedbacks.get(name, [])
+        feedback_count += len(texts)
+        texts_by_name[name] = "\n".join([get_template_text(files)] + texts)
+    return texts_by_name, feedback_count
+
+
+def rebuild_index():
+    """Rebuild the index with the stored feedback and swap it in.
+    Return (template_count, re-embedded count, feedback count)."""
+    global index
+    with index_lock:
+        texts_by_name, feedback_count = get_template_texts_with_feedback()
+        new_index, changed_count = index.rebuild(texts_by_name)
+        index = new_index
+    return len(new_index), changed_count, feedback_count
+
+
+def run_retrain_job(_id):
+    """Background job of POST /model/template:retrain."""
+    global index_update_time
+    retrain_job_col.update_one({"_id": _id}, {
+        "$set": {"status": "training", "last_update_time": datetime.now()}})
+    try:
+        template_count, changed_count, feedback_count = rebuild_index()
+    except Exception as error:
+        retrain_job_col.update_one({"_id": _id}, {
+            "$set": {"status": "failed",
+                     "error_msg": str(error),
+                     "last_update_time": datetime.now()}})
+        raise error
+    now_time = datetime.now()
+    # Mongo keeps milliseconds only, compare with what will be stored.
+    now_time = now_time.replace(microsecond=now_time.microsecond // 1000 * 1000)
+    index_update_time = now_time
+    retrain_job_col.update_one({"_id": _id}, {
+        "$set": {"status": "done",
+                 "template_count": template_count,
+                 "re_embedded_count": changed_count,
+                 "train_data_count": feedback_count,
+                 "last_update_time": now_time}})
+    # Let other API workers know there is a new index.
+    config_col.update_one(
+        {"name": TEMPLATE_INDEX_NAME},
+        {"$set": {"last_update_time": now_time}},
+        upsert=True)
+
+
+def rebuild_index_for_update(update_time):
+    global index_update_time
+    rebuild_index()
+    index_update_time = update_time
+
+
+def check_and_update_index():
+    """If another worker rebuilt the index, rebuild it here too, in a
+    background thread. Requests keep using the current index until the
+    new one is swapped in. Check the DB at most once per SLEEP_INTERVAL_SECOND.
+    Return True if a rebuild was started."""
+    global index_checked_at, index_rebuild_thread
+    if time.monotonic() - index_checked_at < SLEEP_INTERVAL_SECOND:
+        return False
+    index_checked_at = time.monotonic()
+    config = config_col.find_one({"name": TEMPLATE_INDEX_NAME})
+    if config is None or config["last_update_time"] == index_update_time:
+        return False
+    if index_rebuild_thread is not None and index_rebuild_thread.is_alive():
+        # A rebuild is running, check again after it.
+        return False
+    index_rebuild_thread = threading.Thread(target=rebuild_index_for_update,
+                                            args=(config["last_update_time"],), daemon=True)
+    index_rebuild_thread.start()
+    return True
+
 example_text = """# "MAERSK LINE"
 
 ## Bill of Lading for Ocean Transport or Multimodal Transport
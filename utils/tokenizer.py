@@ -1,2 +1,10 @@
-from transformers import RobertaTokenizer
-tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
\ No newline at end of file
+from transformers import RobertaTokenizer, RobertaTokenizerFast
+tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
+fast_tokenizer = RobertaTokenizerFast.from_pretrained("roberta-base")
+
+def encode_words(words):
+    """Tokenize each word on its own, all words in one batch call.
+    Return the token ids of every word, so the word to token alignment is kept."""
+    if len(words) == 0:
+        return []
+    return fast_tokenizer(words, add_special_tokens=False)["input_ids"]
\ No newline at end of file
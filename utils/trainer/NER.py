@@ -1,196 +1,403 @@
-import pandas as pd
 import pymongo
 import numpy as np
 
 from core.config import (
     MONGODB_URL,DATABASE_NAME,
     NER_LABEL_COLLECTION,
-    LABEL_COLLECTION,
-    LABEL_TRAIN_JOB_COLLECTION,
     CONFIG_COLLECTION,
-    NER_TRAINER_DATA_CATCH_FILE,
-    NER_ADAPTERS_TRAINER_NAME,
+    NER_TRAINER_DATA_CACHE_DIR,
+    NER_TRAINER_DATA_CACHE_MAX_SEGMENTS,
+    NER_TRAINER_DATA_CACHE_FETCH_SIZE,
+    LABEL_DICTIONARY_NAME,
     DUMMY_LABEL_NAME,
+    NER_TRAIN_BATCH_SIZE,
+    NER_TRAIN_BUCKET_BY_LENGTH,
+    NER_TRAIN_MAX_TOKENS,
+    NER_TRAIN_LOADER_WORKERS,
+    NER_TRAIN_LOADER_PREFETCH,
+    NER_TRAIN_STREAM_CHUNK_SIZE,
 )
 
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, Sampler, DataLoader, get_worker_info
 import torch
-from sklearn.preprocessing import OneHotEncoder
 
 
 import numpy as np
 
 from tqdm import tqdm
 
-import swifter
-import os
+from utils.label_catalog import get_label_catalog
+from utils.trainer.data_cache import (
+    TrainingDataBuilder,
+    TrainingDataCache,
+    get_cache_key,
+)
+from utils.sentence_encoding import get_label_positions, get_label_names
+from bson.objectid import ObjectId
 
 
 
 client = pymongo.MongoClient(MONGODB_URL)
-def get_training_dataframe(train_data_search_filter = {}, cache = True):
-    try: #load from cache
-        client = pymongo.MongoClient(MONGODB_URL)
-        config_col = client[DATABASE_NAME][CONFIG_COLLECTION] 
-        trainer = config_col.find_one({
-            "name": NER_ADAPTERS_TRAINER_NAME
-        })
-        train_dataset = config_col.find_one({
-            "collection_name": NER_LABEL_COLLECTION
-        }) 
-        if cache:
-            if train_dataset["last_update_time"] == trainer["last_data_cache_timestamp"]:
-                print("Reading Data from Cache...")
-                df = pd.read_csv(trainer["data_cache_path"])
-                df["labels"] = df["cache_labels"].swifter.progress_bar(False).apply(lambda x: x.split("|"))
-                del df["cache_labels"]
-                return df
-            else: # new update, no cache
-                os.remove(NER_TRAINER_DATA_CATCH_FILE)
-    except Exception as e:
-        print(e)
-        pass
 
-    col = client[DATABASE_NAME][NER_LABEL_COLLECTION]
+def build_training_dataframe(sentences):
+    """One row per token of the sentence documents, the frame is created once
+    from the columns of a TrainingData instead of appending a frame per sentence."""
+    builder = TrainingDataBuilder()
+    for sentence in sentences:
+        builder.add(sentence)
+    return builder.build().to_dataframe()
 
-    result = col.find(train_data_search_filter)
-    print("Reading Data from MongoDB...")
-    dfs = []
-    df_columns = ["Sentence #", "token", "labels"]
-    for i, sentence in enumerate(tqdm(result, total = col.count_documents(train_data_search_filter))):
-        if i%50 == 0:
-            if i != 0: dfs.append(df)
-            df = pd.DataFrame()
-        sentense_df = pd.DataFrame(columns = df_columns, data = sentence["token_and_labels"])
-        sentense_df["Sentence #"] = str(sentence["_id"])
-        df = df.append(sentense_df)
-    dfs.append(df)
-    print("Loading Data to DataFrame")
-    while len(dfs) > 50:
-        new_dfs = []
-        tmp_df = pd.DataFrame(columns = df_columns)
-        for i, df in enumerate((dfs)):
-            if i%50 == 0:
-                if i != 0: new_dfs.append(tmp_df)
-                tmp_df = pd.DataFrame()
-            tmp_df = tmp_df.append(df)
-        new_dfs.append(tmp_df)
-        dfs = new_dfs
-    final_df = pd.DataFrame(columns = df_columns)
-    for df in tqdm(dfs):
-        final_df = final_df.append(df)
-    final_df = final_df.reset_index(drop=True)
-    # Cache
-    final_df["cache_labels"] = final_df["labels"].swifter.progress_bar(False).apply(lambda x: "|".join(x))
-    final_df.to_csv(NER_TRAINER_DATA_CATCH_FILE, index=False,
-                    columns = list(
-                        set(df_columns).union(["cache_labels"]).difference(["labels"])
-                    ))
-    del final_df["cache_labels"]
-    config_col.update_one({
-        "name": NER_ADAPTERS_TRAINER_NAME
-    }, {
-        "$set": {
-            "last_data_cache_timestamp": train_dataset["last_update_time"],
-            "data_cache_path": NER_TRAINER_DATA_CATCH_FILE,
-            }
-    })
-    return final_df
-
-def get_training_label_ane_data_by_df_according_to_label_name_and_alias(df, label_name):
-    label_col = client[DATABASE_NAME][LABEL_COLLECTION]
-
-    label_info = label_col.find_one({"label_name": label_name})
-    alias_labels = label_col.find({"alias_as": {"$in": [label_name]}})
-
-    alias = []
-    for alias_label in alias_labels:
-        alias.append(alias_label["label_name"])
-    alias = alias + label_info["inherit"]
-
-    positive_label = [label_name] + alias
-
-    def label_data(label):
-        if set(label).intersection(set(positive_label)):
-            return label_name
-        else:
-            return DUMMY_LABEL_NAME
+def get_data_version(train_dataset):
+    return {key: train_dataset[key].isoformat() if train_dataset.get(key) else None
+            for key in ("last_update_time", "last_delete_time")}
 
-    df[label_name] = list(df["labels"].apply(label_data))
-
-    sentences = df.groupby("Sentence #")["token"].apply(list).values
-    tags = df.groupby("Sentence #")[label_name].apply(list).values
-    return positive_label, sentences, tags
+def fetch_training_data(mongo_filter, label_names = (), token_vocabulary = ()):
+    col = client[DATABASE_NAME][NER_LABEL_COLLECTION]
+    builder = TrainingDataBuilder(label_names, token_vocabulary)
+    result = col.find(mongo_filter, {"token_and_labels": True})
+    for sentence in tqdm(result, total = col.count_documents(mongo_filter)):
+        builder.add(sentence)
+    return builder.build()
+
+def iter_training_data(mongo_filter, label_names = (), token_vocabulary = ()):
+    """fetch_training_data by parts of NER_TRAINER_DATA_CACHE_FETCH_SIZE sentences,
+    sharing growing vocabularies. At least one part, maybe empty."""
+    col = client[DATABASE_NAME][NER_LABEL_COLLECTION]
+    builder = TrainingDataBuilder(label_names, token_vocabulary)
+    result = col.find(mongo_filter, {"token_and_labels": True})
+    parts = 0
+    for sentence in tqdm(result, total = col.count_documents(mongo_filter)):
+        builder.add(sentence)
+        if len(builder.sentence_ids) == NER_TRAINER_DATA_CACHE_FETCH_SIZE:
+            parts += 1
+            yield builder.flush()
+    if builder.sentence_ids or parts == 0:
+        yield builder.flush()
+
+def get_training_data(train_data_search_filter = {}, cache = True):
+    """TrainingData of the filter. With cache, only the sentences inserted
+    or deleted since the last sync are read from MongoDB:
+    after inserts, the sentences after the last cached _id, appended to the cache.
+    After deletes, when the counts disagree (sentences written with a
+    smaller _id) or after NER_TRAINER_DATA_CACHE_MAX_SEGMENTS appends, the
+    cached _ids are compared with the _ids of the filter and the cache is rewritten."""
+    config_col = client[DATABASE_NAME][CONFIG_COLLECTION]
+    col = client[DATABASE_NAME][NER_LABEL_COLLECTION]
+    if not cache:
+        print("Reading Data from MongoDB...")
+        return fetch_training_data(train_data_search_filter)
+
+    data_cache = TrainingDataCache(NER_TRAINER_DATA_CACHE_DIR, train_data_search_filter,
+                                   NER_TRAINER_DATA_CACHE_MAX_SEGMENTS)
+    with data_cache.lock():
+        version = get_data_version(config_col.find_one({
+            "collection_name": NER_LABEL_COLLECTION
+        }) or {})
+        manifest = data_cache.read_manifest()
+        if manifest is None:
+            print("Reading Data from MongoDB...")
+            label_positions = get_label_positions(config_col.find_one({"name": LABEL_DICTIONARY_NAME}))
+            manifest = data_cache.write(iter_training_data(
+                train_data_search_filter, get_label_names(label_positions)), version)
+            return data_cache.load(manifest)
+
+        print("Reading Data from Cache...")
+        data = data_cache.load(manifest)
+        if manifest["version"] == version:
+            return data
+        last_id = bytes.fromhex(manifest["last_id"]) if manifest["last_id"] else None
+
+        if manifest["version"]["last_delete_time"] == version["last_delete_time"] \
+                and data_cache.can_append(manifest):
+            delta_filter = train_data_search_filter
+            if last_id is not None:
+                delta_filter = {"$and": [train_data_search_filter,
+                                         {"_id": {"$gt": ObjectId(last_id)}}]}
+            delta_count = col.count_documents(delta_filter)
+            if len(data) + delta_count == col.count_documents(train_data_search_filter):
+                print(f"Add {delta_count} sentences to Cache...")
+                return data_cache.load(data_cache.append(manifest, iter_training_data(
+                    delta_filter, data.label_names, data.token_vocabulary), version))
+
+        # Deleted sentences, or sentences before the last _id.
+        wanted_ids = {sentence["_id"].binary for sentence
+                      in col.find(train_data_search_filter, {"_id": True})}
+        cached_ids = data.get_sentence_id_bytes()
+        keep = [i for i, sentence_id in enumerate(cached_ids) if sentence_id in wanted_ids]
+        missing = list(wanted_ids.difference(cached_ids))
+        del wanted_ids, cached_ids
+        print(f"Remove {len(data) - len(keep)} and add {len(missing)} sentences in Cache...")
+        manifest = data_cache.write(iter_kept_and_missing_data(data, keep, missing), version)
+        return data_cache.load(manifest)
+
+def iter_kept_and_missing_data(data, keep, missing):
+    """The sentences keep of data then the sentences of the _ids missing,
+    by parts of NER_TRAINER_DATA_CACHE_FETCH_SIZE sentences."""
+    for i in range(0, len(keep), NER_TRAINER_DATA_CACHE_FETCH_SIZE):
+        yield data.take(keep[i:i + NER_TRAINER_DATA_CACHE_FETCH_SIZE])
+    label_names, token_vocabulary = data.label_names, data.token_vocabulary
+    for i in range(0, len(missing), NER_TRAINER_DATA_CACHE_FETCH_SIZE):
+        part = fetch_training_data(
+            {"_id": {"$in": [ObjectId(sentence_id) for sentence_id
+                             in missing[i:i + NER_TRAINER_DATA_CACHE_FETCH_SIZE]]}},
+            label_names, token_vocabulary)
+        label_names, token_vocabulary = part.label_names, part.token_vocabulary
+        yield part
+    if not keep and not missing:
+        yield data.take([])
+
+def get_target_indexes_by_filter(data, train_data_search_filter):
+    """Sorted indexes of the sentences of data matching train_data_search_filter.
+    MongoDB returns the matching _ids only, they are resolved to sentence
+    indexes by binary search, and the indexes are kept per filter and data version."""
+    config_col = client[DATABASE_NAME][CONFIG_COLLECTION]
+    version = get_data_version(config_col.find_one({
+        "collection_name": NER_LABEL_COLLECTION
+    }) or {})
+    key = (get_cache_key(train_data_search_filter), version["last_update_time"], version["last_delete_time"])
+    if key not in data.filter_indexes:
+        col = client[DATABASE_NAME][NER_LABEL_COLLECTION]
+        wanted_ids = [sentence["_id"].binary for sentence
+                      in col.find(train_data_search_filter, {"_id": True})]
+        data.filter_indexes[key] = data.get_sentence_indexes(wanted_ids)
+    return data.filter_indexes[key]
+
+def get_target_data_by_filter(data, train_data_search_filter):
+    """The sentences of data matching train_data_search_filter.
+    The label bitmask is built once on data, the jobs take its rows."""
+    data.get_label_bitmask()
+    return data.take(get_target_indexes_by_filter(data, train_data_search_filter))
+
+def get_positive_label_mask(data, label_name, positive_label = None):
+    """A token is positive if it has any of the positive labels of label_name,
+    one OR over the columns of the label bitmask.
+    Return (positive labels, bool per token of data)."""
+    if positive_label is None:
+        positive_label = get_label_catalog().get_positive_labels(label_name)
+    return positive_label, data.get_label_mask(positive_label)
+
+def get_positive_labels(label_name, positive_label = None):
+    """{label: positive labels} of label_name, a label or a list of labels
+    trained together, positive_label is then None or a list per label.
+    A positive_label dict is already the result."""
+    if isinstance(positive_label, dict):
+        return positive_label
+    if isinstance(label_name, str):
+        label_name, positive_label = [label_name], [positive_label]
+    if positive_label is None:
+        positive_label = [None] * len(label_name)
+    return {label: get_label_catalog().get_positive_labels(label) if positive is None else positive
+            for label, positive in zip(label_name, positive_label)}
 
 class NER_Dataset_for_Adapter(Dataset):
-    def __init__(self, tokenizer, df, label_name):
+    """The input ids with <s> and </s> and the [DUMMY, label_name] label
+    of every token are computed once, into flat arrays. Item i is
+    offsets[i]:offsets[i + 1] of them, sliced without a copy.
+    With a list of label names, a token has a column per label and DUMMY
+    is set where none of them is positive."""
+    def __init__(self, tokenizer, data, label_name, positive_label = None):
         self.label_name = label_name
         self.mode = "train"
-        
-        self.positive_label, self.sentences, self.tags \
-            = get_training_label_ane_data_by_df_according_to_label_name_and_alias(df, label_name)
-        self.len = len(self.sentences)
-
-        labels = [DUMMY_LABEL_NAME, label_name]
-
-        if self.mode != "test":
-            labels = [DUMMY_LABEL_NAME, label_name]
-            self.label_map = {}
-            for i, label in enumerate(labels):
-                self.label_map[label] = i
-
-            possible_labels = np.array(range(len(labels))).reshape(-1, 1)
-            self.oneHotEncoder = OneHotEncoder()
-            self.oneHotEncoder.fit(possible_labels)
-        else:
-            self.label_map = None
 
+        self.positive_labels = get_positive_labels(label_name, positive_label)
+        self.positive_label = self.positive_labels[label_name] \
+            if isinstance(label_name, str) else self.positive_labels
+        self.len = len(data)
+
+        labels = [DUMMY_LABEL_NAME, *self.positive_labels]
+        self.label_map = {label: i for i, label in enumerate(labels)}
         self.tokenizer = tokenizer  # RoBERTa tokenizer
         self.O_label = self.label_map[DUMMY_LABEL_NAME]
 
+        # Each token of the vocabulary is converted once.
+        vocabulary_ids = np.array(tokenizer.convert_tokens_to_ids(data.token_vocabulary.tolist()),
+                                  dtype=np.int64)
+        sentence_lengths = np.diff(data.sentence_offsets)
+        self.offsets = data.sentence_offsets + 2 * np.arange(self.len + 1)
+        token_positions = np.arange(len(data.token_ids)) + 1 \
+            + 2 * np.repeat(np.arange(self.len), sentence_lengths)
+
+        self.input_ids = np.empty(self.offsets[-1], dtype=np.int64)
+        self.input_ids[self.offsets[:-1]] = tokenizer.cls_token_id
+        self.input_ids[self.offsets[1:] - 1] = tokenizer.sep_token_id
+        self.input_ids[token_positions] = vocabulary_ids[data.token_ids]
+
+        self.labels = np.zeros((self.offsets[-1], len(labels)), dtype=np.float32)
+        self.labels[:, self.O_label] = 1
+        for label, positive_label in self.positive_labels.items():
+            _, positive = get_positive_label_mask(data, label, positive_label)
+            positive_positions = token_positions[positive]
+            self.labels[positive_positions, self.O_label] = 0
+            self.labels[positive_positions, self.label_map[label]] = 1
+
+        self.segment_ids = np.zeros(sentence_lengths.max(initial=0) + 2, dtype=np.int64)
+
     def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
         if self.mode == "test":
             label_tensor = None
         else:
-            label = [DUMMY_LABEL_NAME] + self.tags[idx] + [DUMMY_LABEL_NAME]
-
-            label = np.array(label)
-            label = label.reshape(-1,1)
-
-            label = np.apply_along_axis(self.split_one_hot_multiTags, 1, label)
-            label_tensor = torch.tensor(label, dtype = torch.float32)
+            label_tensor = torch.from_numpy(self.labels[start:end])
 
-        # Add [CLS] and [SEP]
-        word_pieces = [self.tokenizer.cls_token]
-        word_pieces += self.sentences[idx]
-        word_pieces += [self.tokenizer.sep_token]
-
-        ids = self.tokenizer.convert_tokens_to_ids(word_pieces)
-        tokens_tensor = torch.tensor(ids)
-
-        segments_tensor = torch.zeros_like(tokens_tensor)
+        tokens_tensor = torch.from_numpy(self.input_ids[start:end])
+        segments_tensor = torch.from_numpy(self.segment_ids[:end - start])
 
         return (tokens_tensor, segments_tensor, label_tensor)
 
     def __len__(self):
         return self.len
 
-    def split_one_hot_multiTags(self, tags):
-        # tags = ['B-org|Party|String']
-        tags = tags[0]
-        tags = tags.split("|")
-
-
-        tags_num = list(map(lambda x: self.label_map[x], tags))
-        #[5, 20, 23]
-
-        tags_num = np.array(tags_num).reshape(-1,1)
-
-        tags_one_hot = self.oneHotEncoder.transform(tags_num).toarray()
-
-        tags_one_hot = tags_one_hot.sum(axis = 0)
+    def get_lengths(self):
+        """Tokens of every item, with <s> and </s>."""
+        return np.diff(self.offsets)
+
+class LengthBucketBatchSampler(Sampler):
+    """Batches of sentences with the same or close lengths, so little padding is needed.
+    Every epoch the sentences are sorted by length with random order inside
+    each length, cut into batches of at most batch_size sentences and
+    max_tokens tokens (sentences x longest sentence), and the batches are
+    shuffled. With bucket = False, batches are cut from the shuffled order.
+    The batches of an epoch are cut when the previous one ends, so len() is
+    the number of batches the next iteration yields, also when the token
+    cap of bucket = False depends on the order."""
+    def __init__(self, lengths, batch_size, max_tokens = None, bucket = True, shuffle = True, seed = None):
+        self.lengths = np.asarray(lengths)
+        self.bucket = bucket
+        self.shuffle = shuffle
+        self.generator = np.random.default_rng(seed)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.batch_ends = get_batch_ends(np.sort(self.lengths) if bucket else self.lengths,
+                                         batch_size, max_tokens)
+        self.batches = self.get_epoch_batches()
+
+    def get_epoch_batches(self):
+        order = self.generator.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        batch_ends = self.batch_ends
+        if self.bucket:
+            order = order[np.argsort(self.lengths[order], kind="stable")]
+        elif self.max_tokens is not None:
+            # The token cap depends on the order.
+            batch_ends = get_batch_ends(self.lengths[order], self.batch_size, self.max_tokens)
+        batches = np.split(order, batch_ends[:-1])
+        if self.shuffle:
+            batches = [batches[i] for i in self.generator.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        for batch in self.batches:
+            yield batch.tolist()
+        self.batches = self.get_epoch_batches()
 
-        #return torch.tensor(tags_one_hot, dtype = torch.float32)
-
-        return tags_one_hot
+    def __len__(self):
+        return len(self.batches)
+
+def get_batch_ends(lengths, batch_size, max_tokens = None):
+    """End index of every batch of lengths in this order. Without max_tokens
+    every batch has batch_size sentences. With it, a batch also stops before
+    its sentences x longest sentence would exceed max_tokens."""
+    if max_tokens is None:
+        return list(range(batch_size, len(lengths), batch_size)) + [len(lengths)]
+    ends = []
+    start, longest = 0, 0
+    for i, length in enumerate(lengths.tolist()):
+        longest = max(longest, length)
+        if i > start and (i - start == batch_size or (i - start + 1) * longest > max_tokens):
+            ends.append(i)
+            start, longest = i, length
+    ends.append(len(lengths))
+    return ends
+
+class NER_Streaming_Dataset_for_Adapter(IterableDataset):
+    """The sentences of train_data_search_filter streamed in chunks, only
+    a chunk per loader worker is in memory. Every epoch the matching _ids are
+    shuffled and cut into chunks of chunk_size, the loader workers take turns.
+    A chunk is read from data (the memory-mapped cache of get_training_data)
+    if given, else from MongoDB by _id. Yield length bucketed batches,
+    lists of NER_Dataset_for_Adapter items, for DataLoader(batch_size=None)."""
+    def __init__(self, tokenizer, label_name, train_data_search_filter, data = None,
+                 chunk_size = NER_TRAIN_STREAM_CHUNK_SIZE, shuffle = True, seed = None):
+        self.tokenizer = tokenizer
+        self.label_name = label_name
+        self.mode = "train"
+        self.positive_labels = get_positive_labels(label_name)
+        self.positive_label = self.positive_labels[label_name] \
+            if isinstance(label_name, str) else self.positive_labels
+        self.label_map = {label: i for i, label in enumerate([DUMMY_LABEL_NAME, *self.positive_labels])}
+        self.data = data
+        self.chunk_size = chunk_size
+        self.shuffle = shuffle
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.epoch = 0
+        if data is not None:
+            self.indexes = get_target_indexes_by_filter(data, train_data_search_filter)
+        else:
+            col = client[DATABASE_NAME][NER_LABEL_COLLECTION]
+            self.indexes = np.frombuffer(b"".join(
+                sentence["_id"].binary for sentence
+                in col.find(train_data_search_filter, {"_id": True})), dtype=np.uint8).reshape(-1, 12)
 
+    def __len__(self):
+        return len(self.indexes)
+
+    def read_chunk(self, chunk):
+        if self.data is not None:
+            return self.data.take(self.indexes[np.sort(chunk)])
+        if not hasattr(self, "worker_client"):
+            # A MongoClient must not be shared with the forked workers.
+            self.worker_client = pymongo.MongoClient(MONGODB_URL)
+        col = self.worker_client[DATABASE_NAME][NER_LABEL_COLLECTION]
+        builder = TrainingDataBuilder()
+        sentence_ids = [ObjectId(sentence_id.tobytes()) for sentence_id in self.indexes[chunk]]
+        for sentence in col.find({"_id": {"$in": sentence_ids}}, {"token_and_labels": True}):
+            builder.add(sentence)
+        return builder.build()
+
+    def __iter__(self):
+        # Every worker has a copy, all of them shuffle the same way in an epoch.
+        generator = np.random.default_rng([self.seed, self.epoch])
+        self.epoch += 1
+        worker = get_worker_info()
+        worker_id, worker_count = (worker.id, worker.num_workers) if worker else (0, 1)
+
+        order = generator.permutation(len(self.indexes)) if self.shuffle else np.arange(len(self.indexes))
+        chunks = [order[i:i + self.chunk_size] for i in range(0, len(order), self.chunk_size)]
+        for chunk in chunks[worker_id::worker_count]:
+            dataset = NER_Dataset_for_Adapter(self.tokenizer, self.read_chunk(chunk),
+                                              self.label_name, self.positive_labels)
+            dataset.mode = self.mode
+            sampler = LengthBucketBatchSampler(dataset.get_lengths(), NER_TRAIN_BATCH_SIZE,
+                                               NER_TRAIN_MAX_TOKENS, NER_TRAIN_BUCKET_BY_LENGTH,
+                                               self.shuffle, generator.integers(2 ** 32))
+            for batch in sampler:
+                yield [dataset[i] for i in batch]
+
+def get_train_loader(trainset, collate_fn, shuffle = True):
+    """DataLoader of a training set, by the NER_TRAIN_* config."""
+    loader_options = {}
+    if NER_TRAIN_LOADER_WORKERS:
+        loader_options = {"num_workers": NER_TRAIN_LOADER_WORKERS,
+                          "prefetch_factor": NER_TRAIN_LOADER_PREFETCH,
+                          "persistent_workers": True}
+    if isinstance(trainset, IterableDataset):
+        # The dataset yields whole batches.
+        return DataLoader(trainset, batch_size=None, collate_fn=collate_fn,
+                          pin_memory=torch.cuda.is_available(), **loader_options)
+    sampler = LengthBucketBatchSampler(trainset.get_lengths(), NER_TRAIN_BATCH_SIZE,
+                                       NER_TRAIN_MAX_TOKENS, NER_TRAIN_BUCKET_BY_LENGTH, shuffle)
+    return DataLoader(trainset, batch_sampler=sampler, collate_fn=collate_fn,
+                      pin_memory=torch.cuda.is_available(), **loader_options)
+
+def get_padding_counts(labels):
+    """(token count, padded token count) of a batch of padded label tensors,
+    the rows of padding are all zeros."""
+    return int((labels.sum(-1) != 0).sum()), labels.shape[0] * labels.shape[1]
+
+def get_epoch_stats(epoch, batch_count, token_count, padded_count):
+    """The "epoch_stats" entry of a training job, with the share of
+    padding in the padded batches of the epoch."""
+    return {
+        "epoch": epoch,
+        "batches": batch_count,
+        "padding_ratio": 1 - token_count / padded_count if padded_count else 0,
+    }
@@ -0,0 +1,362 @@
+"""Binary cache of the NER training data, refreshed incrementally.
+
+Each column is a raw binary file loaded with numpy.memmap, so nothing is
+parsed and the trainers share a copy in the page cache. Sentence i has the
+tokens sentence_offsets[i]:sentence_offsets[i + 1], token j has the labels
+label_offsets[j]:label_offsets[j + 1]. Tokens and labels are integer ids
+of token_vocabulary and label_names.
+
+The column files of a filter are in a columns-* directory, manifest.json
+names it, holds the row counts and the data version they are synced to.
+A refresh appends the fetched sentences to the column files as a new
+segment, then writes the manifest, so it costs the fetched sentences only,
+and a load is one memory map per column whatever the number of segments.
+Readers of an older manifest only map the rows it counts, which appends
+don't change. After deletes, sentences written before the last cached _id,
+or max_segments appends, the cache is rewritten into a new directory, part
+by part. The vocabularies only grow, so the ids of the cached sentences
+stay valid."""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+DATAFRAME_COLUMNS = ["Sentence #", "token", "labels"]
+# column: (dtype, shape of a row)
+COLUMN_TYPES = {
+    "sentence_ids": (np.uint8, (12,)),
+    "sentence_offsets": (np.int64, ()),
+    "token_ids": (np.int32, ()),
+    "label_offsets": (np.int64, ()),
+    "label_ids": (np.int32, ()),
+}
+VOCABULARY_COLUMNS = ["token_vocabulary", "label_names"]
+BITMASK_CHUNK_SIZE = 65536 # tokens per bool mask packed into the label bitmask
+
+
+class TrainingData:
+    def __init__(self, sentence_ids, sentence_offsets, token_ids, label_offsets,
+                 label_ids, token_vocabulary, label_names):
+        self.sentence_ids = sentence_ids # uint8 (sentences, 12), ObjectId bytes
+        self.sentence_offsets = sentence_offsets
+        self.token_ids = token_ids
+        self.label_offsets = label_offsets
+        self.label_ids = label_ids
+        self.token_vocabulary = token_vocabulary
+        self.label_names = label_names
+        self.label_bitmask = None
+        self.sorted_sentence_ids = None
+        # {(filter key, data version): sentence indexes}, see NER.get_target_data_by_filter
+        self.filter_indexes = {}
+
+    def __len__(self):
+        return len(self.sentence_ids)
+
+    def get_sentence_id_bytes(self):
+        ids = np.ascontiguousarray(self.sentence_ids).tobytes()
+        return [ids[i:i + 12] for i in range(0, len(ids), 12)]
+
+    def get_sentence_id_strings(self):
+        """str(ObjectId) of every sentence, the hex of its 12 bytes."""
+        ids = np.ascontiguousarray(self.sentence_ids).tobytes().hex()
+        return [ids[i:i + 24] for i in range(0, len(ids), 24)]
+
+    def to_dataframe(self):
+        """The "Sentence #", "token", "labels" frame, one row per token."""
+        sentence_lengths = np.diff(self.sentence_offsets)
+        labels = self.label_names[self.label_ids].tolist()
+        label_offsets = self.label_offsets.tolist()
+        return pd.DataFrame({
+            "Sentence #": np.repeat(np.array(self.get_sentence_id_strings(), dtype=object), sentence_lengths),
+            "token": self.token_vocabulary[self.token_ids].astype(object),
+            "labels": [labels[start:end] for start, end in zip(label_offsets[:-1], label_offsets[1:])],
+        }, columns = DATAFRAME_COLUMNS)
+
+    def get_sentence_indexes(self, sentence_ids):
+        """Sorted int64 indexes of the sentences of sentence_ids (ObjectId bytes),
+        ids not in this data are skipped. Binary search over the sorted ids."""
+        if self.sorted_sentence_ids is None:
+            ids = np.ascontiguousarray(self.sentence_ids).view("S12").ravel()
+            order = np.argsort(ids, kind="stable")
+            self.sorted_sentence_ids = (ids[order], order)
+        sorted_ids, order = self.sorted_sentence_ids
+        if len(sorted_ids) == 0:
+            return np.array([], dtype=np.int64)
+        wanted = np.frombuffer(b"".join(sentence_ids), dtype="S12")
+        positions = np.minimum(np.searchsorted(sorted_ids, wanted), len(sorted_ids) - 1)
+        found = sorted_ids[positions] == wanted
+        return np.sort(order[positions[found]])
+
+    def get_label_bitmask(self):
+        """Token x label membership, bit-packed: uint8 (tokens, ceil(labels / 8)),
+        bit i of a row (numpy.packbits order) is set if the token has label_names[i].
+        Built once per TrainingData."""
+        if self.label_bitmask is None:
+            width = max((len(self.label_names) + 7) // 8, 1)
+            label_counts = np.diff(self.label_offsets)
+            bitmask = np.empty((len(self.token_ids), width), dtype=np.uint8)
+            for start in range(0, len(self.token_ids), BITMASK_CHUNK_SIZE):
+                end = min(start + BITMASK_CHUNK_SIZE, len(self.token_ids))
+                mask = np.zeros((end - start, width * 8), dtype=bool)
+                rows = np.repeat(np.arange(end - start), label_counts[start:end])
+                mask[rows, self.label_ids[self.label_offsets[start]:self.label_offsets[end]]] = True
+                bitmask[start:end] = np.packbits(mask, axis=1)
+            self.label_bitmask = bitmask
+        return self.label_bitmask
+
+    def get_label_mask(self, labels):
+        """Bool per token, True if the token has any of labels."""
+        label_bits = np.zeros(self.get_label_bitmask().shape[1] * 8, dtype=bool)
+        label_bits[np.flatnonzero(np.isin(self.label_names, list(labels)))] = True
+        return (self.get_label_bitmask() & np.packbits(label_bits)).any(axis=1)
+
+    def take(self, sentence_indexes):
+        """TrainingData of the sentences at sentence_indexes,
+        with the rows of the label bitmask if it is built."""
+        sentence_indexes = np.asarray(sentence_indexes, dtype=np.int64)
+        tokens, sentence_offsets = gather_ranges(self.sentence_offsets, sentence_indexes)
+        labels, label_offsets = gather_ranges(self.label_offsets, tokens)
+        data = TrainingData(
+            sentence_ids = self.sentence_ids[sentence_indexes],
+            sentence_offsets = sentence_offsets,
+            token_ids = self.token_ids[tokens],
+            label_offsets = label_offsets,
+            label_ids = self.label_ids[labels],
+            token_vocabulary = self.token_vocabulary,
+            label_names = self.label_names,
+        )
+        if self.label_bitmask is not None:
+            data.label_bitmask = self.label_bitmask[tokens]
+        return data
+
+
+class TrainingDataBuilder:
+    """Collect sentence documents ({"_id", "token_and_labels"}) into a TrainingData.
+    Start from the vocabularies of a cache to keep its ids."""
+    def __init__(self, label_names = (), token_vocabulary = ()):
+        self.label_positions = {label: i for i, label in enumerate(label_names)}
+        self.token_positions = {token: i for i, token in enumerate(token_vocabulary)}
+        self.sentence_ids = []
+        self.sentence_lengths = []
+        self.token_ids = []
+        self.label_counts = []
+        self.label_ids = []
+
+    def add(self, sentence):
+        self.sentence_ids.append(sentence["_id"].binary)
+        self.sentence_lengths.append(len(sentence["token_and_labels"]))
+        for token in sentence["token_and_labels"]:
+            self.token_ids.append(self.token_positions.setdefault(token["token"], len(self.token_positions)))
+            self.label_counts.append(len(token["labels"]))
+            for label in token["labels"]:
+                self.label_ids.append(self.label_positions.setdefault(label, len(self.label_positions)))
+
+    def flush(self):
+        """build() the sentences added so far and start over,
+        keeping the vocabularies so the ids stay the same."""
+        data = self.build()
+        self.sentence_ids = []
+        self.sentence_lengths = []
+        self.token_ids = []
+        self.label_counts = []
+        self.label_ids = []
+        return data
+
+    def build(self):
+        return TrainingData(
+            sentence_ids = np.frombuffer(b"".join(self.sentence_ids), dtype=np.uint8).reshape(-1, 12),
+            sentence_offsets = get_offsets(self.sentence_lengths),
+            token_ids = np.array(self.token_ids, dtype=np.int32),
+            label_offsets = get_offsets(self.label_counts),
+            label_ids = np.array(self.label_ids, dtype=np.int32),
+            token_vocabulary = get_vocabulary_array(self.token_positions),
+            label_names = get_vocabulary_array(self.label_positions),
+        )
+
+
+def get_offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def gather_ranges(offsets, indexes):
+    """Positions of the ranges offsets[i]:offsets[i + 1] of every i in indexes,
+    in order, and the offsets of those ranges in the result."""
+    starts = offsets[:-1][indexes]
+    lengths = offsets[1:][indexes] - starts
+    new_offsets = get_offsets(lengths)
+    positions = np.arange(new_offsets[-1], dtype=np.int64)
+    positions += np.repeat(starts - new_offsets[:-1], lengths)
+    return positions, new_offsets
+
+
+def get_vocabulary_array(positions):
+    # dict keeps the insertion order, which is the position order.
+    return np.array(list(positions), dtype=str) if positions else np.array([], dtype="<U1")
+
+
+def save_columns(path, data, columns):
+    for column in columns:
+        tmp_file = os.path.join(path, f".{column}.npy.tmp")
+        with open(tmp_file, "wb") as file:
+            np.save(file, np.asarray(getattr(data, column)))
+        os.replace(tmp_file, os.path.join(path, f"{column}.npy"))
+
+
+def get_row_counts(counts):
+    """Rows of every column file holding the (sentences, tokens, label ids) counts."""
+    sentence_count, token_count, label_id_count = counts
+    return {
+        "sentence_ids": sentence_count,
+        "sentence_offsets": sentence_count + 1,
+        "token_ids": token_count,
+        "label_offsets": token_count + 1,
+        "label_ids": label_id_count,
+    }
+
+
+def create_column_files(path):
+    """Column files of no sentence, the offsets start at 0."""
+    for column, (dtype, _) in COLUMN_TYPES.items():
+        with open(os.path.join(path, f"{column}.bin"), "wb") as file:
+            if column.endswith("_offsets"):
+                file.write(np.zeros(1, dtype=dtype).tobytes())
+
+
+def append_column_files(path, counts, data):
+    """Append the rows of data to the column files of path, which hold
+    counts = (sentences, tokens, label ids). Rows after them are left by a
+    failed write, they are cut. Return the new counts."""
+    sentence_count, token_count, label_id_count = counts
+    shifts = {"sentence_offsets": token_count, "label_offsets": label_id_count}
+    for column, rows in get_row_counts(counts).items():
+        dtype, shape = COLUMN_TYPES[column]
+        values = getattr(data, column)
+        if column in shifts:
+            values = values[1:] + shifts[column]
+        with open(os.path.join(path, f"{column}.bin"), "r+b") as file:
+            file.truncate(rows * np.dtype(dtype).itemsize * int(np.prod(shape)))
+            file.seek(0, os.SEEK_END)
+            file.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+    return sentence_count + len(data), token_count + len(data.token_ids), label_id_count + len(data.label_ids)
+
+
+def load_column_files(path, counts):
+    columns = {}
+    for column, rows in get_row_counts(counts).items():
+        dtype, shape = COLUMN_TYPES[column]
+        if rows == 0:
+            # An empty file can't be memory-mapped.
+            columns[column] = np.zeros((0,) + shape, dtype=dtype)
+        else:
+            columns[column] = np.memmap(os.path.join(path, f"{column}.bin"), dtype=dtype,
+                                        mode="r", shape=(rows,) + shape)
+    return columns
+
+
+def load_columns(path, columns):
+    return {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+            for column in columns}
+
+
+def get_cache_key(train_data_search_filter):
+    return hashlib.sha1(json.dumps(train_data_search_filter, sort_keys=True, default=str)
+                        .encode("utf-8")).hexdigest()[:16]
+
+
+class TrainingDataCache:
+    """The training data of a filter, in cache_dir/<filter key>.
+    Hold lock() from reading the manifest to writing the cache."""
+    def __init__(self, cache_dir, train_data_search_filter, max_segments = 64):
+        self.path = os.path.join(cache_dir, get_cache_key(train_data_search_filter))
+        self.max_segments = max_segments
+        os.makedirs(self.path, exist_ok=True)
+
+    @contextlib.contextmanager
+    def lock(self):
+        with open(os.path.join(self.path, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_manifest(self):
+        """{"columns", "segments", "version", "last_id", "sentence_count",
+        "token_count", "label_id_count"}, None if there is no cache.
+        segments is the sentence count of every append."""
+        try:
+            with open(os.path.join(self.path, "manifest.json")) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, manifest):
+        """The TrainingData of manifest, memory-mapped."""
+        return TrainingData(**load_column_files(os.path.join(self.path, manifest["columns"]),
+                                                get_counts(manifest)),
+                            **load_columns(self.path, VOCABULARY_COLUMNS))
+
+    def can_append(self, manifest):
+        return len(manifest["segments"]) < self.max_segments
+
+    def write(self, datas, version):
+        """Write datas, one after the other, as a new cache of one segment.
+        datas can be a generator, each TrainingData is written as it comes.
+        They share growing vocabularies, the last has the largest.
+        Return the new manifest."""
+        columns = tempfile.mkdtemp(dir=self.path, prefix="columns-")
+        create_column_files(columns)
+        manifest = {"columns": os.path.basename(columns), "segments": [], "last_id": None,
+                    "sentence_count": 0, "token_count": 0, "label_id_count": 0}
+        return self.append(manifest, datas, version)
+
+    def append(self, manifest, datas, version):
+        """Append datas to the column files of manifest as a new segment,
+        like write. Return the new manifest."""
+        columns = os.path.join(self.path, manifest["columns"])
+        counts = get_counts(manifest)
+        last_id = bytes.fromhex(manifest["last_id"]) if manifest["last_id"] else None
+        data = None
+        for data in datas:
+            ids = data.get_sentence_id_bytes()
+            if last_id is not None:
+                ids.append(last_id)
+            last_id = max(ids, default=None)
+            counts = append_column_files(columns, counts, data)
+        if data is not None:
+            # Before the manifest: readers of the old manifest get a superset.
+            save_columns(self.path, data, VOCABULARY_COLUMNS)
+
+        new_manifest = {
+            "columns": manifest["columns"],
+            "segments": manifest["segments"] + [counts[0] - manifest["sentence_count"]],
+            "version": version,
+            "last_id": last_id.hex() if last_id is not None else None,
+            "sentence_count": counts[0],
+            "token_count": counts[1],
+            "label_id_count": counts[2],
+        }
+        tmp_file = os.path.join(self.path, ".manifest.json.tmp")
+        with open(tmp_file, "w") as file:
+            json.dump(new_manifest, file)
+        os.replace(tmp_file, os.path.join(self.path, "manifest.json"))
+        self.remove_unused_columns(new_manifest["columns"])
+        return new_manifest
+
+    def remove_unused_columns(self, columns):
+        """Processes still reading removed column files keep their memory map."""
+        for name in os.listdir(self.path):
+            if name.startswith("columns-") and name != columns:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+
+def get_counts(manifest):
+    return manifest["sentence_count"], manifest["token_count"], manifest["label_id_count"]
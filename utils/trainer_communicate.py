@@ -6,20 +6,23 @@ from core.config import (
     NER_ADAPTERS_TRAINER_NAME,
 )
 from datetime import datetime
-async def asyncio_update_db_last_modify_time(collection_name):
+async def asyncio_update_db_last_modify_time(collection_name, deleted = False):
+    """deleted: documents were deleted, also set last_delete_time."""
     client = await get_database()
     col = client[DATABASE_NAME][CONFIG_COLLECTION]
+    now_time = datetime.now()
+    modify_times = {"last_update_time": now_time}
+    if deleted:
+        modify_times["last_delete_time"] = now_time
     result = await col.update_one({
         "collection_name": collection_name
     }, {
-        "$set": {
-            "last_update_time": datetime.now()
-        }
+        "$set": modify_times
     })
     if result.modified_count == 0:
         insert_result = await col.insert_one({
             "collection_name": collection_name,
-            "last_update_time": datetime.now()
+            **modify_times
         })
     return True
 
@@ -6,19 +6,22 @@ from core.config import (
 from pymongo import MongoClient
 from datetime import datetime
 
-def update_db_last_modify_time(collection_name):
+def update_db_last_modify_time(collection_name, deleted = False):
+    """deleted: documents were deleted, also set last_delete_time."""
     client = MongoClient(MONGODB_URL)
     col = client[DATABASE_NAME][CONFIG_COLLECTION]
+    now_time = datetime.now()
+    modify_times = {"last_update_time": now_time}
+    if deleted:
+        modify_times["last_delete_time"] = now_time
     result = col.update_one({
         "collection_name": collection_name
     }, {
-        "$set": {
-            "last_update_time": datetime.now()
-        }
+        "$set": modify_times
     })
     if result.modified_count == 0:
         insert_result = col.insert_one({
             "collection_name": collection_name,
-            "last_update_time": datetime.now()
+            **modify_times
         })
     return True
\ No newline at end of file